@@ -0,0 +1,143 @@
+"""
+冪等キー（Idempotency-Key）による二重実行の防止
+
+クライアントの再送や二重送信で同じ購入処理が二度実行されないように、
+リクエストに付けられた冪等キーごとに最初の結果を保存し、同じキーのリクエストには保存した結果を返す。
+
+    - キーは Idempotency-Key ヘッダー、またはフォームの idempotency_key で受け取る（なければ通常どおり実行）
+    - キーは利用者・処理ごとに区別し、IDEMPOTENCY_KEY_TTL 秒保存する
+    - 処理中に同じキーのリクエストが来た場合は実行せず、最初のリクエストの完了を待って同じ結果を返す
+      （IDEMPOTENCY_WAIT_SECONDS 待っても終わらない場合は409）
+    - 同じキーで内容の異なるリクエストは422
+    - 5xxの結果と例外は保存しない（再送で再実行できる）
+
+状態はDjangoのキャッシュに保存する。複数ノードで運用する場合はRedisなどの共有キャッシュを設定すること。
+"""
+import hashlib
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.http.request import RawPostDataException
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+MAX_KEY_LENGTH = 255
+
+# 処理中の印の保存期間（秒）。処理が異常終了した場合もこの時間が過ぎれば再実行できる
+PROCESSING_TTL = 60
+
+# 保存する応答ヘッダー
+STORED_HEADERS = ('Content-Type', 'Location')
+
+PROCESSING = 'processing'
+COMPLETED = 'completed'
+
+
+def get_idempotency_key(request):
+    """リクエストの冪等キーを取得する（ヘッダー → フォームの順）"""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key and request.content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        key = request.POST.get(IDEMPOTENCY_FIELD)
+    return key or None
+
+
+def _cache_key(scope, user_id, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'idempotency:{scope}:{user_id}:{digest}'
+
+
+def _fingerprint(request):
+    """リクエスト内容の指紋（同じキーで内容が異なる再送を検出する）"""
+    digest = hashlib.sha256(request.method.encode())
+    digest.update(request.get_full_path().encode())
+    try:
+        digest.update(request.body)
+    except RawPostDataException:
+        # multipart（CSRF検証で本文を読み込み済み）の場合はフォームの値から計算する
+        digest.update(repr(sorted(request.POST.lists())).encode())
+    return digest.hexdigest()
+
+
+def _store_response(response):
+    return {
+        'status': response.status_code,
+        'content': response.content,
+        'headers': {name: response[name] for name in STORED_HEADERS if response.has_header(name)},
+    }
+
+
+def _replay_response(stored):
+    response = HttpResponse(stored['content'], status=stored['status'])
+    for name, value in stored['headers'].items():
+        response[name] = value
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _wait_for_completion(cache_key):
+    """処理中のリクエストの完了を待つ（待ち時間を過ぎた場合は処理中の記録を返す）"""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    interval = 0.05
+    while True:
+        record = cache.get(cache_key)
+        if record is None or record['state'] == COMPLETED or time.monotonic() >= deadline:
+            return record
+        time.sleep(interval)
+        interval = min(interval * 2, 0.5)
+
+
+def idempotent(scope):
+    """
+    冪等キーに対応するビューのデコレーター
+
+    クラスベースビューでは method_decorator(idempotent('checkout')) として post に付ける。
+
+    Args:
+        scope: 処理の名前（同じキーでも処理が異なれば別のリクエストとして扱う）
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            key = get_idempotency_key(request)
+            if key is None or not request.user.is_authenticated:
+                return view_func(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return JsonResponse({'error': f'{IDEMPOTENCY_HEADER} が長すぎます'}, status=400)
+
+            cache_key = _cache_key(scope, request.user.pk, key)
+            fingerprint = _fingerprint(request)
+
+            while not cache.add(cache_key, {'state': PROCESSING, 'fingerprint': fingerprint}, PROCESSING_TTL):
+                record = _wait_for_completion(cache_key)
+                if record is None:
+                    # 最初のリクエストが結果を残さずに終わった（5xx・例外・期限切れ）ので実行し直す
+                    continue
+                if record['fingerprint'] != fingerprint:
+                    return JsonResponse({'error': '同じ冪等キーで内容の異なるリクエストが送信されました'}, status=422)
+                if record['state'] == COMPLETED:
+                    return _replay_response(record['response'])
+                response = JsonResponse({'error': '同じリクエストを処理中です。しばらくしてから再度お試しください'}, status=409)
+                response['Retry-After'] = str(settings.IDEMPOTENCY_WAIT_SECONDS)
+                return response
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except Exception:
+                cache.delete(cache_key)
+                raise
+            if response.status_code >= 500 or response.streaming:
+                cache.delete(cache_key)
+            else:
+                cache.set(cache_key, {
+                    'state': COMPLETED,
+                    'fingerprint': fingerprint,
+                    'response': _store_response(response),
+                }, settings.IDEMPOTENCY_KEY_TTL)
+            return response
+        return wrapped
+    return decorator
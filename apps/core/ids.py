@@ -0,0 +1,160 @@
+"""
+時刻順の識別子の生成（注文番号・チケット番号）
+
+ランダムな識別子（uuid4）は一意インデックスのB-treeのあちこちに挿入されるため、
+件数が増えるとページ分割とキャッシュミスが増えて登録が遅くなる。
+ここで生成する識別子は先頭が時刻のため、新しい識別子は常にインデックスの末尾に追加される。
+
+構成（70ビット、Crockford Base32で14文字）:
+    - 42ビット: ID_EPOCH からのミリ秒（約139年分）
+    - 16ビット: ノード（プロセスごとに割り当てる。fork後の子プロセスでは割り当て直す）
+    - 12ビット: 同じミリ秒内の連番
+
+ノードは最初に識別子を生成するときに IdNode の行を1つ追加し、そのIDの下位16ビットを使う。
+行は呼び出し元のトランザクションとは別の接続で追加してすぐにコミットする（呼び出し元がロールバックしても
+ノードの行は残り、呼び出し元のトランザクションの中で書き込まない）。
+IDはDBの連番（トランザクションがロールバックしても再利用されない）のため、同時に動いている
+プロセスのノードは、プロセスの起動が65536回を超えて一巡しない限り重ならない。
+同じプロセス内では単調増加する（時計が戻った場合や連番を使い切った場合は直前の時刻を引き継ぐ）ため、
+ワーカーをまたいでも識別子は重複しない。
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+
+# Crockford Base32（I, L, O, U を除く。大文字・数字のみで読み間違えにくい）
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ID_LENGTH = 14
+
+ID_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+_EPOCH_MS = int(ID_EPOCH.timestamp() * 1000)
+
+TIMESTAMP_BITS = 42
+NODE_BITS = 16
+SEQUENCE_BITS = 12
+
+_MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+def allocate_node():
+    """
+    プロセスのノードを割り当てる
+
+    呼び出し元のトランザクションに含めないよう、新しい接続（自動コミット）で IdNode の行を追加する。
+    SQLite（開発・テスト用）は他の接続が書き込み中のトランザクションを持っていると書き込めないため、
+    呼び出し元と同じ接続で追加する。
+
+    Returns:
+        int: ノード（IdNode のIDの下位 NODE_BITS ビット）
+    """
+    from django.db import DEFAULT_DB_ALIAS, connections
+    from django.utils import timezone
+    from apps.core.models import IdNode
+
+    if connections[DEFAULT_DB_ALIAS].vendor == 'sqlite':
+        node = IdNode.objects.create(host=socket.gethostname()[:255], pid=os.getpid())
+        return node.pk & ((1 << NODE_BITS) - 1)
+
+    connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {connection.ops.quote_name(IdNode._meta.db_table)} (host, pid, allocated_at) '
+                'VALUES (%s, %s, %s) RETURNING id',
+                [socket.gethostname()[:255], os.getpid(), timezone.now()],
+            )
+            node_id = cursor.fetchone()[0]
+    finally:
+        connection.close()
+    return node_id & ((1 << NODE_BITS) - 1)
+
+
+class IdGenerator:
+    """時刻順の識別子の生成器（スレッドセーフ）"""
+
+    def __init__(self, node=None):
+        self._fixed_node = node
+        self._reset()
+
+    def _reset(self):
+        # fork時に他のスレッドが保持していたロックを引き継がないよう作り直す
+        self._lock = threading.Lock()
+        # 指定がない場合は最初に生成するときに割り当てる
+        self.node = self._fixed_node
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_int(self):
+        """次の識別子を整数で取得する"""
+        node = self.node
+        if node is None:
+            # DBの往復中に他のスレッドを待たせないよう、ロックの外で割り当てる（競合した場合は先に設定した方を使う）
+            node = allocate_node()
+        with self._lock:
+            if self.node is None:
+                self.node = node
+            now_ms = int(time.time() * 1000) - _EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # 同じミリ秒（または時計が戻った）場合は連番を進め、使い切ったら次のミリ秒を先取りする
+                self._sequence += 1
+                if self._sequence > _MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (
+                (self._last_ms << (NODE_BITS + SEQUENCE_BITS))
+                | (self.node << SEQUENCE_BITS)
+                | self._sequence
+            )
+
+    def next(self, prefix=''):
+        """次の識別子を文字列で取得する"""
+        return f'{prefix}{encode(self.next_int())}'
+
+
+def encode(value, length=ID_LENGTH):
+    """整数を固定長のCrockford Base32にする（文字列の順序と数値の順序が一致する）"""
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 32)
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+
+def decode(text):
+    """Crockford Base32の文字列を整数に戻す"""
+    value = 0
+    for char in text.upper():
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+
+def id_datetime(identifier, prefix=''):
+    """識別子に含まれる生成日時を取得する"""
+    value = decode(identifier[len(prefix):])
+    return ID_EPOCH + timedelta(milliseconds=value >> (NODE_BITS + SEQUENCE_BITS))
+
+
+_generator = IdGenerator()
+
+# fork（gunicorn・Celeryのワーカー）後の子プロセスでは親とノードが重ならないよう割り当て直す
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_generator._reset)
+
+
+def generate_id(prefix=''):
+    """
+    時刻順の識別子を生成する
+
+    Args:
+        prefix: 先頭に付ける文字列（'ORD' など）
+
+    Returns:
+        str: prefix + 14文字
+    """
+    return _generator.next(prefix)
@@ -0,0 +1,75 @@
+"""ランダムな識別子と時刻順の識別子の登録速度を比較するコマンド"""
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from apps.core.ids import IdGenerator
+
+
+TABLE_NAME = 'id_benchmark'
+
+
+def random_ticket_number():
+    """従来のチケット番号（uuid4の一部）"""
+    return f"TK{uuid.uuid4().hex[:14].upper()}"
+
+
+class Command(BaseCommand):
+    help = 'ランダムな識別子（uuid4）と時刻順の識別子で、一意インデックス付きの列への登録速度を比較します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000, help='登録件数')
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回のINSERTの件数')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        batch_size = options['batch_size']
+        generator = IdGenerator()
+
+        results = {}
+        for label, make_id in [('uuid4', random_ticket_number), ('時刻順', lambda: generator.next('TK'))]:
+            results[label] = self.run(make_id, rows, batch_size)
+            total, tail, index_size = results[label]
+            message = f'{label}: 全体 {total:,.0f}件/秒 / 最後の10% {tail:,.0f}件/秒'
+            if index_size is not None:
+                message += f' / インデックス {index_size / 1024 / 1024:.1f}MB'
+            self.stdout.write(message)
+
+        ratio = results['時刻順'][0] / results['uuid4'][0]
+        self.stdout.write(self.style.SUCCESS(f'時刻順 / uuid4: {ratio:.2f}倍'))
+
+    def run(self, make_id, rows, batch_size):
+        """
+        一意インデックス付きの一時テーブルに登録する
+
+        Returns:
+            tuple: (全体の件数/秒, 最後の10%の件数/秒, インデックスサイズ（PostgreSQLのみ）)
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMPORARY TABLE {TABLE_NAME} (ticket_number varchar(16) NOT NULL UNIQUE)')
+            try:
+                # バッチごとの所要時間（最後の10%はインデックスが大きくなった後の登録速度）
+                timings = []
+                inserted = 0
+                while inserted < rows:
+                    count = min(batch_size, rows - inserted)
+                    values = [(make_id(),) for _ in range(count)]
+                    batch_started = time.perf_counter()
+                    with transaction.atomic():
+                        cursor.executemany(f'INSERT INTO {TABLE_NAME} (ticket_number) VALUES (%s)', values)
+                    timings.append((count, time.perf_counter() - batch_started))
+                    inserted += count
+
+                index_size = None
+                if connection.vendor == 'postgresql':
+                    cursor.execute(f"SELECT pg_indexes_size('{TABLE_NAME}')")
+                    index_size = cursor.fetchone()[0]
+            finally:
+                cursor.execute(f'DROP TABLE {TABLE_NAME}')
+
+        tail = timings[-max(len(timings) // 10, 1):]
+        return (
+            rows / sum(elapsed for count, elapsed in timings),
+            sum(count for count, elapsed in tail) / sum(elapsed for count, elapsed in tail),
+            index_size,
+        )
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-18 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdNode',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('host', models.CharField(max_length=255, verbose_name='ホスト名')),
+                ('pid', models.IntegerField(verbose_name='プロセスID')),
+                ('allocated_at', models.DateTimeField(auto_now_add=True, verbose_name='割り当て日時')),
+            ],
+            options={
+                'verbose_name': '識別子ノード',
+                'verbose_name_plural': '識別子ノード',
+                'db_table': 'id_nodes',
+            },
+        ),
+    ]
@@ -1,3 +1,18 @@
 from django.db import models
 
-# Create your models here.
+
+class IdNode(models.Model):
+    """識別子のノードの割り当て（識別子を生成するプロセスごとに1行。IDをノードに使う）"""
+    
+    id = models.BigAutoField(primary_key=True)
+    host = models.CharField('ホスト名', max_length=255)
+    pid = models.IntegerField('プロセスID')
+    allocated_at = models.DateTimeField('割り当て日時', auto_now_add=True)
+    
+    class Meta:
+        db_table = 'id_nodes'
+        verbose_name = '識別子ノード'
+        verbose_name_plural = '識別子ノード'
+    
+    def __str__(self):
+        return f"{self.pk} ({self.host}:{self.pid})"
@@ -0,0 +1,226 @@
+"""
+キーセット（シーク）ページネーション
+
+OFFSET方式はページが深くなるほど読み飛ばす行が増え、DjangoのPaginatorは毎回COUNT(*)を実行する。
+キーセット方式は直前のページの最後（最初）の行の並び順の値をカーソルにして
+「その値より後（前）」を条件に取得するため、どのページも先頭ページと同じコストで取得できる。
+
+    - 並び順は一意になるように指定する（最後に 'id' / '-id' を加えるなど）
+    - 並び順の列はNULLを含まないこと
+    - カーソルは署名付きの不透明な文字列で、改ざんされた場合は先頭ページを返す
+    - 件数は表示しない（None）・概算（'approximate'）・正確（'exact'）から選ぶ
+"""
+import json
+from django.core import signing
+from django.db import connection
+from django.db.models import Q
+
+
+CURSOR_SALT = 'core.pagination'
+
+# 概算件数がこれより少ない場合は正確な件数を数える（小さな結果は推定の誤差が大きいため）
+APPROXIMATE_COUNT_THRESHOLD = 10000
+
+
+def approximate_count(queryset):
+    """
+    件数の概算を取得する
+
+    PostgreSQLでは実行計画の推定行数を使うため、テーブル全体を数えない。
+    推定行数が少ない場合とPostgreSQL以外のDBでは正確な件数を数える。
+
+    Returns:
+        tuple: (件数, 概算かどうか)
+    """
+    if connection.vendor == 'postgresql':
+        plan = queryset.order_by().explain(format='json')
+        estimate = _plan_rows(plan)
+        if estimate is not None and estimate >= APPROXIMATE_COUNT_THRESHOLD:
+            return estimate, True
+    return queryset.count(), False
+
+
+def _plan_rows(plan):
+    """EXPLAIN (FORMAT JSON) の結果から推定行数を取り出す"""
+    try:
+        return int(json.loads(plan)[0]['Plan']['Plan Rows'])
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+class KeysetPage:
+    """キーセットページネーションの1ページ"""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor,
+                 count=None, count_is_approximate=False):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+        self.count_is_approximate = count_is_approximate
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    キーセットページネーター
+
+    Args:
+        queryset: 対象のQuerySet
+        ordering: 並び順（例: ['-start_datetime', '-id']、一意になること）
+        per_page: 1ページの件数
+        count: 件数の取得方法（None / 'approximate' / 'exact'）
+    """
+
+    def __init__(self, queryset, ordering, per_page, count=None):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+        self.count_mode = count
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def encode_cursor(self, obj, direction):
+        values = [_cursor_value(_get_value(obj, field)) for field in self.fields]
+        return signing.dumps([direction, values], salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, cursor):
+        """
+        カーソルを復元する
+
+        Returns:
+            tuple: (方向 'next' / 'prev', 値のリスト)（不正な場合は (None, None)）
+        """
+        if not cursor:
+            return None, None
+        try:
+            direction, values = signing.loads(cursor, salt=CURSOR_SALT)
+        except (signing.BadSignature, ValueError, TypeError):
+            return None, None
+        if direction not in ('next', 'prev') or len(values) != len(self.fields):
+            return None, None
+        return direction, values
+
+    def _seek_filter(self, values, backward):
+        """カーソルの値より後（backward=Trueの場合は前）の行を取り出す条件"""
+        condition = Q()
+        equal = Q()
+        for field, ordering, value in zip(self.fields, self.ordering, values):
+            descending = ordering.startswith('-') != backward
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def page(self, cursor=None):
+        """
+        カーソルが指すページを取得する
+
+        Args:
+            cursor: カーソル（Noneまたは不正な場合は先頭ページ）
+
+        Returns:
+            KeysetPage
+        """
+        direction, values = self.decode_cursor(cursor)
+        backward = direction == 'prev'
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek_filter(values, backward))
+        if backward:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+        else:
+            ordering = self.ordering
+
+        # 1件多く取得して次のページの有無を判定
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backward:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        count = None
+        count_is_approximate = False
+        if self.count_mode == 'approximate':
+            count, count_is_approximate = approximate_count(self.queryset)
+        elif self.count_mode == 'exact':
+            count = self.queryset.count()
+
+        return KeysetPage(
+            rows,
+            has_next=has_next and bool(rows),
+            has_previous=has_previous and bool(rows),
+            next_cursor=self.encode_cursor(rows[-1], 'next') if rows else None,
+            previous_cursor=self.encode_cursor(rows[0], 'prev') if rows else None,
+            count=count,
+            count_is_approximate=count_is_approximate,
+        )
+
+
+def _get_value(obj, field):
+    """'order__created_at' のような関連先のフィールドもたどって値を取得"""
+    for name in field.split('__'):
+        obj = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+    return obj
+
+
+def _cursor_value(value):
+    """カーソルに入れる値（JSONにできない値は文字列にする）"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def paginate_keyset(request, queryset, ordering, per_page, count=None, cursor_param='cursor'):
+    """
+    リクエストのカーソルに対応するページを取得する（関数ビュー用）
+
+    Args:
+        request: HttpRequest
+        queryset: 対象のQuerySet
+        ordering: 並び順（一意になること）
+        per_page: 1ページの件数
+        count: 件数の取得方法（None / 'approximate' / 'exact'）
+        cursor_param: カーソルのクエリパラメータ名
+
+    Returns:
+        KeysetPage
+    """
+    paginator = KeysetPaginator(queryset, ordering, per_page, count=count)
+    return paginator.page(request.GET.get(cursor_param))
+
+
+class KeysetPaginationMixin:
+    """
+    ListViewのページネーションをキーセット方式にするMixin
+
+    paginate_by と keyset_ordering を指定する。テンプレートでは page_obj.next_cursor /
+    page_obj.previous_cursor を ?cursor= に渡してページを移動する（ページ番号はない）。
+    """
+    keyset_ordering = None
+    keyset_count = None
+    cursor_param = 'cursor'
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, self.get_keyset_ordering(), page_size, count=self.keyset_count)
+        page = paginator.page(self.request.GET.get(self.cursor_param))
+        return paginator, page, page.object_list, page.has_other_pages()
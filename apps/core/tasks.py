@@ -0,0 +1,72 @@
+"""
+Celeryタスクの共通処理
+
+TimedTask を base に指定したタスクは、実行ごとに所要時間と結果（success・retry・failure）を
+ログに出力し、プロセス内の集計（get_task_metrics）に記録する。
+"""
+import logging
+import threading
+import time
+from celery import Task
+from celery.exceptions import Retry
+
+
+logger = logging.getLogger(__name__)
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def record_task_timing(name, state, elapsed_ms):
+    """タスクの実行結果と所要時間を集計する"""
+    with _metrics_lock:
+        metrics = _metrics.setdefault(name, {
+            'count': 0, 'success': 0, 'retry': 0, 'failure': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+        })
+        metrics['count'] += 1
+        metrics[state] += 1
+        metrics['total_ms'] += elapsed_ms
+        metrics['max_ms'] = max(metrics['max_ms'], elapsed_ms)
+
+
+def get_task_metrics():
+    """
+    タスクごとの集計を取得する（このプロセスで実行した分）
+
+    Returns:
+        dict: {タスク名: {'count', 'success', 'retry', 'failure', 'total_ms', 'max_ms', 'avg_ms'}}
+    """
+    with _metrics_lock:
+        return {
+            name: dict(metrics, avg_ms=round(metrics['total_ms'] / metrics['count'], 1))
+            for name, metrics in _metrics.items()
+        }
+
+
+def reset_task_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+
+class TimedTask(Task):
+    """所要時間を計測するタスクの基底クラス"""
+
+    def __call__(self, *args, **kwargs):
+        started = time.perf_counter()
+        state = 'success'
+        try:
+            # Task.__call__ は実行中のリクエスト（再試行回数など）を置き換えるため、run を直接呼ぶ
+            return self.run(*args, **kwargs)
+        except Retry:
+            state = 'retry'
+            raise
+        except Exception:
+            state = 'failure'
+            raise
+        finally:
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            record_task_timing(self.name, state, elapsed_ms)
+            logger.info(
+                'タスクを実行しました: task=%s state=%s elapsed_ms=%s retries=%s',
+                self.name, state, elapsed_ms, self.request.retries or 0
+            )
@@ -0,0 +1,13 @@
+"""冪等キー用テンプレートタグ"""
+import uuid
+from django import template
+from django.utils.html import format_html
+from apps.core.idempotency import IDEMPOTENCY_FIELD
+
+register = template.Library()
+
+
+@register.simple_tag
+def idempotency_key_input():
+    """フォームの二重送信を防ぐ冪等キーのhidden入力（表示ごとに新しいキー）"""
+    return format_html('<input type="hidden" name="{}" value="{}">', IDEMPOTENCY_FIELD, uuid.uuid4().hex)
@@ -1,3 +1,244 @@
-from django.test import TestCase
+import threading
+import unittest
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse, JsonResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.core import ids
+from apps.core.idempotency import idempotent, REPLAYED_HEADER
+from apps.core.pagination import KeysetPaginator, paginate_keyset
+from apps.core.models import IdNode
+from apps.events.models import Venue
+
+User = get_user_model()
+
+
+class KeysetPaginatorTest(TestCase):
+    """キーセットページネーションのテスト"""
+
+    def setUp(self):
+        # 同じ名前を含めて並び順の同値をidで区別できることを確認する
+        for i in range(25):
+            Venue.objects.create(name=f'会場{i // 2:02d}', address='東京都', capacity=100)
+        self.expected = list(Venue.objects.order_by('name', 'id').values_list('id', flat=True))
+        self.paginator = KeysetPaginator(Venue.objects.all(), ['name', 'id'], 10)
+
+    def test_walks_forward_and_backward(self):
+        """次へ・前へでページをたどると全件が順に重複なく返る"""
+        pages = [self.paginator.page()]
+        while pages[-1].has_next:
+            pages.append(self.paginator.page(pages[-1].next_cursor))
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([venue.id for page in pages for venue in page], self.expected)
+        self.assertFalse(pages[0].has_previous)
+        self.assertTrue(pages[2].has_previous)
+
+        back = self.paginator.page(pages[2].previous_cursor)
+        self.assertEqual([venue.id for venue in back], self.expected[10:20])
+        self.assertTrue(back.has_previous)
+        self.assertTrue(back.has_next)
+
+        first = self.paginator.page(back.previous_cursor)
+        self.assertEqual([venue.id for venue in first], self.expected[:10])
+        self.assertFalse(first.has_previous)
+
+    def test_deep_page_does_not_count(self):
+        """件数を指定しない場合、どのページも1クエリで取得する"""
+        page = self.paginator.page()
+        page = self.paginator.page(page.next_cursor)
+        with self.assertNumQueries(1):
+            self.paginator.page(page.next_cursor)
+
+    def test_tampered_cursor_returns_first_page(self):
+        """改ざんされたカーソルは先頭ページとして扱う"""
+        cursor = self.paginator.page().next_cursor
+        page = self.paginator.page(cursor[:-2] + 'xx')
+        self.assertEqual([venue.id for venue in page], self.expected[:10])
+
+    def test_count_modes(self):
+        """件数は指定した場合のみ取得し、小さな結果は正確な件数になる"""
+        self.assertIsNone(self.paginator.page().count)
+        request = RequestFactory().get('/')
+        page = paginate_keyset(request, Venue.objects.all(), ['name', 'id'], 10, count='approximate')
+        self.assertEqual(page.count, 25)
+        self.assertFalse(page.count_is_approximate)
+
+    def test_list_view_uses_cursor(self):
+        """一覧画面はカーソルで次のページを表示する"""
+        user = User.objects.create_user(username='staff', password='testpass123')
+        self.client.force_login(user)
+        url = reverse('events:venue_list')
+
+        response = self.client.get(url)
+        self.assertTrue(response.context['is_paginated'])
+        next_cursor = response.context['page_obj'].next_cursor
+
+        response = self.client.get(url, {'cursor': next_cursor})
+        self.assertEqual([venue.id for venue in response.context['venues']], self.expected[20:25])
+
+
+class _User:
+    pk = 1
+    is_authenticated = True
+
+
+@override_settings(IDEMPOTENCY_WAIT_SECONDS=5)
+class IdempotencyTest(SimpleTestCase):
+    """冪等キーのテスト"""
+    
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.factory = RequestFactory()
+    
+    def request(self, view, key='key-1', body='{"seat_ids": [1]}'):
+        headers = {'Idempotency-Key': key} if key else {}
+        request = self.factory.post('/cart/add/', data=body, content_type='application/json', headers=headers)
+        request.user = _User()
+        return view(request)
+    
+    def counting_view(self, status=200):
+        @idempotent('test')
+        def view(request):
+            self.calls += 1
+            return JsonResponse({'call': self.calls}, status=status)
+        return view
+    
+    def test_duplicate_is_replayed(self):
+        """同じキーの再送は実行せずに最初の結果を返す"""
+        view = self.counting_view()
+        first = self.request(view)
+        second = self.request(view)
+        
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second[REPLAYED_HEADER], 'true')
+        self.assertEqual(self.request(view, key='key-2').status_code, 200)
+        self.assertEqual(self.request(view, key=None).status_code, 200)
+        self.assertEqual(self.calls, 3)
+    
+    def test_different_body_is_rejected(self):
+        """同じキーで内容の異なるリクエストは422"""
+        view = self.counting_view()
+        self.request(view)
+        self.assertEqual(self.request(view, body='{"seat_ids": [2]}').status_code, 422)
+        self.assertEqual(self.calls, 1)
+    
+    def test_server_error_is_not_stored(self):
+        """5xxの結果は保存せず、再送で再実行する"""
+        self.request(self.counting_view(status=500))
+        self.assertEqual(self.request(self.counting_view()).status_code, 200)
+        self.assertEqual(self.calls, 2)
+    
+    def test_in_flight_duplicate_joins_original(self):
+        """処理中の同じキーのリクエストは最初の完了を待って同じ結果を返す"""
+        started = threading.Event()
+        release = threading.Event()
+        
+        @idempotent('test')
+        def slow_view(request):
+            self.calls += 1
+            started.set()
+            release.wait(5)
+            return HttpResponse('done')
+        
+        responses = []
+        first = threading.Thread(target=lambda: responses.append(self.request(slow_view)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: responses.append(self.request(slow_view)))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+        
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([response.content for response in responses], [b'done', b'done'])
+        self.assertEqual(sum(response.has_header(REPLAYED_HEADER) for response in responses), 1)
+
+
+class IdGeneratorTest(TestCase):
+    """時刻順の識別子のテスト"""
+    
+    def test_ids_are_sorted_and_unique(self):
+        """生成順に文字列として昇順に並び、重複しない"""
+        generator = ids.IdGenerator()
+        values = [generator.next('TK') for _ in range(10000)]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(len(set(values)), len(values))
+        self.assertTrue(all(len(value) == 16 for value in values))
+        self.assertLess(abs((ids.id_datetime(values[0], 'TK') - timezone.now()).total_seconds()), 5)
+    
+    def test_monotonic_when_clock_stalls_or_goes_back(self):
+        """時計が止まった・戻った場合も単調増加し、連番を使い切ると次のミリ秒に進む"""
+        generator = ids.IdGenerator(node=1)
+        with mock.patch.object(ids.time, 'time', return_value=1_800_000_000.0):
+            values = [generator.next_int() for _ in range(ids._MAX_SEQUENCE + 10)]
+        with mock.patch.object(ids.time, 'time', return_value=1_799_999_999.0):
+            values.append(generator.next_int())
+        self.assertEqual(values, sorted(set(values)))
+    
+    def test_processes_get_distinct_nodes(self):
+        """ノードはプロセスごとにDBの連番から割り当て、fork後の子プロセスでは割り当て直す"""
+        allocated = IdNode.objects.count()
+        generators = [ids.IdGenerator() for _ in range(3)]
+        values = [generator.next_int() for generator in generators]
+        nodes = [generator.node for generator in generators]
+        self.assertEqual(len(set(nodes)), 3)
+        self.assertEqual(IdNode.objects.count(), allocated + 3)
+        self.assertEqual([(value >> ids.SEQUENCE_BITS) & 0xFFFF for value in values], nodes)
+        
+        generators[0]._reset()
+        generators[0].next_int()
+        self.assertNotIn(generators[0].node, nodes)
+    
+    def test_node_is_allocated_outside_generator_lock(self):
+        """ノードの割り当て（DBの往復）中は生成器のロックを保持しない"""
+        generator = ids.IdGenerator()
+        
+        def allocate_node():
+            self.assertFalse(generator._lock.locked())
+            return 7
+        
+        with mock.patch.object(ids, 'allocate_node', side_effect=allocate_node):
+            value = generator.next_int()
+        self.assertEqual((value >> ids.SEQUENCE_BITS) & 0xFFFF, 7)
+    
+    def test_call_sites_use_generator(self):
+        """チケット番号は列の長さに収まる"""
+        from apps.tickets.models import Ticket, TICKET_NUMBER_PREFIX
+        from apps.tickets.services.ticket_service import TicketQRService
+        
+        for ticket_number in (Ticket().generate_ticket_number(), TicketQRService.generate_ticket_number()):
+            self.assertTrue(ticket_number.startswith(TICKET_NUMBER_PREFIX))
+            self.assertLessEqual(len(ticket_number), Ticket._meta.get_field('ticket_number').max_length)
+    
+    def test_benchmark_command(self):
+        """ベンチマークのコマンドが両方式の結果を出力する"""
+        out = StringIO()
+        call_command('benchmark_ids', rows=200, batch_size=50, stdout=out)
+        self.assertIn('uuid4', out.getvalue())
+        self.assertIn('時刻順 / uuid4', out.getvalue())
+
+
+@unittest.skipIf(connection.vendor == 'sqlite', 'SQLiteでは呼び出し元と同じ接続でノードを割り当てる')
+class IdNodeAllocationTest(TransactionTestCase):
+    """識別子のノードの割り当てのテスト（別の接続でコミットするため、実際にコミットする）"""
+    
+    def test_node_survives_rolled_back_transaction(self):
+        """ノードの行は呼び出し元のトランザクションの外で追加し、ロールバックしても残る"""
+        generator = ids.IdGenerator()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            generator.next_int()
+            raise RuntimeError('ロールバック')
+        self.assertEqual(IdNode.objects.count(), 1)
+        self.assertEqual(IdNode.objects.get().pk & 0xFFFF, generator.node)
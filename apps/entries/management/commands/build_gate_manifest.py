@@ -0,0 +1,38 @@
+"""入場ゲートの端末に配布するマニフェストを作成するコマンド"""
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from apps.entries.manifest import signed_manifest
+from apps.events.models import Event
+
+
+class Command(BaseCommand):
+    help = 'イベントの署名付きマニフェスト（有効なチケット・キャンセルされたチケットの一覧）を作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int, help='イベントID')
+        parser.add_argument('--since', help='差分の起点（前回のマニフェストの cursor。未指定時は全件）')
+        parser.add_argument('--output', help='出力先のファイル（未指定時は標準出力）')
+
+    def handle(self, *args, **options):
+        if not Event.objects.filter(pk=options['event_id']).exists():
+            raise CommandError(f"イベント #{options['event_id']} が見つかりません")
+
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"日時の形式が不正です: {options['since']}")
+
+        result = signed_manifest(options['event_id'], since)
+        text = json.dumps(result, ensure_ascii=False)
+        if not options['output']:
+            self.stdout.write(text)
+            return
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            f.write(text)
+        manifest = result['manifest']
+        self.stderr.write(self.style.SUCCESS(
+            f"{options['output']} に出力しました（有効: {manifest['count']}枚 / cursor: {manifest['cursor']}）"
+        ))
@@ -0,0 +1,135 @@
+"""
+入場ゲートの端末に配布するマニフェスト（イベントごとの有効なチケットの一覧）
+
+開場時にすべての読み取りを中央のDBに問い合わせると、ゲートの処理速度がサーバーと回線に左右される。
+端末は開場前にマニフェストをダウンロードし、QRコードの署名付きペイロード（signing.py）から取り出した
+チケット番号をマニフェストと照合して入場を判定する。入場記録は後から /entries/sync/ に送る。
+
+形式（gate-manifest/2）:
+    {
+        'format': 'gate-manifest/2',
+        'event_id': イベントID,
+        'type': 'full'（全件）| 'delta'（since 以降の差分）,
+        'since': 差分の起点（全件の場合はNone）,
+        'cursor': 次の差分の since に指定する日時,
+        'count': tickets の件数,
+        'tickets': 入場できる（未使用の）チケットのハッシュ（8バイト）を昇順に連結したBase64,
+        'used': 入場済みのチケットのハッシュ（同上）,
+        'cancelled': キャンセルされたチケットのハッシュ（同上）,
+    }
+ハッシュはチケット番号のSHA-256の先頭8バイトで、端末は二分探索で照合する。
+配布時はサーバーの秘密鍵で署名し（Ed25519、sign_message）、鍵ID・署名を付ける。端末は配布された公開鍵
+（/entries/keys/）で検証し、改ざんされたマニフェストを使わない。端末に秘密鍵はないため、端末から
+マニフェストを偽造することもできない。
+
+差分は since 以降に更新されたチケット（追加販売・キャンセル・入場）を返す。他のゲートで入場した
+チケットは used に入るため、端末は差分を取得するたびに入場済みとして扱い、同じチケットでの再入場を拒否できる
+（差分の取得と取得の間に別のゲートで読み取ったチケットは、次の差分までは重複して入場できる）。
+コミットの遅れで取りこぼさないよう DELTA_OVERLAP_SECONDS だけさかのぼるため、端末は差分を冪等に適用すること。
+"""
+import base64
+import hashlib
+import json
+from datetime import timedelta
+from django.core.cache import cache
+from django.utils import timezone
+from apps.tickets.models import Ticket
+from apps.tickets.services.signing import SIGNATURE_ALGORITHM, sign_message
+
+
+MANIFEST_FORMAT = 'gate-manifest/2'
+TICKET_HASH_BYTES = 8
+
+# 差分の起点をさかのぼる秒数（起点の直前に更新され、後からコミットされたチケットを含める）
+DELTA_OVERLAP_SECONDS = 60
+# 全件のマニフェストをキャッシュする秒数（開場時に端末が一斉にダウンロードしても1回だけ作成する）
+FULL_MANIFEST_CACHE_SECONDS = 30
+FULL_MANIFEST_CACHE_KEY = 'gate_manifest:{event_id}'
+
+# DBから読み込む1回の件数
+ITERATOR_CHUNK_SIZE = 2000
+
+
+def ticket_hash(ticket_number):
+    """マニフェストで照合するチケットのハッシュ"""
+    return hashlib.sha256(ticket_number.encode()).digest()[:TICKET_HASH_BYTES]
+
+
+def _pack(hashes):
+    return base64.b64encode(b''.join(sorted(hashes))).decode()
+
+
+def unpack_hashes(value):
+    """マニフェストのハッシュの列をリストに戻す（昇順）"""
+    data = base64.b64decode(value)
+    return [data[i:i + TICKET_HASH_BYTES] for i in range(0, len(data), TICKET_HASH_BYTES)]
+
+
+def build_manifest(event_id, since=None, now=None):
+    """
+    マニフェストを作成する
+
+    チケットは行を順に読み込み（iterator）、ハッシュだけを保持するため、枚数が多くても
+    モデルのインスタンスを一度に作らない。
+
+    Args:
+        event_id: イベントID
+        since: 差分の起点（未指定時は全件）
+        now: 作成日時（テスト用）
+
+    Returns:
+        dict: マニフェスト
+    """
+    now = now or timezone.now()
+    tickets = Ticket.objects.filter(order__event_id=event_id)
+    if since is not None:
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        tickets = tickets.filter(updated_at__gte=since - timedelta(seconds=DELTA_OVERLAP_SECONDS))
+
+    hashes = {'valid': [], 'used': [], 'cancelled': []}
+    for ticket_number, status in tickets.values_list('ticket_number', 'status').iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        hashes[status].append(ticket_hash(ticket_number))
+
+    return {
+        'format': MANIFEST_FORMAT,
+        'event_id': event_id,
+        'type': 'full' if since is None else 'delta',
+        'since': since.isoformat() if since is not None else None,
+        'cursor': now.isoformat(),
+        'count': len(hashes['valid']),
+        'tickets': _pack(hashes['valid']),
+        'used': _pack(hashes['used']),
+        'cancelled': _pack(hashes['cancelled']),
+    }
+
+
+def canonical_json(manifest):
+    """署名の対象（キーを並べた区切り文字のないJSON）"""
+    return json.dumps(manifest, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def signed_manifest(event_id, since=None):
+    """
+    署名付きのマニフェストを作成する（全件はキャッシュする）
+
+    Args:
+        event_id: イベントID
+        since: 差分の起点（未指定時は全件）
+
+    Returns:
+        dict: {'manifest': マニフェスト, 'algorithm': 署名方式, 'key_id': 鍵ID, 'signature': 署名（Base64）}
+    """
+    cache_key = FULL_MANIFEST_CACHE_KEY.format(event_id=event_id)
+    if since is None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    manifest = build_manifest(event_id, since)
+    key_id, signature = sign_message(canonical_json(manifest))
+    result = {'manifest': manifest, 'algorithm': SIGNATURE_ALGORITHM, 'key_id': key_id, 'signature': signature}
+
+    if since is None:
+        cache.set(cache_key, result, FULL_MANIFEST_CACHE_SECONDS)
+    return result
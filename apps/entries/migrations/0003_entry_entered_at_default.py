@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entry',
+            name='entered_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='入場日時'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from apps.tickets.models import Ticket
 
 
@@ -22,7 +23,8 @@ class Entry(models.Model):
         verbose_name='スキャンスタッフ'
     )
     
-    entered_at = models.DateTimeField('入場日時', auto_now_add=True)
+    # オフラインの端末から後で送られた入場は読み取り日時を記録する
+    entered_at = models.DateTimeField('入場日時', default=timezone.now)
     
     class Meta:
         db_table = 'entries'
@@ -2,16 +2,21 @@
 from django.db import transaction
 from django.db import models
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from apps.entries.models import Entry
 from apps.tickets.models import Ticket
+from apps.tickets.services.signing import TicketPayloadError, decode_payload, is_signed_payload
 
 
 def verify_and_record_entry(ticket_number: str, gate: str, scanned_by_user) -> dict:
     """
     チケット検証と入場記録
     
+    QRコードの署名付きペイロードは署名を検証してからチケットを取得する（改ざん・偽造されたQRコードは
+    DBを参照せずに拒否する）。手入力のチケット番号はそのまま取得する。
+    
     Args:
-        ticket_number: チケット番号
+        ticket_number: QRコードの内容（署名付きペイロード）またはチケット番号
         gate: ゲート名
         scanned_by_user: スキャンしたスタッフ
         
@@ -24,6 +29,18 @@ def verify_and_record_entry(ticket_number: str, gate: str, scanned_by_user) -> d
         }
     """
     try:
+        # QRコード署名検証
+        if is_signed_payload(ticket_number):
+            try:
+                ticket_number = decode_payload(ticket_number).ticket_number
+            except TicketPayloadError as e:
+                return {
+                    'success': False,
+                    'message': f'QRコードの検証に失敗しました（{e}）。不正なチケットの可能性があります。',
+                    'ticket': None,
+                    'entry': None
+                }
+        
         # チケットを取得
         ticket = Ticket.objects.select_related(
             'order__event',
@@ -31,16 +48,6 @@ def verify_and_record_entry(ticket_number: str, gate: str, scanned_by_user) -> d
             'seat__venue'
         ).get(ticket_number=ticket_number)
         
-        # QRコード署名検証
-        qr_service = TicketQRService()
-        if not qr_service.verify_qr_code(ticket.qr_code):
-            return {
-                'success': False,
-                'message': 'QRコードの検証に失敗しました。不正なチケットの可能性があります。',
-                'ticket': ticket,
-                'entry': None
-            }
-        
         # チケットステータス確認
         if ticket.status == 'cancelled':
             return {
@@ -84,15 +91,21 @@ def verify_and_record_entry(ticket_number: str, gate: str, scanned_by_user) -> d
         
         # 入場記録を作成
         with transaction.atomic():
+            # チケットを使用済みに更新（別のゲートで同時に読み取られた場合は1回だけ成功する）
+            if not Ticket.objects.filter(pk=ticket.pk, status='valid').update(status='used', updated_at=timezone.now()):
+                return {
+                    'success': False,
+                    'message': 'このチケットは既に使用されています',
+                    'ticket': ticket,
+                    'entry': Entry.objects.filter(ticket=ticket).first()
+                }
+            ticket.status = 'used'
+            
             entry = Entry.objects.create(
                 ticket=ticket,
                 gate=gate,
                 scanned_by=scanned_by_user
             )
-            
-            # チケットを使用済みに更新
-            ticket.status = 'used'
-            ticket.save(update_fields=['status'])
         
         return {
             'success': True,
@@ -117,6 +130,70 @@ def verify_and_record_entry(ticket_number: str, gate: str, scanned_by_user) -> d
         }
 
 
+def record_offline_entries(scans, gate, scanned_by_user):
+    """
+    入場ゲートの端末がオフラインで許可した入場をまとめて記録する
+    
+    端末はQRコードの署名・対象イベント・入場可能期間を端末内で検証して入場させ、
+    入場記録だけを後から送る。送られたペイロードはここでも署名を検証し、チケットは1文でロックして
+    入場記録の作成・使用済みへの更新をそれぞれ1文で行う（件数によらず文の数は一定）。
+    
+    Args:
+        scans: [{'payload': QRコードの内容, 'scanned_at': 読み取り日時（ISO 8601）}, ...]
+        gate: ゲート名
+        scanned_by_user: 端末を操作したスタッフ
+    
+    Returns:
+        list: スキャンごとの結果 [{
+            'ticket_number': チケット番号（ペイロードが不正な場合はNone）,
+            'status': 'recorded'（記録した）| 'duplicate'（使用済み）| 'cancelled' | 'not_found' | 'invalid',
+            'message': メッセージ
+        }, ...]
+    """
+    now = timezone.now()
+    results = []
+    accepted = []
+    for scan in scans:
+        try:
+            scanned_at = parse_datetime(str(scan.get('scanned_at') or '')) or now
+            if timezone.is_naive(scanned_at):
+                scanned_at = timezone.make_aware(scanned_at)
+            claims = decode_payload(str(scan.get('payload') or ''), now=scanned_at)
+        except (TicketPayloadError, ValueError) as e:
+            results.append({'ticket_number': None, 'status': 'invalid', 'message': str(e)})
+            continue
+        results.append({'ticket_number': claims.ticket_number, 'status': None, 'message': ''})
+        accepted.append((results[-1], claims, min(scanned_at, now)))
+    
+    with transaction.atomic():
+        tickets = {
+            ticket_number: (ticket_id, event_id, status)
+            for ticket_number, ticket_id, event_id, status in Ticket.objects.select_for_update().filter(
+                ticket_number__in={claims.ticket_number for result, claims, scanned_at in accepted}
+            ).order_by('id').values_list('ticket_number', 'id', 'order__event_id', 'status')
+        }
+        entries = []
+        for result, claims, scanned_at in accepted:
+            ticket_id, event_id, status = tickets.get(claims.ticket_number, (None, None, None))
+            if ticket_id is None or event_id != claims.event_id:
+                result.update(status='not_found', message='チケットが見つかりません')
+            elif status == 'cancelled':
+                result.update(status='cancelled', message='このチケットはキャンセルされています')
+            elif status == 'used':
+                result.update(status='duplicate', message='このチケットは既に使用されています')
+            else:
+                result.update(status='recorded', message='入場を記録しました')
+                # 同じチケットが複数回送られた場合は2回目以降を使用済みとして扱う
+                tickets[claims.ticket_number] = (ticket_id, event_id, 'used')
+                entries.append(Entry(ticket_id=ticket_id, gate=gate, scanned_by=scanned_by_user, entered_at=scanned_at))
+        
+        if entries:
+            Entry.objects.bulk_create(entries)
+            Ticket.objects.filter(id__in=[entry.ticket_id for entry in entries]).update(status='used', updated_at=now)
+    
+    return results
+
+
 def get_entry_statistics(event_id=None):
     """
     入場統計情報を取得
@@ -1,3 +1,188 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.entries.manifest import canonical_json, ticket_hash, unpack_hashes
+from apps.entries.models import Entry
+from apps.events.models import Event
+from apps.orders.models import Order
+from apps.seats.models import Seat
+from apps.seats.tests import SeatTestMixin, User
+from apps.tickets.models import Ticket
+from apps.tickets.services.signing import decode_payload, sign_ticket, verify_message
+
+
+class EntryTestMixin(SeatTestMixin):
+    """入場テスト用の共通データ（入場可能期間内のイベントと発行済みのチケット）"""
+
+    def setUp(self):
+        super().setUp()
+        # 入場可能期間内（開始1時間前）
+        Event.objects.filter(pk__in=[self.event.pk, self.other_event.pk]).update(
+            start_datetime=timezone.now() + timedelta(hours=1)
+        )
+        self.other_event.refresh_from_db()
+        self.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        customer = User.objects.create_user(username='customer', password='testpass123')
+        self.order = Order.objects.create(
+            order_number='ORD1', user=customer, event=self.event, total_amount=16000, status='paid'
+        )
+        seat_ids = list(Seat.objects.order_by('id').values_list('id', flat=True)[:3])
+        self.tickets = [Ticket.objects.create(order=self.order, seat_id=seat_id) for seat_id in seat_ids]
+        self.client.force_login(self.staff)
+
+    def payload(self, ticket):
+        return sign_ticket(Ticket.objects.select_related('order__event').get(pk=ticket.pk))
+
+
+class SignedEntryTest(EntryTestMixin, TestCase):
+    """署名付きQRコードの入場とオフライン入場の同期のテスト"""
+
+    def test_scan_signed_payload(self):
+        """QRコードのペイロードで入場でき、改ざんされたペイロードはDBを参照せずに拒否する"""
+        payload = self.payload(self.tickets[0])
+        response = self.client.post(reverse('entries:verify_ticket'), {'ticket_number': payload, 'gate': '東ゲート'})
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(Ticket.objects.get(pk=self.tickets[0].pk).status, 'used')
+
+        response = self.client.post(reverse('entries:verify_ticket'), {'ticket_number': payload})
+        self.assertFalse(response.json()['success'])
+
+        tampered = payload[:-1] + ('A' if payload[-1] != 'A' else 'B')
+        with self.assertNumQueries(0):
+            from apps.entries.services import verify_and_record_entry
+            result = verify_and_record_entry(tampered, '東ゲート', self.staff)
+        self.assertFalse(result['success'])
+        self.assertIn('署名', result['message'])
+
+    def test_gate_keys(self):
+        """端末には公開鍵だけを配布し、公開鍵でQRコードを検証できる"""
+        data = self.client.get(reverse('entries:gate_keys')).json()
+        self.assertEqual(data['algorithm'], 'Ed25519')
+        self.assertFalse(set(settings.TICKET_SIGNING_KEYS.values()) & set(data['keys'].values()))
+        claims = decode_payload(self.payload(self.tickets[0]), event_id=self.event.pk, keys=data['keys'])
+        self.assertEqual(claims.ticket_number, self.tickets[0].ticket_number)
+    
+    def test_sync_offline_entries(self):
+        """オフラインで許可した入場を読み取り日時で記録し、使用済み・キャンセル・不正は結果で返す"""
+        Ticket.objects.filter(pk=self.tickets[2].pk).update(status='cancelled')
+        scanned_at = timezone.now() - timedelta(minutes=3)
+        # 別のイベントのチケットとして署名されたペイロード
+        other_event_ticket = Ticket(order=Order(event=self.other_event), ticket_number=self.tickets[0].ticket_number)
+
+        scans = [
+            {'payload': self.payload(self.tickets[0]), 'scanned_at': scanned_at.isoformat()},
+            {'payload': self.payload(self.tickets[1]), 'scanned_at': scanned_at.isoformat()},
+            {'payload': self.payload(self.tickets[0]), 'scanned_at': timezone.now().isoformat()},
+            {'payload': self.payload(self.tickets[2])},
+            {'payload': 'T2.K1.INVALID.PAYLOAD'},
+            {'payload': sign_ticket(other_event_ticket)},
+        ]
+        response = self.client.post(
+            reverse('entries:sync_entries'),
+            data=json.dumps({'gate': '西ゲート', 'scans': scans}),
+            content_type='application/json'
+        )
+
+        data = response.json()
+        self.assertEqual(data['recorded'], 2)
+        self.assertEqual(
+            [result['status'] for result in data['results']],
+            ['recorded', 'recorded', 'duplicate', 'cancelled', 'invalid', 'not_found']
+        )
+        entries = Entry.objects.filter(gate='西ゲート')
+        self.assertEqual(entries.count(), 2)
+        self.assertEqual(entries.first().entered_at, scanned_at)
+        self.assertEqual(
+            list(Ticket.objects.order_by('id').values_list('status', flat=True)), ['used', 'used', 'cancelled']
+        )
+
+        response = self.client.post(reverse('entries:sync_entries'), data='[]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class GateManifestTest(EntryTestMixin, TestCase):
+    """入場ゲートのマニフェストのテスト"""
+
+    def setUp(self):
+        super().setUp()
+        # 端末に配布する公開鍵
+        self.public_keys = self.client.get(reverse('entries:gate_keys')).json()['keys']
+    
+    def assertSigned(self, data):
+        """端末と同じく公開鍵だけで署名を検証する"""
+        self.assertEqual(data['algorithm'], 'Ed25519')
+        self.assertTrue(
+            verify_message(canonical_json(data['manifest']), data['key_id'], data['signature'], keys=self.public_keys)
+        )
+    
+    def get_manifest(self, **params):
+        response = self.client.get(reverse('entries:gate_manifest', args=[self.event.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertSigned(data)
+        return data['manifest']
+
+    def test_full_manifest(self):
+        """有効なチケットのハッシュを昇順に、キャンセルされたチケットを別に含む"""
+        Ticket.objects.filter(pk=self.tickets[2].pk).update(status='cancelled')
+        manifest = self.get_manifest()
+
+        hashes = unpack_hashes(manifest['tickets'])
+        self.assertEqual((manifest['type'], manifest['count']), ('full', 2))
+        self.assertEqual(hashes, sorted(ticket_hash(ticket.ticket_number) for ticket in self.tickets[:2]))
+        self.assertEqual(unpack_hashes(manifest['cancelled']), [ticket_hash(self.tickets[2].ticket_number)])
+
+        self.client.force_login(User.objects.get(username='customer'))
+        response = self.client.get(reverse('entries:gate_manifest', args=[self.event.pk]))
+        self.assertEqual(response.status_code, 302)
+
+    def test_delta_follows_late_sales_and_cancellations(self):
+        """差分は前回の cursor 以降に販売・キャンセルされたチケットだけを含む"""
+        cursor = self.get_manifest()['cursor']
+        Ticket.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+
+        late = Ticket.objects.create(order=self.order)
+        Ticket.objects.filter(pk=self.tickets[0].pk).update(status='cancelled', updated_at=timezone.now())
+        delta = self.get_manifest(since=cursor)
+
+        self.assertEqual(delta['type'], 'delta')
+        self.assertEqual(unpack_hashes(delta['tickets']), [ticket_hash(late.ticket_number)])
+        self.assertEqual(unpack_hashes(delta['cancelled']), [ticket_hash(self.tickets[0].ticket_number)])
+        response = self.client.get(reverse('entries:gate_manifest', args=[self.event.pk]), {'since': 'x'})
+        self.assertEqual(response.status_code, 400)
 
-# Create your tests here.
+    def test_delta_marks_tickets_scanned_at_other_gates(self):
+        """マニフェストの作成後に別のゲートで入場したチケットは、差分で入場済みになる"""
+        manifest = self.get_manifest()
+        self.assertEqual(unpack_hashes(manifest['used']), [])
+        from apps.entries.services import verify_and_record_entry
+        verify_and_record_entry(self.payload(self.tickets[1]), '東ゲート', self.staff)
+        
+        delta = self.get_manifest(since=manifest['cursor'])
+        scanned = ticket_hash(self.tickets[1].ticket_number)
+        self.assertEqual(unpack_hashes(delta['used']), [scanned])
+        self.assertNotIn(scanned, unpack_hashes(delta['tickets']))
+    
+    def test_command_writes_signed_manifest(self):
+        """管理コマンドで署名付きのマニフェストをファイルに出力する"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'manifest.json')
+            call_command('build_gate_manifest', self.event.pk, output=path, stderr=open(os.devnull, 'w'))
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        self.assertEqual(data['manifest']['count'], 3)
+        self.assertSigned(data)
+        
+        # 改ざんしたマニフェストは公開鍵で検証できない
+        data['manifest']['count'] = 4
+        self.assertFalse(
+            verify_message(canonical_json(data['manifest']), data['key_id'], data['signature'], keys=self.public_keys)
+        )
@@ -6,6 +6,9 @@ app_name = 'entries'
 urlpatterns = [
     path('scan/', views.qr_scan_view, name='qr_scan'),
     path('verify/', views.verify_ticket_view, name='verify_ticket'),
+    path('sync/', views.sync_entries_view, name='sync_entries'),
+    path('manifest/<int:event_id>/', views.gate_manifest_view, name='gate_manifest'),
+    path('keys/', views.gate_keys_view, name='gate_keys'),
     path('process/', views.process_entry, name='process_entry'),
     path('list/', views.entry_list, name='entry_list'),
     path('status/', views.entry_status_view, name='entry_status'),
@@ -7,9 +7,10 @@ from django.utils import timezone
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from apps.core.pagination import paginate_keyset
 from apps.entries.models import Entry
 from apps.tickets.models import Ticket
-from apps.entries.services import verify_and_record_entry, get_entry_statistics
+from apps.entries.services import verify_and_record_entry, record_offline_entries, get_entry_statistics
 
 
 @staff_member_required
@@ -58,7 +59,7 @@ def verify_ticket_view(request):
             'ticket_number': ticket.ticket_number,
             'event_name': ticket.order.event.name,
             'seat_info': f"{ticket.seat.block} {ticket.seat.row}列 {ticket.seat.number}番" if ticket.seat else "自由席",
-            'ticket_type': ticket.order.event.tickettype_set.first().name if ticket.order.event.tickettype_set.exists() else "一般",
+            'ticket_type': ticket.order.event.ticket_types.first().name if ticket.order.event.ticket_types.exists() else "一般",
         }
     
     if result['entry']:
@@ -71,6 +72,72 @@ def verify_ticket_view(request):
     return JsonResponse(response_data)
 
 
+@staff_member_required
+@require_http_methods(["POST"])
+def sync_entries_view(request):
+    """
+    オフライン入場の同期API（入場ゲートの端末用）
+    
+    端末内でQRコードの署名を検証して入場させた記録をまとめて送る。
+    
+    POST data (JSON):
+        - gate: ゲート名
+        - scans: [{'payload': QRコードの内容, 'scanned_at': 読み取り日時（ISO 8601）}, ...]
+    """
+    import json
+    
+    try:
+        data = json.loads(request.body)
+        scans = data['scans']
+        if not isinstance(scans, list) or not all(isinstance(scan, dict) for scan in scans):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    results = record_offline_entries(scans, data.get('gate') or 'メインゲート', request.user)
+    return JsonResponse({
+        'results': results,
+        'recorded': sum(1 for result in results if result['status'] == 'recorded'),
+    })
+
+
+@staff_member_required
+@require_http_methods(["GET"])
+def gate_manifest_view(request, event_id):
+    """
+    入場ゲートの端末に配布するマニフェストAPI
+    
+    GET params:
+        - since: 差分の起点（前回のマニフェストの cursor。未指定時は全件）
+    """
+    from django.utils.dateparse import parse_datetime
+    from apps.events.models import Event
+    from apps.entries.manifest import signed_manifest
+    
+    get_object_or_404(Event, pk=event_id)
+    since = None
+    if request.GET.get('since'):
+        since = parse_datetime(request.GET['since'])
+        if since is None:
+            return JsonResponse({'error': 'Invalid since'}, status=400)
+    
+    return JsonResponse(signed_manifest(event_id, since))
+
+
+@staff_member_required
+@require_http_methods(["GET"])
+def gate_keys_view(request):
+    """
+    入場ゲートの端末に配布する公開鍵API
+    
+    QRコードとマニフェストの署名を端末で検証するための公開鍵（{鍵ID: 公開鍵のBase64}）を返す。
+    秘密鍵は返さないため、端末から署名を作ることはできない。
+    """
+    from apps.tickets.services.signing import SIGNATURE_ALGORITHM, export_verification_keys
+    
+    return JsonResponse({'algorithm': SIGNATURE_ALGORITHM, 'keys': export_verification_keys()})
+
+
 @staff_member_required
 def process_entry(request):
     """入場処理（フォーム送信用、旧版）"""
@@ -97,7 +164,8 @@ def entry_list(request):
         'ticket__order__event',
         'ticket__seat',
         'scanned_by'
-    ).order_by('-entered_at')[:100]
+    )
+    page = paginate_keyset(request, entries, ['-entered_at', '-id'], 100)
     
     # 統計情報
     total_entries = Entry.objects.count()
@@ -106,7 +174,8 @@ def entry_list(request):
     ).count()
     
     return render(request, 'entries/entry_list.html', {
-        'entries': entries,
+        'entries': page,
+        'page_obj': page,
         'total_entries': total_entries,
         'today_entries': today_entries
     })
@@ -28,7 +28,7 @@ class EventForm(forms.ModelForm):
     class Meta:
         model = Event
         fields = ['name', 'description', 'category', 'venue', 'start_datetime', 
-                  'end_datetime', 'image', 'is_public', 'status']
+                  'end_datetime', 'image', 'is_public', 'status', 'waiting_room_rate']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 5}),
@@ -39,6 +39,7 @@ class EventForm(forms.ModelForm):
             'image': forms.FileInput(attrs={'class': 'form-control'}),
             'is_public': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'status': forms.Select(attrs={'class': 'form-select'}),
+            'waiting_room_rate': forms.NumberInput(attrs={'class': 'form-control', 'min': 1, 'placeholder': '未設定の場合は待合室なし'}),
         }
 
 
@@ -47,10 +48,11 @@ class TicketTypeForm(forms.ModelForm):
     
     class Meta:
         model = TicketType
-        fields = ['name', 'type', 'price', 'total_quantity', 'sale_start', 'sale_end']
+        fields = ['name', 'type', 'seat_type', 'price', 'total_quantity', 'sale_start', 'sale_end']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'S席'}),
             'type': forms.Select(attrs={'class': 'form-select'}),
+            'seat_type': forms.Select(attrs={'class': 'form-select'}),
             'price': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
             'total_quantity': forms.NumberInput(attrs={'class': 'form-control'}),
             'sale_start': forms.DateTimeInput(attrs={'class': 'form-control', 'type': 'datetime-local'}),
@@ -0,0 +1,84 @@
+"""仮想待合室の入場制御ミドルウェア"""
+import json
+from urllib.parse import urlencode
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.urls import reverse
+from .waiting_room import (
+    GATED_VIEWS, admit, has_admission, read_queue_token, get_queue_status, rebind_admission_cookies,
+    set_admission_cookie, QUEUE_COOKIE,
+)
+
+
+class WaitingRoomMiddleware:
+    """
+    待合室を有効にしたイベントの購入画面へのアクセスを入場トークンで制御する
+
+    入場トークンの検証は署名とセッションキーの確認のみで、DBにもバックエンドにもアクセスしない。
+    入場トークンがない場合のみバックエンドで整理券の順番を確認し、
+    入場が許可されていればトークンを発行し、許可されていなければ待合室へ誘導する。
+    入場を許可したリクエスト（request.waiting_room_admitted）のレスポンスに入場トークンを設定する。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        previous_session_key = request.session.session_key
+        response = self.get_response(request)
+        event_id = getattr(request, 'waiting_room_admitted', None)
+        if event_id is not None:
+            set_admission_cookie(response, event_id, request.session.session_key)
+            response.delete_cookie(QUEUE_COOKIE.format(event_id=event_id), samesite='Lax')
+        rebind_admission_cookies(request, response, previous_session_key)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if match is None or match.view_name not in GATED_VIEWS:
+            return None
+        event_id = _requested_event_id(request, GATED_VIEWS[match.view_name], view_kwargs)
+        if event_id is None or has_admission(request, event_id):
+            return None
+
+        position = read_queue_token(request, event_id)
+        status = get_queue_status(event_id, position)
+        if status is None:
+            # 待合室が無効のイベント
+            return None
+        if status.is_admitted and admit(request, event_id, position):
+            return None
+
+        # 待合室から戻る画面（GET以外はイベント詳細に戻す）
+        if request.method == 'GET':
+            next_url = request.get_full_path()
+        else:
+            next_url = reverse('events:public_event_detail', args=[event_id])
+        waiting_room_url = f"{reverse('events:waiting_room', args=[event_id])}?{urlencode({'next': next_url})}"
+
+        if request.content_type == 'application/json':
+            return JsonResponse({
+                'success': False,
+                'error': 'アクセスが集中しています。順番が来るまでお待ちください。',
+                'waiting_room_url': waiting_room_url,
+            }, status=429)
+        return redirect(waiting_room_url)
+
+
+def _requested_event_id(request, kwarg, view_kwargs):
+    """リクエストの対象イベントIDを取得する（対象を求める関数・URL引数・JSON本文・フォームの順）"""
+    if callable(kwarg):
+        value = kwarg(request, view_kwargs)
+    elif kwarg is not None:
+        value = view_kwargs.get(kwarg)
+    elif request.content_type == 'application/json':
+        try:
+            value = json.loads(request.body).get('event_id')
+        except (ValueError, AttributeError):
+            value = None
+    else:
+        value = request.POST.get('event_id')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
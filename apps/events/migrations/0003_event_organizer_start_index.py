@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_initial'),
+        ('organizers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['organizer', 'start_datetime'], name='idx_events_organizer_start'),
+        ),
+    ]
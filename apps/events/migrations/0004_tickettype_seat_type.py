@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_event_organizer_start_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tickettype',
+            name='seat_type',
+            field=models.CharField(blank=True, choices=[('S', 'S席'), ('A', 'A席'), ('B', 'B席')], max_length=1, verbose_name='座席種別'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0004_tickettype_seat_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketStockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='シャード番号')),
+                ('capacity', models.IntegerField(default=0, verbose_name='割当枚数')),
+                ('sold', models.IntegerField(default=0, verbose_name='販売枚数')),
+                ('ticket_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_shards', to='events.tickettype', verbose_name='チケット種別')),
+            ],
+            options={
+                'verbose_name': 'チケット在庫シャード',
+                'verbose_name_plural': 'チケット在庫シャード',
+                'db_table': 'ticket_stock_shards',
+                'unique_together': {('ticket_type', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0005_ticket_stock_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='waiting_room_rate',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='待合室の入場ペース（人/分）'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Sum
+from django.utils.functional import cached_property
 
 
 class Venue(models.Model):
@@ -67,6 +69,9 @@ class Event(models.Model):
     status = models.CharField('ステータス', max_length=20, choices=STATUS_CHOICES, default='draft')
     is_public = models.BooleanField('公開', default=False)
     
+    # 仮想待合室（設定した場合、購入画面への入場を1分あたりこの人数ずつ許可する）
+    waiting_room_rate = models.PositiveIntegerField('待合室の入場ペース（人/分）', null=True, blank=True)
+    
     # タイムスタンプ
     created_at = models.DateTimeField('登録日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
@@ -79,6 +84,7 @@ class Event(models.Model):
             models.Index(fields=['is_public', 'start_datetime'], name='idx_events_public_start'),
             models.Index(fields=['category'], name='idx_events_category'),
             models.Index(fields=['status'], name='idx_events_status'),
+            models.Index(fields=['organizer', 'start_datetime'], name='idx_events_organizer_start'),
         ]
         ordering = ['-start_datetime']
     
@@ -94,11 +100,19 @@ class TicketType(models.Model):
         ('free', '自由席'),
     ]
     
+    SEAT_TYPE_CHOICES = [
+        ('S', 'S席'),
+        ('A', 'A席'),
+        ('B', 'B席'),
+    ]
+    
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='ticket_types', verbose_name='イベント')
     
     # チケット種別情報
     name = models.CharField('種別名', max_length=100)
     type = models.CharField('タイプ', max_length=20, choices=TYPE_CHOICES)
+    # 座席指定の場合の対象座席種別（空欄の場合は全座席種別に共通の価格）
+    seat_type = models.CharField('座席種別', max_length=1, choices=SEAT_TYPE_CHOICES, blank=True)
     price = models.DecimalField('価格', max_digits=10, decimal_places=2)
     
     # 販売管理
@@ -124,13 +138,55 @@ class TicketType(models.Model):
     def __str__(self):
         return f"{self.event.name} - {self.name}"
     
+    @cached_property
+    def shard_sold_quantity(self):
+        """
+        在庫シャードに記録された未集約の販売枚数
+        
+        一覧ではQuerySetのannotate(shard_sold_quantity=...)で取得しておくとクエリを発行しない。
+        """
+        return self.stock_shards.aggregate(total=Sum('sold'))['total'] or 0
+    
+    @property
+    def current_sold_quantity(self):
+        """販売済枚数（集約済み + 在庫シャードの未集約分）"""
+        return self.sold_quantity + self.shard_sold_quantity
+    
     @property
     def remaining_quantity(self):
         """残り枚数"""
-        return self.total_quantity - self.sold_quantity
+        return max(self.total_quantity - self.current_sold_quantity, 0)
     
     @property
     def is_sold_out(self):
         """売り切れかどうか"""
-        return self.sold_quantity >= self.total_quantity
+        return self.current_sold_quantity >= self.total_quantity
+
+
+class TicketStockShard(models.Model):
+    """
+    チケット種別の在庫シャード（自由席の販売枚数カウンター）
+    
+    販売枚数を1行で数えると同時購入が1行のロックに集中するため、
+    残り枚数をN個のシャードに割り当て、購入ごとにいずれかのシャードだけを更新する。
+    soldは直近の集約以降の販売枚数（返却でマイナスになる場合がある）で、
+    定期的な集約で TicketType.sold_quantity に移し、残り枚数をシャードに割り当て直す。
+    """
+    
+    ticket_type = models.ForeignKey(TicketType, on_delete=models.CASCADE, related_name='stock_shards',
+                                    verbose_name='チケット種別')
+    shard = models.PositiveSmallIntegerField('シャード番号')
+    
+    # 集約時に割り当てた販売可能枚数と、それ以降の販売枚数
+    capacity = models.IntegerField('割当枚数', default=0)
+    sold = models.IntegerField('販売枚数', default=0)
+    
+    class Meta:
+        db_table = 'ticket_stock_shards'
+        verbose_name = 'チケット在庫シャード'
+        verbose_name_plural = 'チケット在庫シャード'
+        unique_together = [['ticket_type', 'shard']]
+    
+    def __str__(self):
+        return f"{self.ticket_type} #{self.shard}"
 
@@ -0,0 +1,202 @@
+"""
+チケット種別の在庫カウンター（自由席）
+
+販売枚数を TicketType.sold_quantity の1行で数えると、一斉販売時にすべての購入がその行のロックを待つ。
+ここでは残り枚数を TICKET_STOCK_SHARDS 個の在庫シャードに割り当て、購入ごとに
+ランダムに選んだ1シャードを条件付きUPDATE（割当枚数を超えない場合のみ加算）で更新する。
+同時購入は別々の行を更新するため、シャード数に応じて並列に処理できる。
+
+    - 確保: sold + 枚数 <= capacity の条件付きUPDATE。1シャードで足りない場合は
+            全シャードをロックして複数シャードから確保する（合計で足りなければ確保しない）
+    - 返却: いずれかのシャードの sold を減らす（割当枚数の範囲内で再び販売できる）
+    - 参照: sold_quantity + シャードの sold の合計
+    - 集約: シャードの sold を sold_quantity に移し、残り枚数をシャードに均等に割り当て直す
+
+割当枚数の合計は集約時点の残り枚数と等しいため、シャードの偏りがあっても販売枚数が総販売枚数を超えることはない。
+"""
+import random
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import TicketType, TicketStockShard
+
+
+def _shard_count():
+    return settings.TICKET_STOCK_SHARDS
+
+
+def with_shard_sold(queryset):
+    """
+    チケット種別のQuerySetに未集約の販売枚数を付与する（一覧で残り枚数を表示する場合）
+    """
+    return queryset.annotate(shard_sold_quantity=Coalesce(Sum('stock_shards__sold'), Value(0)))
+
+
+def reserve_stock(ticket_type_id, quantity):
+    """
+    在庫を確保する
+
+    呼び出し側のトランザクション内で実行すると、ロールバック時に確保も取り消される。
+
+    Args:
+        ticket_type_id: チケット種別ID
+        quantity: 枚数
+
+    Returns:
+        bool: 確保できた場合True（在庫不足の場合は何も確保しない）
+    """
+    if quantity <= 0:
+        raise ValueError('枚数は1以上を指定してください')
+
+    shards = list(range(_shard_count()))
+    random.shuffle(shards)
+    for shard in shards:
+        updated = TicketStockShard.objects.filter(
+            ticket_type_id=ticket_type_id,
+            shard=shard,
+            sold__lte=F('capacity') - quantity,
+        ).update(sold=F('sold') + quantity)
+        if updated:
+            return True
+
+    return _reserve_across_shards(ticket_type_id, quantity)
+
+
+def _reserve_across_shards(ticket_type_id, quantity):
+    """1シャードの残りでは足りない場合に、全シャードをロックして複数シャードから確保する"""
+    with transaction.atomic():
+        # 集約と同じく チケット種別 → シャード の順にロックする
+        if not _lock_ticket_type(ticket_type_id):
+            return False
+        shards = _lock_shards(ticket_type_id)
+        if len(shards) != _shard_count():
+            # シャード未作成（登録直後・シャード数の変更後）の場合は割り当ててから再試行
+            _compact(ticket_type_id)
+            shards = _lock_shards(ticket_type_id)
+
+        if sum(shard.capacity - shard.sold for shard in shards) < quantity:
+            return False
+
+        remaining = quantity
+        for shard in shards:
+            take = min(shard.capacity - shard.sold, remaining)
+            if take <= 0:
+                continue
+            TicketStockShard.objects.filter(pk=shard.pk).update(sold=F('sold') + take)
+            remaining -= take
+            if not remaining:
+                break
+    return True
+
+
+def release_stock(ticket_type_id, quantity):
+    """
+    確保した在庫を返却する（カートからの削除・仮予約の期限切れなど）
+
+    Args:
+        ticket_type_id: チケット種別ID
+        quantity: 枚数
+    """
+    if quantity <= 0:
+        return
+    updated = TicketStockShard.objects.filter(
+        ticket_type_id=ticket_type_id,
+        shard=random.randrange(_shard_count()),
+    ).update(sold=F('sold') - quantity)
+    if not updated:
+        # シャードがない場合は集約済みの販売枚数から戻す
+        with transaction.atomic():
+            TicketType.objects.filter(pk=ticket_type_id).update(sold_quantity=F('sold_quantity') - quantity)
+            _compact(ticket_type_id)
+
+
+def compact_stock(ticket_type_id):
+    """
+    チケット種別の在庫シャードを集約する
+
+    シャードの販売枚数を sold_quantity に移し、残り枚数をシャードに割り当て直す。
+    総販売枚数の変更後やシャード数の変更後にも呼び出す。
+
+    Args:
+        ticket_type_id: チケット種別ID
+
+    Returns:
+        int: 集約した販売枚数
+    """
+    with transaction.atomic():
+        return _compact(ticket_type_id)
+
+
+def _lock_ticket_type(ticket_type_id):
+    """
+    チケット種別の行をロックする
+
+    FOR NO KEY UPDATE はカートアイテム登録時の外部キーの共有ロックと競合しないため、
+    シャードを更新中の購入トランザクションとデッドロックしない。
+    """
+    return (
+        TicketType.objects.select_for_update(no_key=True)
+        .only('id', 'total_quantity', 'sold_quantity')
+        .filter(pk=ticket_type_id)
+        .first()
+    )
+
+
+def _lock_shards(ticket_type_id):
+    return list(
+        TicketStockShard.objects.select_for_update()
+        .filter(ticket_type_id=ticket_type_id)
+        .order_by('shard')
+    )
+
+
+def _compact(ticket_type_id):
+    """compact_stock の本体（トランザクション内で呼び出す）"""
+    ticket_type = _lock_ticket_type(ticket_type_id)
+    if ticket_type is None:
+        return 0
+    shards = {shard.shard: shard for shard in _lock_shards(ticket_type_id)}
+
+    moved = sum(shard.sold for shard in shards.values())
+    sold_quantity = ticket_type.sold_quantity + moved
+    remaining = max(ticket_type.total_quantity - sold_quantity, 0)
+
+    shard_count = _shard_count()
+    base, extra = divmod(remaining, shard_count)
+    to_create = []
+    to_update = []
+    for index in range(shard_count):
+        capacity = base + (1 if index < extra else 0)
+        shard = shards.pop(index, None)
+        if shard is None:
+            to_create.append(TicketStockShard(ticket_type_id=ticket_type_id, shard=index, capacity=capacity))
+        else:
+            shard.capacity = capacity
+            shard.sold = 0
+            to_update.append(shard)
+
+    if moved:
+        TicketType.objects.filter(pk=ticket_type_id).update(sold_quantity=sold_quantity)
+    TicketStockShard.objects.bulk_update(to_update, ['capacity', 'sold'])
+    TicketStockShard.objects.bulk_create(to_create)
+    # シャード数を減らした場合の余分なシャード（販売枚数は集約済み）
+    if shards:
+        TicketStockShard.objects.filter(pk__in=[shard.pk for shard in shards.values()]).delete()
+    return moved
+
+
+def compact_all_stock():
+    """
+    未集約の販売枚数があるチケット種別の在庫シャードをすべて集約する（定期実行）
+
+    Returns:
+        dict: {'ticket_types': 集約したチケット種別数, 'moved': 集約した販売枚数}
+    """
+    ticket_type_ids = list(
+        TicketStockShard.objects.exclude(sold=0).values_list('ticket_type_id', flat=True).distinct()
+    )
+    moved = 0
+    for ticket_type_id in ticket_type_ids:
+        moved += compact_stock(ticket_type_id)
+    return {'ticket_types': len(ticket_type_ids), 'moved': moved}
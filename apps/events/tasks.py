@@ -0,0 +1,15 @@
+"""イベント関連のCeleryタスク"""
+import logging
+from celery import shared_task
+from .stock import compact_all_stock
+
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def compact_ticket_stock_task():
+    """自由席の在庫シャードを集約（Celery beatで定期実行）"""
+    result = compact_all_stock()
+    logger.info('チケット在庫を集約しました: ticket_types=%(ticket_types)s moved=%(moved)s', result)
+    return result
@@ -1,3 +1,234 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.events import waiting_room
+from apps.events.models import Venue, Event, TicketType, TicketStockShard
+from apps.organizers.models import Organizer
+from apps.events.stock import reserve_stock, release_stock, compact_stock, compact_all_stock, with_shard_sold
+
+
+class EventTestMixin:
+    """イベントテスト用の共通データ"""
+    
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='organizer', password='testpass123')
+        organizer = Organizer.objects.create(user=user, organization_name='テスト主催者', role='admin')
+        venue = Venue.objects.create(name='テスト会場', address='東京都渋谷区', capacity=100)
+        self.event = Event.objects.create(
+            name='イベント1',
+            description='テスト',
+            category='concert',
+            venue=venue,
+            organizer=organizer,
+            start_datetime=timezone.now() + timedelta(days=1),
+            is_public=True,
+            status='on_sale'
+        )
+
+
+@override_settings(TICKET_STOCK_SHARDS=4)
+class TicketStockTest(EventTestMixin, TestCase):
+    """自由席の在庫シャードのテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        self.ticket_type = TicketType.objects.create(
+            event=self.event, name='自由席', type='free', price=3000, total_quantity=10
+        )
+    
+    def refresh(self):
+        return TicketType.objects.get(pk=self.ticket_type.pk)
+    
+    def test_never_oversells(self):
+        """シャードに偏りがあっても総販売枚数を超えて確保しない"""
+        results = [reserve_stock(self.ticket_type.pk, 3) for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+        self.assertTrue(reserve_stock(self.ticket_type.pk, 1))
+        self.assertFalse(reserve_stock(self.ticket_type.pk, 1))
+        
+        ticket_type = self.refresh()
+        self.assertEqual(ticket_type.current_sold_quantity, 10)
+        self.assertEqual(ticket_type.remaining_quantity, 0)
+        self.assertTrue(ticket_type.is_sold_out)
+        self.assertEqual(TicketStockShard.objects.filter(ticket_type=self.ticket_type).count(), 4)
+    
+    def test_single_shard_reserve_is_one_update(self):
+        """割当枚数の残りがあるシャードでは1回のUPDATEで確保する"""
+        compact_stock(self.ticket_type.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(reserve_stock(self.ticket_type.pk, 2))
+    
+    def test_release_and_compact(self):
+        """返却した在庫は再び販売でき、集約で販売済枚数に移る"""
+        reserve_stock(self.ticket_type.pk, 6)
+        release_stock(self.ticket_type.pk, 2)
+        self.assertEqual(self.refresh().remaining_quantity, 6)
+        
+        self.assertEqual(compact_all_stock(), {'ticket_types': 1, 'moved': 4})
+        ticket_type = self.refresh()
+        self.assertEqual(ticket_type.sold_quantity, 4)
+        self.assertEqual(ticket_type.shard_sold_quantity, 0)
+        shards = TicketStockShard.objects.filter(ticket_type=self.ticket_type)
+        self.assertEqual(sorted(shards.values_list('capacity', flat=True)), [1, 1, 2, 2])
+        self.assertEqual(compact_all_stock(), {'ticket_types': 0, 'moved': 0})
+        
+        self.assertTrue(reserve_stock(self.ticket_type.pk, 6))
+        self.assertFalse(reserve_stock(self.ticket_type.pk, 1))
+    
+    def test_total_quantity_change_is_reallocated(self):
+        """総販売枚数の変更は集約で割当枚数に反映される"""
+        reserve_stock(self.ticket_type.pk, 10)
+        TicketType.objects.filter(pk=self.ticket_type.pk).update(total_quantity=12)
+        compact_stock(self.ticket_type.pk)
+        self.assertEqual(
+            TicketStockShard.objects.filter(ticket_type=self.ticket_type).aggregate(total=Sum('capacity'))['total'], 2
+        )
+        self.assertTrue(reserve_stock(self.ticket_type.pk, 2))
+        self.assertFalse(reserve_stock(self.ticket_type.pk, 1))
+    
+    def test_annotated_remaining_quantity(self):
+        """annotateした一覧では残り枚数の参照でクエリを発行しない"""
+        reserve_stock(self.ticket_type.pk, 3)
+        ticket_type = with_shard_sold(TicketType.objects.filter(pk=self.ticket_type.pk)).get()
+        with self.assertNumQueries(0):
+            self.assertEqual(ticket_type.remaining_quantity, 7)
+
+
+class WaitingRoomTest(EventTestMixin, TestCase):
+    """仮想待合室のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(waiting_room, '_backend', waiting_room.InMemoryBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        self.now = time.time()
+        self.event.waiting_room_rate = 60
+        waiting_room.configure_waiting_room(self.event)
+        self.detail_url = reverse('events:public_event_detail', args=[self.event.pk])
+        self.status_url = reverse('events:waiting_room_status', args=[self.event.pk])
+    
+    def at(self, seconds):
+        """基準時刻から指定秒後の時刻で実行する"""
+        return mock.patch.object(waiting_room.time, 'time', return_value=self.now + seconds)
+    
+    def join(self, client):
+        with self.at(0):
+            response = client.get(self.detail_url)
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.url.startswith(reverse('events:waiting_room', args=[self.event.pk])))
+            return client.get(response.url)
+    
+    def test_event_without_waiting_room_is_open(self):
+        """待合室が無効のイベントはそのまま表示する"""
+        self.event.waiting_room_rate = None
+        waiting_room.configure_waiting_room(self.event)
+        self.assertEqual(self.client.get(self.detail_url).status_code, 200)
+    
+    def test_admits_in_arrival_order(self):
+        """到着順に入場ペースに合わせて入場を許可する"""
+        first, second = self.client, self.client_class()
+        response = self.join(first)
+        self.assertContains(response, '順番になりましたら')
+        self.join(second)
+        
+        with self.at(0.5):
+            self.assertEqual(first.get(self.status_url).json()['admitted'], False)
+        with self.at(1):
+            self.assertEqual(first.get(self.status_url).json(), {'admitted': True})
+            data = second.get(self.status_url).json()
+        self.assertEqual(data['admitted'], False)
+        self.assertEqual(data['ahead'], 0)
+        
+        # 入場トークンの検証ではバックエンドを参照しない
+        with mock.patch.object(waiting_room, 'get_backend', side_effect=AssertionError):
+            self.assertEqual(first.get(self.detail_url).status_code, 200)
+        with self.at(2):
+            self.assertEqual(second.get(self.status_url).json(), {'admitted': True})
+    
+    def test_reload_keeps_position(self):
+        """待合室を再表示しても新しい整理券は発行しない"""
+        self.join(self.client)
+        with self.at(0):
+            self.client.get(reverse('events:waiting_room', args=[self.event.pk]))
+        with self.at(1):
+            self.assertEqual(self.client.get(self.status_url).json(), {'admitted': True})
+    
+    def admitted_client(self):
+        client = self.client_class()
+        self.join(client)
+        with self.at(1):
+            self.assertEqual(client.get(self.status_url).json(), {'admitted': True})
+        return client
+    
+    def test_admission_is_bound_to_session(self):
+        """入場トークン・入場済みの整理券を別のブラウザにコピーしても入場できない"""
+        first = self.admitted_client()
+        admission = waiting_room.ADMISSION_COOKIE.format(event_id=self.event.pk)
+        self.assertEqual(first.get(self.detail_url).status_code, 200)
+        
+        second = self.client_class()
+        second.cookies[admission] = first.cookies[admission].value
+        with self.at(1):
+            self.assertEqual(second.get(self.detail_url).status_code, 302)
+        
+        # 交換済みの整理券をコピーしても入場トークンに交換できず、並び直しになる
+        queue_token = waiting_room.make_queue_token(self.event.pk, 1)
+        second.cookies[waiting_room.QUEUE_COOKIE.format(event_id=self.event.pk)] = queue_token
+        with self.at(1):
+            response = second.get(self.status_url)
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn(admission, response.cookies)
+    
+    def test_login_keeps_admission(self):
+        """ログインでセッションキーが変わっても入場トークンを発行し直して入場を続けられる"""
+        get_user_model().objects.create_user(username='customer', password='testpass123')
+        client = self.admitted_client()
+        response = client.post(reverse('members:login'), {'username': 'customer', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, 302)
+        with mock.patch.object(waiting_room, 'get_backend', side_effect=AssertionError):
+            self.assertEqual(client.get(self.detail_url).status_code, 200)
+    
+    def test_forged_admission_is_rejected(self):
+        """署名のない入場トークンは受け付けない"""
+        self.client.cookies[waiting_room.ADMISSION_COOKIE.format(event_id=self.event.pk)] = 'forged'
+        with self.at(0):
+            self.assertEqual(self.client.get(self.detail_url).status_code, 302)
+    
+    def test_free_tickets_are_gated_by_ticket_type_event(self):
+        """自由席のカート追加は、送信された event_id によらずチケット種別のイベントの待合室を通す"""
+        user = get_user_model().objects.create_user(username='customer', password='testpass123')
+        other_event = Event.objects.create(
+            name='イベント2', description='テスト', category='concert', venue=self.event.venue,
+            organizer=self.event.organizer, start_datetime=self.event.start_datetime, is_public=True,
+            status='on_sale'
+        )
+        free = TicketType.objects.create(event=self.event, name='自由席', type='free', price=3000, total_quantity=10)
+        self.client.force_login(user)
+        waiting_room_url = reverse('events:waiting_room', args=[self.event.pk])
+        for data in ({'ticket_type_id': free.pk}, {'ticket_type_id': free.pk, 'event_id': other_event.pk}):
+            with self.at(0):
+                response = self.client.post(reverse('orders:add_to_cart_free'), data)
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.url.startswith(waiting_room_url))
+        self.assertEqual(TicketType.objects.get(pk=free.pk).remaining_quantity, 10)
+    
+    def test_json_request_is_told_to_wait(self):
+        """JSONのリクエストには待合室のURLを返す"""
+        user = get_user_model().objects.create_user(username='customer', password='testpass123')
+        self.client.force_login(user)
+        with self.at(0):
+            response = self.client.post(
+                reverse('orders:cart_add'), data={'event_id': self.event.pk, 'seat_ids': [1]},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('waiting_room_url', response.json())
@@ -7,6 +7,8 @@ urlpatterns = [
     # 購入者向けイベント
     path('', views.PublicEventListView.as_view(), name='public_event_list'),
     path('<int:pk>/', views.EventDetailView.as_view(), name='public_event_detail'),
+    path('<int:pk>/waiting-room/', views.WaitingRoomView.as_view(), name='waiting_room'),
+    path('<int:pk>/waiting-room/status/', views.WaitingRoomStatusView.as_view(), name='waiting_room_status'),
     
     # 会場管理（主催者）
     path('venues/', views.VenueListView.as_view(), name='venue_list'),
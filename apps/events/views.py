@@ -1,23 +1,29 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.views import View
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
-from django.urls import reverse_lazy
+from django.http import JsonResponse
+from django.urls import reverse, reverse_lazy
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
+from apps.core.pagination import KeysetPaginationMixin
 from .models import Venue, Event, TicketType
 from .forms import VenueForm, EventForm, TicketTypeForm
 
 
 # ================== 会場管理 ==================
 
-class VenueListView(LoginRequiredMixin, ListView):
+class VenueListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """会場一覧ビュー"""
     model = Venue
     template_name = 'events/venue_list.html'
     context_object_name = 'venues'
     paginate_by = 20
+    keyset_ordering = ['name', 'id']
 
 
 class VenueCreateView(LoginRequiredMixin, CreateView):
@@ -57,12 +63,20 @@ class VenueDeleteView(LoginRequiredMixin, DeleteView):
 
 # ================== イベント管理 ==================
 
-class EventListView(LoginRequiredMixin, ListView):
+def apply_event_settings(event):
+    """イベントの保存後に待合室の設定を反映（座席在庫は保存時のシグナルで作成される）"""
+    from .waiting_room import configure_waiting_room
+    
+    configure_waiting_room(event)
+
+
+class EventListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """イベント一覧ビュー（主催者向け）"""
     model = Event
     template_name = 'events/event_list.html'
     context_object_name = 'events'
     paginate_by = 20
+    keyset_ordering = ['-start_datetime', '-id']
     
     def get_queryset(self):
         # 主催者自身のイベントのみ表示
@@ -82,8 +96,10 @@ class EventCreateView(LoginRequiredMixin, CreateView):
         # organizerを自動設定
         if hasattr(self.request.user, 'organizer'):
             form.instance.organizer = self.request.user.organizer
+            response = super().form_valid(form)
+            apply_event_settings(self.object)
             messages.success(self.request, 'イベントを登録しました。')
-            return super().form_valid(form)
+            return response
         else:
             messages.error(self.request, '主催者アカウントが必要です。')
             return redirect('events:event_list')
@@ -103,8 +119,16 @@ class EventUpdateView(LoginRequiredMixin, UpdateView):
         return Event.objects.none()
     
     def form_valid(self, form):
+        response = super().form_valid(form)
+        apply_event_settings(self.object)
         messages.success(self.request, 'イベントを更新しました。')
-        return super().form_valid(form)
+        
+        # 開催中止にした場合は全注文を一括キャンセル・返金する（Celeryで実行）
+        if 'status' in form.changed_data and self.object.status == 'cancelled':
+            from apps.orders.services import start_cancellation_run
+            start_cancellation_run(event=self.object, reason='開催中止', created_by=self.request.user)
+            messages.info(self.request, '開催中止に伴い、購入済みの注文の一括キャンセル・返金を開始しました。')
+        return response
 
 
 class EventDeleteView(LoginRequiredMixin, DeleteView):
@@ -141,9 +165,18 @@ class TicketTypeCreateView(LoginRequiredMixin, CreateView):
         return redirect('events:event_list')
     
     def form_valid(self, form):
+        from apps.orders.pricing import invalidate_price_table
+        
+        from .stock import compact_stock
+        
         form.instance.event = self.event
+        response = super().form_valid(form)
+        invalidate_price_table(self.event.pk)
+        if self.object.type == 'free':
+            # 在庫シャードを作成して総販売枚数を割り当てる
+            compact_stock(self.object.pk)
         messages.success(self.request, 'チケット種別を登録しました。')
-        return super().form_valid(form)
+        return response
     
     def get_success_url(self):
         return reverse_lazy('events:event_detail', kwargs={'pk': self.event.pk})
@@ -167,8 +200,21 @@ class TicketTypeUpdateView(LoginRequiredMixin, UpdateView):
         return TicketType.objects.none()
     
     def form_valid(self, form):
+        from apps.orders.pricing import invalidate_price_table
+        from .stock import compact_stock
+        
+        with transaction.atomic():
+            # 販売済枚数は在庫の集約で更新されるため、編集画面を開いた時点の値で上書きしない
+            form.instance.sold_quantity = TicketType.objects.select_for_update(no_key=True).values_list(
+                'sold_quantity', flat=True
+            ).get(pk=form.instance.pk)
+            response = super().form_valid(form)
+            if self.object.type == 'free':
+                # 総販売枚数の変更を在庫シャードの割当に反映
+                compact_stock(self.object.pk)
+        invalidate_price_table(self.object.event_id)
         messages.success(self.request, 'チケット種別を更新しました。')
-        return super().form_valid(form)
+        return response
     
     def get_success_url(self):
         return reverse_lazy('events:event_detail', kwargs={'pk': self.object.event.pk})
@@ -186,8 +232,12 @@ class TicketTypeDeleteView(LoginRequiredMixin, DeleteView):
         return TicketType.objects.none()
     
     def form_valid(self, form):
+        from apps.orders.pricing import invalidate_price_table
+        
+        response = super().form_valid(form)
+        invalidate_price_table(self.object.event_id)
         messages.success(self.request, 'チケット種別を削除しました。')
-        return super().form_valid(form)
+        return response
     
     def get_success_url(self):
         return reverse_lazy('events:event_detail', kwargs={'pk': self.object.event.pk})
@@ -247,8 +297,87 @@ class EventDetailView(DetailView):
         context = super().get_context_data(**kwargs)
         # チケット種別を販売中のものから取得
         now = timezone.now()
-        context['ticket_types'] = self.object.ticket_types.filter(
+        from .stock import with_shard_sold
+        
+        context['ticket_types'] = with_shard_sold(self.object.ticket_types.filter(
             sale_start__lte=now,
             sale_end__gte=now
-        ).order_by('price')
+        )).order_by('price')
         return context
+
+
+# ================== 仮想待合室 ==================
+
+class WaitingRoomView(View):
+    """
+    待合室画面
+    
+    整理券を発行して順番待ちの画面を表示する。アクセス集中時に表示するため、DBにはアクセスしない
+    （入場の許可時にセッションがない場合のセッションの作成を除く）。
+    """
+    
+    def get(self, request, pk):
+        from .waiting_room import admit, has_admission, read_queue_token, get_queue_status, set_queue_cookie
+        
+        next_url = request.GET.get('next', '')
+        if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()},
+                                               require_https=request.is_secure()):
+            next_url = reverse('events:public_event_detail', args=[pk])
+        if has_admission(request, pk):
+            return redirect(next_url)
+        
+        position = read_queue_token(request, pk)
+        status = get_queue_status(pk, position, join=position is None)
+        if status is None:
+            return redirect(next_url)
+        if status.is_admitted:
+            if admit(request, pk, status.position):
+                return redirect(next_url)
+            # 他のセッションで入場トークンに交換済みの整理券は並び直す
+            position = None
+            status = get_queue_status(pk, join=True)
+        
+        response = render(request, 'events/waiting_room.html', {
+            'event_id': pk,
+            'status': status,
+            'next_url': next_url,
+        })
+        if position is None:
+            set_queue_cookie(response, pk, status.position)
+        return response
+
+
+class WaitingRoomStatusView(View):
+    """
+    待合室の順番確認API（ポーリング用）
+    
+    整理券の順番を確認し、入場が許可されていれば入場トークンを発行する。DBにはアクセスしない
+    （入場の許可時にセッションがない場合のセッションの作成を除く）。
+    """
+    
+    def get(self, request, pk):
+        from .waiting_room import admit, read_queue_token, get_queue_status, QUEUE_COOKIE
+        
+        position = read_queue_token(request, pk)
+        if position is None:
+            return JsonResponse({'admitted': False, 'error': '整理券がありません。'}, status=400)
+        
+        status = get_queue_status(pk, position)
+        if status is None or status.is_admitted:
+            if admit(request, pk, position if status is not None else None):
+                return JsonResponse({'admitted': True})
+            # 他のセッションで入場トークンに交換済みの整理券（待合室を再表示すると並び直す）
+            response = JsonResponse(
+                {'admitted': False, 'error': 'この整理券は別のブラウザで使用されています。もう一度お並びください。'},
+                status=409
+            )
+            response.delete_cookie(QUEUE_COOKIE.format(event_id=pk), samesite='Lax')
+            return response
+        
+        return JsonResponse({
+            'admitted': False,
+            'ahead': status.ahead,
+            'estimated_wait': status.estimated_wait,
+            # 次の確認までの秒数（待ち時間が長いほど間隔を空ける）
+            'retry_after': min(max(status.estimated_wait // 10, 3), 30),
+        })
@@ -0,0 +1,339 @@
+"""
+仮想待合室（販売開始時のアクセス集中対策）
+
+待合室を有効にしたイベント（Event.waiting_room_rate を設定）では、購入画面
+（イベント詳細・座席選択・カート追加）へのアクセスに入場トークンが必要になる。
+入場トークンのないアクセスは待合室へ誘導し、到着順の整理券（署名付きの順番）を発行する。
+入場は1分あたり waiting_room_rate 人ずつ順番に許可し、許可された利用者には入場トークンを発行する。
+
+    - 整理券・入場トークンはCookieに保存する署名付きの値で、検証にDBを使わない
+    - 入場トークンはセッションキーに結び付け、Cookieだけを他のブラウザに渡しても使えない
+      （ログインでセッションキーが変わった場合はミドルウェアが新しいキーで発行し直す）
+    - 整理券の順番は1つのセッションでしか入場トークンに交換できない（交換済みの記録はバックエンドに保存する）
+    - 待合室の状態（発行済みの順番・入場許可済みの順番・入場ペース）はバックエンドに保存する
+    - 入場許可は発行済みの順番を超えて進まないため、空いている時間に入場枠が貯まって一度に流れ込むことはない
+
+バックエンドは設定 WAITING_ROOM_BACKEND で切り替える:
+    - 'memory': プロセス内（単一ノード・テスト用）
+    - 'redis':  Redis（複数ノード用、WAITING_ROOM_REDIS_URL に接続）
+"""
+import math
+import threading
+import time
+from django.conf import settings
+from django.core import signing
+
+
+QUEUE_SALT = 'events.waiting_room.queue'
+ADMISSION_SALT = 'events.waiting_room.admission'
+
+QUEUE_COOKIE = 'waiting_room_{event_id}'
+ADMISSION_COOKIE = 'admission_{event_id}'
+
+# 整理券の有効期間（秒）。これを過ぎた整理券は並び直しになる
+QUEUE_TOKEN_MAX_AGE = 6 * 60 * 60
+
+
+
+def ticket_type_event_id(request, view_kwargs):
+    """
+    自由席のカート追加の対象イベントID
+
+    在庫を確保するのは送信されたチケット種別のイベントのため、送信された event_id は使わない。
+
+    Returns:
+        int: イベントID（チケット種別がない場合はNone）
+    """
+    from .models import TicketType
+    try:
+        ticket_type_id = int(request.POST.get('ticket_type_id'))
+    except (TypeError, ValueError):
+        return None
+    return TicketType.objects.filter(pk=ticket_type_id).values_list('event_id', flat=True).first()
+
+
+# 入場トークンが必要な画面（URL名 → イベントIDのURL引数名。Noneの場合はリクエスト本文の event_id、
+# 関数の場合は (request, view_kwargs) から対象イベントIDを求める）
+# 座席状況の取得・配信は入場済みの座席選択画面から呼ばれるため対象外
+GATED_VIEWS = {
+    'events:public_event_detail': 'pk',
+    'seats:seat_selection': 'event_id',
+    'seats:best_available': 'event_id',
+    'orders:cart_add': None,
+    'orders:add_to_cart_free': ticket_type_event_id,
+}
+
+
+class QueueStatus:
+    """待合室の状態"""
+
+    def __init__(self, rate, admitted, issued, position=None):
+        self.rate = rate
+        self.admitted = admitted
+        self.issued = issued
+        self.position = position
+
+    @property
+    def is_admitted(self):
+        return self.position is not None and self.position <= self.admitted
+
+    @property
+    def ahead(self):
+        """自分より前に並んでいる人数"""
+        if self.position is None:
+            return 0
+        return max(self.position - self.admitted - 1, 0)
+
+    @property
+    def estimated_wait(self):
+        """入場までの目安（秒）"""
+        if self.is_admitted or not self.rate:
+            return 0
+        return math.ceil((self.ahead + 1) * 60 / self.rate)
+
+
+class InMemoryBackend:
+    """プロセス内の待合室バックエンド（単一ノード・テスト用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}
+        self._redeemed = {}
+
+    def redeem(self, event_id, position, holder, ttl):
+        with self._lock:
+            return self._redeemed.setdefault((event_id, position), holder) == holder
+
+    def configure(self, event_id, rate):
+        with self._lock:
+            room = self._rooms.setdefault(event_id, {'admitted': 0.0, 'issued': 0, 'last': time.time()})
+            room['rate'] = rate
+
+    def advance(self, event_id, now, join=False):
+        with self._lock:
+            room = self._rooms.get(event_id)
+            if room is None or not room.get('rate'):
+                return None
+            room['admitted'] = min(room['issued'], room['admitted'] + max(now - room['last'], 0) * room['rate'] / 60)
+            room['last'] = now
+            position = None
+            if join:
+                room['issued'] += 1
+                position = room['issued']
+            return room['rate'], room['admitted'], room['issued'], position
+
+
+# 入場許可の順番を経過時間に応じて進め、必要なら整理券を発行する（Redis上で不可分に実行）
+ADVANCE_SCRIPT = """
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate'))
+if not rate or rate <= 0 then
+    return nil
+end
+local now = tonumber(ARGV[1])
+local issued = tonumber(redis.call('HGET', KEYS[1], 'issued') or '0')
+local admitted = tonumber(redis.call('HGET', KEYS[1], 'admitted') or '0')
+local last = tonumber(redis.call('HGET', KEYS[1], 'last') or ARGV[1])
+admitted = math.min(issued, admitted + math.max(now - last, 0) * rate / 60)
+local position = 0
+if ARGV[2] == '1' then
+    issued = issued + 1
+    position = issued
+end
+redis.call('HSET', KEYS[1], 'admitted', tostring(admitted), 'last', ARGV[1], 'issued', issued)
+return {tostring(rate), tostring(admitted), issued, position}
+"""
+
+
+class RedisBackend:
+    """Redisの待合室バックエンド（複数ノード用）"""
+
+    KEY = 'waiting_room:event:{event_id}'
+    REDEEMED_KEY = 'waiting_room:event:{event_id}:redeemed:{position}'
+
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+        self._script = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        import redis
+        with self._lock:
+            if self._client is None:
+                self._client = redis.Redis.from_url(self.url)
+                self._script = self._client.register_script(ADVANCE_SCRIPT)
+            return self._client
+
+    def configure(self, event_id, rate):
+        key = self.KEY.format(event_id=event_id)
+        client = self._get_client()
+        if rate:
+            client.hsetnx(key, 'last', repr(time.time()))
+            client.hset(key, 'rate', rate)
+        else:
+            client.hdel(key, 'rate')
+
+    def redeem(self, event_id, position, holder, ttl):
+        client = self._get_client()
+        key = self.REDEEMED_KEY.format(event_id=event_id, position=position)
+        if client.set(key, holder, nx=True, ex=ttl):
+            return True
+        current = client.get(key)
+        return current is not None and current.decode() == holder
+
+    def advance(self, event_id, now, join=False):
+        self._get_client()
+        result = self._script(keys=[self.KEY.format(event_id=event_id)], args=[repr(now), '1' if join else '0'])
+        if result is None:
+            return None
+        rate, admitted, issued, position = result
+        return float(rate), float(admitted), int(issued), int(position) or None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """設定に応じた待合室バックエンドを取得（プロセス内で1つ）"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend = getattr(settings, 'WAITING_ROOM_BACKEND', 'memory')
+            if backend == 'redis':
+                _backend = RedisBackend(settings.WAITING_ROOM_REDIS_URL)
+            elif backend == 'memory':
+                _backend = InMemoryBackend()
+            else:
+                raise ValueError(f'不明な待合室バックエンドです: {backend}')
+        return _backend
+
+
+def configure_waiting_room(event):
+    """イベントの待合室の入場ペースをバックエンドに反映する（Noneの場合は待合室を無効にする）"""
+    get_backend().configure(event.pk, event.waiting_room_rate)
+
+
+def get_queue_status(event_id, position=None, join=False):
+    """
+    待合室の状態を取得する
+
+    Args:
+        event_id: イベントID
+        position: 整理券の順番
+        join: Trueの場合は新しい整理券の順番を発行する
+
+    Returns:
+        QueueStatus: 状態（待合室が無効の場合はNone）
+    """
+    result = get_backend().advance(event_id, time.time(), join=join)
+    if result is None:
+        return None
+    rate, admitted, issued, issued_position = result
+    return QueueStatus(rate, math.floor(admitted), issued, issued_position if join else position)
+
+
+def make_queue_token(event_id, position):
+    return signing.dumps({'e': event_id, 'p': position}, salt=QUEUE_SALT, compress=True)
+
+
+def read_queue_token(request, event_id):
+    """Cookieの整理券の順番を取得する（無効な場合はNone）"""
+    token = request.COOKIES.get(QUEUE_COOKIE.format(event_id=event_id))
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=QUEUE_SALT, max_age=QUEUE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    if data.get('e') != event_id:
+        return None
+    return data.get('p')
+
+
+def _session_key(request):
+    """入場トークンを結び付けるセッションキー（セッションがない場合は作成する）"""
+    if request.session.session_key is None:
+        request.session.save()
+    return request.session.session_key
+
+
+def _read_admission(token, event_id):
+    """入場トークンが結び付いたセッションキー（無効な場合はNone）"""
+    try:
+        data = signing.loads(
+            token, salt=ADMISSION_SALT, max_age=settings.WAITING_ROOM_ADMISSION_MINUTES * 60
+        )
+    except signing.BadSignature:
+        return None
+    if data.get('e') != event_id:
+        return None
+    return data.get('s')
+
+
+def has_admission(request, event_id):
+    """Cookieにこのセッションの有効な入場トークンがあるか（DB・バックエンドを参照しない）"""
+    token = request.COOKIES.get(ADMISSION_COOKIE.format(event_id=event_id))
+    if not token or request.session.session_key is None:
+        return False
+    return _read_admission(token, event_id) == request.session.session_key
+
+
+def admit(request, event_id, position):
+    """
+    入場を許可された整理券を入場トークンに交換する
+
+    整理券の順番は1つのセッションでしか交換できない（同じセッションの再交換は許可する）。
+    入場トークンのCookieはレスポンスの送信時にミドルウェアが設定する。
+
+    Args:
+        request: リクエスト
+        event_id: イベントID
+        position: 整理券の順番（待合室が無効の場合はNone）
+
+    Returns:
+        bool: 交換した場合はTrue（他のセッションで交換済みの整理券の場合はFalse）
+    """
+    session_key = _session_key(request)
+    if position is not None and not get_backend().redeem(event_id, position, session_key, QUEUE_TOKEN_MAX_AGE):
+        return False
+    request.waiting_room_admitted = event_id
+    return True
+
+
+def set_queue_cookie(response, event_id, position):
+    response.set_cookie(
+        QUEUE_COOKIE.format(event_id=event_id), make_queue_token(event_id, position),
+        max_age=QUEUE_TOKEN_MAX_AGE, httponly=True, samesite='Lax',
+    )
+
+
+def set_admission_cookie(response, event_id, session_key):
+    response.set_cookie(
+        ADMISSION_COOKIE.format(event_id=event_id),
+        signing.dumps({'e': event_id, 's': session_key}, salt=ADMISSION_SALT),
+        max_age=settings.WAITING_ROOM_ADMISSION_MINUTES * 60, httponly=True, samesite='Lax',
+    )
+
+
+def rebind_admission_cookies(request, response, previous_session_key):
+    """
+    セッションキーが変わった場合（ログイン・ログアウト）に、前のセッションの入場トークンを新しいキーで発行し直す
+
+    Args:
+        request: リクエスト
+        response: レスポンス
+        previous_session_key: リクエスト受信時のセッションキー
+    """
+    session_key = request.session.session_key
+    if previous_session_key is None or session_key is None or session_key == previous_session_key:
+        return
+    prefix = ADMISSION_COOKIE.format(event_id='')
+    for name, token in request.COOKIES.items():
+        if not name.startswith(prefix) or not name[len(prefix):].isdigit():
+            continue
+        event_id = int(name[len(prefix):])
+        if name in response.cookies:
+            continue
+        if _read_admission(token, event_id) == previous_session_key:
+            set_admission_cookie(response, event_id, session_key)
@@ -0,0 +1,406 @@
+"""
+カートの保存先
+
+カートの中身は購入確定まで一時的に保持するだけで、多くは購入されずに期限切れになる。
+販売開始時のカート操作をDBから切り離せるよう、保存先を設定 CART_STORE で切り替える:
+    - 'db':    Cart・CartItemテーブル
+    - 'cache': Djangoのキャッシュ（本番はRedis）。DBに保存するのは座席の状態・在庫と確定した注文のみ
+
+どちらの保存先も同じインターフェースで、サービス層（services.py）からのみ使う:
+    lock(user_id)                 カートをロックして取得（ない場合はNone）
+    get(user_id)                  カートを取得（ロックしない）
+    create(user_id)               空のカートを作成
+    items(cart)                   カートアイテム（座席・チケット種別・イベントを取得済み）
+    has_items(cart)               カートアイテムがあるか
+    add_items(cart, event_id, seat_ids, ticket_type_id, quantity)
+    remove_item(cart, item_id)    カートアイテムを削除して返す（ない場合はNone）
+    set_expiry(cart, expires_at)  有効期限を変更
+    delete(cart)                  カートを削除
+    claim_expired(now, limit)     期限切れのカートを解放用に確保し、[(利用者ID, カートアイテム), ...] を返す（削除しない）
+    delete_expired(expired, now)  確保したカートを削除（座席・在庫を戻すトランザクションのコミットと同時・コミット後）
+    discard_seats(holds)          解放済みの座席 [(利用者ID, イベントID, 座席ID), ...] をカートから削除
+
+カートアイテムは event_id・seat_id・ticket_type_id を持つ（座席指定は seat_id と選んだチケット種別の
+ticket_type_id、自由席は ticket_type_id のみ）。
+"""
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from apps.events.models import Event, TicketType
+from apps.seats.models import Seat
+from .models import Cart, CartItem, default_cart_expiry, remaining_seconds
+
+
+class CartLocked(Exception):
+    """カートを他のリクエストが更新中"""
+
+
+class DatabaseCartStore:
+    """DBのカート（トランザクション内で使う）"""
+
+    @contextmanager
+    def lock(self, user_id):
+        yield Cart.objects.select_for_update().filter(user_id=user_id).first()
+
+    def get(self, user_id):
+        return Cart.objects.filter(user_id=user_id).first()
+
+    def create(self, user_id):
+        return Cart.objects.create(user_id=user_id)
+
+    def items(self, cart):
+        return list(cart.items.select_related('seat__venue', 'ticket_type', 'event'))
+
+    def has_items(self, cart):
+        return cart.items.exists()
+
+    def add_items(self, cart, event_id, seat_ids=(), ticket_type_id=None, quantity=0):
+        CartItem.objects.bulk_create(
+            [
+                CartItem(cart=cart, seat_id=seat_id, ticket_type_id=ticket_type_id, event_id=event_id)
+                for seat_id in seat_ids
+            ]
+            + [CartItem(cart=cart, ticket_type_id=ticket_type_id, event_id=event_id) for _ in range(quantity)]
+        )
+
+    def remove_item(self, cart, item_id):
+        item = cart.items.filter(pk=item_id).first()
+        if item is not None:
+            item.delete()
+        return item
+
+    def set_expiry(self, cart, expires_at):
+        cart.expires_at = expires_at
+        cart.save(update_fields=['expires_at', 'updated_at'])
+
+    def delete(self, cart):
+        cart.items.all().delete()
+        cart.delete()
+
+    def claim_expired(self, now, limit):
+        # 行ロックで確保する（購入確定中のカートはスキップ）
+        carts = dict(
+            Cart.objects.select_for_update(skip_locked=True).filter(
+                expires_at__lte=now
+            ).order_by('expires_at').values_list('id', 'user_id')[:limit]
+        )
+        if not carts:
+            return []
+        items = defaultdict(list)
+        for item in CartItem.objects.filter(cart_id__in=carts).only('cart_id', 'event_id', 'seat_id', 'ticket_type_id'):
+            items[item.cart_id].append(item)
+        return [(user_id, items[cart_id]) for cart_id, user_id in carts.items()]
+
+    def delete_expired(self, expired, now):
+        # 座席・在庫を戻すのと同じトランザクションで削除する（ロールバック時はカートも残る）
+        carts = Cart.objects.filter(user_id__in=[user_id for user_id, items in expired], expires_at__lte=now)
+        CartItem.objects.filter(cart__in=carts).delete()
+        carts.delete()
+
+    def discard_seats(self, holds):
+        seats_by_user = defaultdict(lambda: defaultdict(list))
+        for user_id, event_id, seat_id in holds:
+            seats_by_user[user_id][event_id].append(seat_id)
+        deleted = 0
+        for user_id, seats_by_event in seats_by_user.items():
+            for event_id, seat_ids in seats_by_event.items():
+                count, _ = CartItem.objects.filter(
+                    cart__user_id=user_id, event_id=event_id, seat_id__in=seat_ids
+                ).delete()
+                deleted += count
+        return deleted
+
+
+class CachedCart:
+    """キャッシュに保存したカート"""
+
+    def __init__(self, user_id, expires_at, items=None, next_id=1):
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.item_list = items or []
+        self.next_id = next_id
+
+    @property
+    def pk(self):
+        return self.user_id
+
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+    @property
+    def remaining_seconds(self):
+        return remaining_seconds(self.expires_at)
+
+
+class CachedCartItem:
+    """キャッシュに保存したカートアイテム（座席・チケット種別・イベントは items() で取得）"""
+
+    def __init__(self, id, event_id, seat_id=None, ticket_type_id=None):
+        self.id = self.pk = id
+        self.event_id = event_id
+        self.seat_id = seat_id
+        self.ticket_type_id = ticket_type_id
+        self.seat = self.ticket_type = self.event = None
+
+
+class CacheCartStore:
+    """
+    Djangoのキャッシュのカート
+
+    カートは利用者ごとに1キーで保存し、更新はキャッシュ上のロック（cache.add）で直列化する。
+    ロックは座席・在庫を更新するトランザクションのコミット後に解放する。
+    期限切れのカートを見つけられるよう、有効期限の分ごとに利用者IDの索引を保存する。
+    索引は分ごとの件数（cache.incr）で番号を払い出し、番号ごとのキーに利用者IDを書くため、
+    カートの作成・延長どうしでロックを取り合わない。
+    キャッシュはDBのトランザクションでロールバックされないため、期限切れのカートはロックしたまま返し、
+    座席・在庫を戻すトランザクションのコミット後に削除する（ロールバックした場合はロックの期限後に再び解放する）。
+    キャッシュから追い出されると確保した座席・在庫を戻せなくなるため、Redisでは追い出しを無効にすること。
+    """
+
+    CART_KEY = 'cart:{user_id}'
+    LOCK_KEY = 'cart:lock:{user_id}'
+    INDEX_COUNT_KEY = 'cart:expiry:{bucket}'
+    INDEX_KEY = 'cart:expiry:{bucket}:{slot}'
+    EXPIRED_LOCK_TOKEN = 'expired:{now}'
+    CURSOR_KEY = 'cart:expiry:cursor'
+
+    # ロックの保持上限・取得の待ち時間（秒）
+    LOCK_TIMEOUT = 30
+    LOCK_WAIT = 5
+    # 期限切れ後もカートを保持する時間（秒）。解放処理が止まっていても座席・在庫を戻せるようにする
+    RETENTION = 24 * 60 * 60
+
+    def _acquire(self, key, wait=None):
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + (self.LOCK_WAIT if wait is None else wait)
+        while not cache.add(key, token, self.LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                raise CartLocked('カートを更新中です。しばらくしてから再度お試しください')
+            time.sleep(0.01)
+        return token
+
+    def _release(self, key, token):
+        if cache.get(key) == token:
+            cache.delete(key)
+
+    @contextmanager
+    def _lock(self, key, wait=None):
+        token = self._acquire(key, wait)
+        try:
+            yield
+        finally:
+            self._release(key, token)
+
+    def _load(self, user_id):
+        data = cache.get(self.CART_KEY.format(user_id=user_id))
+        if data is None:
+            return None
+        return CachedCart(
+            user_id,
+            datetime.fromtimestamp(data['expires_at'], tz=dt_timezone.utc),
+            [CachedCartItem(*item) for item in data['items']],
+            data['next_id'],
+        )
+
+    def _save(self, cart):
+        cache.set(self.CART_KEY.format(user_id=cart.user_id), {
+            'expires_at': cart.expires_at.timestamp(),
+            'next_id': cart.next_id,
+            'items': [
+                [item.id, item.event_id, item.seat_id, item.ticket_type_id] for item in cart.item_list
+            ],
+        }, max(cart.remaining_seconds, 0) + self.RETENTION)
+
+    def _bucket(self, moment):
+        return int(moment.timestamp()) // 60
+
+    def _index(self, cart):
+        bucket = self._bucket(cart.expires_at)
+        timeout = max(cart.remaining_seconds, 0) + self.RETENTION
+        count_key = self.INDEX_COUNT_KEY.format(bucket=bucket)
+        cache.add(count_key, 0, timeout)
+        slot = cache.incr(count_key)
+        cache.set(self.INDEX_KEY.format(bucket=bucket, slot=slot), cart.user_id, timeout)
+
+    @contextmanager
+    def lock(self, user_id):
+        # 座席・在庫の更新がコミットされるまでロックを保持する（ブロックを抜けた時点で解放すると、
+        # 次のリクエストがコミット前の座席・在庫とカートの中身を組み合わせてしまう）。
+        # 例外で抜けた場合はロールバックされるため、その場で解放する
+        key = self.LOCK_KEY.format(user_id=user_id)
+        token = self._acquire(key)
+        try:
+            yield self._load(user_id)
+        except BaseException:
+            self._release(key, token)
+            raise
+        transaction.on_commit(lambda: self._release(key, token))
+
+    def get(self, user_id):
+        return self._load(user_id)
+
+    def create(self, user_id):
+        cart = CachedCart(user_id, default_cart_expiry())
+        self._save(cart)
+        self._index(cart)
+        return cart
+
+    def items(self, cart):
+        items = list(cart.item_list)
+        seats = Seat.objects.select_related('venue').in_bulk({item.seat_id for item in items if item.seat_id})
+        ticket_types = TicketType.objects.in_bulk({item.ticket_type_id for item in items if item.ticket_type_id})
+        events = Event.objects.in_bulk({item.event_id for item in items})
+        for item in items:
+            item.seat = seats.get(item.seat_id)
+            item.ticket_type = ticket_types.get(item.ticket_type_id)
+            item.event = events.get(item.event_id)
+        return items
+
+    def has_items(self, cart):
+        return bool(cart.item_list)
+
+    def add_items(self, cart, event_id, seat_ids=(), ticket_type_id=None, quantity=0):
+        for seat_id in seat_ids:
+            cart.item_list.append(CachedCartItem(cart.next_id, event_id, seat_id=seat_id, ticket_type_id=ticket_type_id))
+            cart.next_id += 1
+        for _ in range(quantity):
+            cart.item_list.append(CachedCartItem(cart.next_id, event_id, ticket_type_id=ticket_type_id))
+            cart.next_id += 1
+        self._save(cart)
+
+    def remove_item(self, cart, item_id):
+        for item in cart.item_list:
+            if item.id == item_id:
+                cart.item_list.remove(item)
+                self._save(cart)
+                return item
+        return None
+
+    def set_expiry(self, cart, expires_at):
+        cart.expires_at = expires_at
+        self._save(cart)
+        self._index(cart)
+
+    def delete(self, cart):
+        cache.delete(self.CART_KEY.format(user_id=cart.user_id))
+
+    def claim_expired(self, now, limit):
+        current = self._bucket(now)
+        # 初回は保持期間分さかのぼって探す
+        cursor = cache.get(self.CURSOR_KEY)
+        if cursor is None:
+            cursor = current - self.RETENTION // 60
+        token = self.EXPIRED_LOCK_TOKEN.format(now=now.timestamp())
+        expired = []
+        claimed = set()
+        # 処理の終わった分まで cursor を進める（書き込み中の索引を読み飛ばさないよう、現在の1分前まで）
+        advance = True
+
+        for bucket in range(cursor, current + 1):
+            if len(expired) >= limit:
+                break
+            count_key = self.INDEX_COUNT_KEY.format(bucket=bucket)
+            slot_keys = [
+                self.INDEX_KEY.format(bucket=bucket, slot=slot) for slot in range(1, cache.get(count_key, 0) + 1)
+            ]
+            entries = cache.get_many(slot_keys)
+            done = []
+            pending = False
+            for key in slot_keys:
+                if key not in entries:
+                    continue
+                user_id = entries[key]
+                if user_id in claimed:
+                    done.append(key)
+                    continue
+                if len(expired) >= limit:
+                    pending = True
+                    break
+                lock_key = self.LOCK_KEY.format(user_id=user_id)
+                if not cache.add(lock_key, token, self.LOCK_TIMEOUT):
+                    # 購入確定中・解放中のカートはスキップ
+                    pending = True
+                    continue
+                cart = self._load(user_id)
+                if cart is not None and cart.expires_at <= now:
+                    # ロックしたまま返し、コミット後に削除する（索引は削除後の次の呼び出しで消す）
+                    expired.append((user_id, cart.item_list))
+                    claimed.add(user_id)
+                    pending = True
+                    continue
+                cache.delete(lock_key)
+                if cart is not None and self._bucket(cart.expires_at) == bucket:
+                    # この分のうちにまだ期限が来ていない
+                    pending = True
+                else:
+                    # 削除済み・有効期限を変更したカート（変更後の分の索引で見つける）
+                    done.append(key)
+            cache.delete_many(done)
+
+            advance = advance and not pending and bucket < current - 1
+            if advance:
+                cache.delete(count_key)
+                cache.set(self.CURSOR_KEY, bucket + 1, None)
+        return expired
+
+    def delete_expired(self, expired, now):
+        token = self.EXPIRED_LOCK_TOKEN.format(now=now.timestamp())
+        user_ids = [user_id for user_id, items in expired]
+
+        def delete():
+            for user_id in user_ids:
+                cart = self._load(user_id)
+                if cart is not None and cart.expires_at <= now:
+                    self.delete(cart)
+                lock_key = self.LOCK_KEY.format(user_id=user_id)
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+
+        transaction.on_commit(delete)
+
+    def discard_seats(self, holds):
+        seats_by_user = defaultdict(set)
+        for user_id, event_id, seat_id in holds:
+            seats_by_user[user_id].add((event_id, seat_id))
+        deleted = 0
+        for user_id, seats in seats_by_user.items():
+            try:
+                with self._lock(self.LOCK_KEY.format(user_id=user_id), wait=0):
+                    cart = self._load(user_id)
+                    if cart is None:
+                        continue
+                    kept = [item for item in cart.item_list if (item.event_id, item.seat_id) not in seats]
+                    deleted += len(cart.item_list) - len(kept)
+                    if len(kept) != len(cart.item_list):
+                        cart.item_list = kept
+                        self._save(cart)
+            except CartLocked:
+                # 購入確定中のカートは待たずにスキップ（解放済みの座席は購入確定で検出される）
+                continue
+        return deleted
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_cart_store():
+    """設定に応じたカートの保存先を取得（プロセス内で1つ）"""
+    name = getattr(settings, 'CART_STORE', 'db')
+    with _stores_lock:
+        if name not in _stores:
+            if name == 'db':
+                _stores[name] = DatabaseCartStore()
+            elif name == 'cache':
+                _stores[name] = CacheCartStore()
+            else:
+                raise ValueError(f'不明なカートの保存先です: {name}')
+        return _stores[name]
@@ -0,0 +1,49 @@
+"""イベント中止などで注文を一括キャンセル・返金するコマンド"""
+from django.core.management.base import BaseCommand, CommandError
+from apps.events.models import Event
+from apps.orders.models import Cancellation, CancellationRun
+from apps.orders.services import create_cancellation_run, run_cancellation
+
+
+class Command(BaseCommand):
+    help = '注文を一括キャンセル・返金します（中断した場合は --run で再開）'
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--event', type=int, help='イベントID（イベントの全注文が対象）')
+        target.add_argument('--cancellations', type=int, nargs='+', help='キャンセル申請ID')
+        target.add_argument('--run', type=int, help='再開する実行記録のID')
+        parser.add_argument('--reason', default='', help='キャンセル申請がない注文に記録する理由')
+        parser.add_argument('--chunk-size', type=int, default=None, help='1トランザクションで処理する注文数')
+
+    def handle(self, *args, **options):
+        run = self.get_run(options)
+        self.stdout.write(f'実行記録 #{run.pk} を処理します（処理済みの注文ID: {run.last_order_id}）')
+
+        while run.status != 'completed':
+            run = run_cancellation(run, chunk_size=options['chunk_size'], max_chunks=1)
+            self.stdout.write(
+                f'注文: {run.processed_orders}件 / チケット: {run.cancelled_tickets}枚 / '
+                f'返金額: ¥{run.refunded_amount:,.0f} / 処理済みの注文ID: {run.last_order_id}'
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'実行記録 #{run.pk} が完了しました'))
+
+    def get_run(self, options):
+        if options['run']:
+            try:
+                return CancellationRun.objects.get(pk=options['run'])
+            except CancellationRun.DoesNotExist:
+                raise CommandError(f"実行記録 #{options['run']} が見つかりません")
+
+        if options['event']:
+            try:
+                event = Event.objects.get(pk=options['event'])
+            except Event.DoesNotExist:
+                raise CommandError(f"イベント #{options['event']} が見つかりません")
+            return create_cancellation_run(event=event, reason=options['reason'])
+
+        cancellations = Cancellation.objects.filter(id__in=options['cancellations'])
+        if cancellations.count() != len(set(options['cancellations'])):
+            raise CommandError('見つからないキャンセル申請があります')
+        return create_cancellation_run(cancellations=cancellations, reason=options['reason'])
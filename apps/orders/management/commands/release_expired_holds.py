@@ -0,0 +1,35 @@
+"""期限切れの仮予約・カートを解放するコマンド（Celery beatが使えない環境向け）"""
+import time
+from django.core.management.base import BaseCommand
+from apps.orders.services import release_expired_carts, release_expired_holds
+
+
+class Command(BaseCommand):
+    help = '期限切れの仮予約（カート内の座席）と有効期限の切れたカートを解放します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='1トランザクションで解放する最大件数')
+        parser.add_argument('--max-batches', type=int, default=None, help='最大バッチ数')
+        parser.add_argument('--interval', type=int, default=0, help='指定秒ごとに繰り返し実行（0の場合は1回のみ）')
+
+    def handle(self, *args, **options):
+        while True:
+            result = release_expired_holds(
+                batch_size=options['batch_size'],
+                max_batches=options['max_batches'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"解放: {result['released']}席 / カートアイテム削除: {result['cart_items_deleted']}件 / "
+                f"バッチ: {result['batches']} / 所要時間: {result['elapsed_ms']}ms"
+            ))
+            result = release_expired_carts(
+                batch_size=options['batch_size'],
+                max_batches=options['max_batches'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"カート削除: {result['carts']}件 / 解放: {result['seats']}席・自由席{result['tickets']}枚 / "
+                f"バッチ: {result['batches']} / 所要時間: {result['elapsed_ms']}ms"
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
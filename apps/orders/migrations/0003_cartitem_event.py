@@ -0,0 +1,39 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_cart_item_event(apps, schema_editor):
+    """既存のカートアイテムにイベントを設定する"""
+    CartItem = apps.get_model('orders', 'CartItem')
+    EventSeat = apps.get_model('seats', 'EventSeat')
+
+    for item in CartItem.objects.filter(event__isnull=True).select_related('ticket_type').iterator():
+        if item.ticket_type_id:
+            event_id = item.ticket_type.event_id
+        else:
+            event_id = EventSeat.objects.filter(
+                seat_id=item.seat_id,
+                status='reserved',
+            ).values_list('event_id', flat=True).first()
+        if event_id:
+            CartItem.objects.filter(pk=item.pk).update(event_id=event_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_initial'),
+        ('orders', '0002_cartitem_ticket_type_alter_cartitem_seat_and_more'),
+        ('seats', '0003_migrate_seat_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='event',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cart_items', to='events.event'),
+        ),
+        migrations.RunPython(populate_cart_item_event, migrations.RunPython.noop),
+    ]
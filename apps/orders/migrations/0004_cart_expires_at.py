@@ -0,0 +1,25 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:19
+
+import apps.orders.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_cartitem_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='expires_at',
+            field=models.DateTimeField(default=apps.orders.models.default_cart_expiry),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['expires_at'], name='idx_carts_expires_at'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0006_event_waiting_room_rate'),
+        ('orders', '0004_cart_expires_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CancellationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cancellation_ids', models.JSONField(blank=True, default=list, verbose_name='キャンセル申請ID')),
+                ('reason', models.TextField(blank=True, verbose_name='キャンセル理由')),
+                ('status', models.CharField(choices=[('pending', '待機中'), ('running', '実行中'), ('completed', '完了'), ('failed', '失敗')], default='pending', max_length=20, verbose_name='ステータス')),
+                ('last_order_id', models.BigIntegerField(default=0, verbose_name='処理済みの注文ID')),
+                ('processed_orders', models.PositiveIntegerField(default=0, verbose_name='キャンセルした注文数')),
+                ('cancelled_tickets', models.PositiveIntegerField(default=0, verbose_name='無効化したチケット数')),
+                ('refunded_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='返金額')),
+                ('error', models.TextField(blank=True, verbose_name='エラー')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='開始日時')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完了日時')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cancellation_runs', to=settings.AUTH_USER_MODEL, verbose_name='実行者')),
+                ('event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cancellation_runs', to='events.event', verbose_name='イベント')),
+            ],
+            options={
+                'db_table': 'cancellation_runs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='idx_cancel_runs_status')],
+            },
+        ),
+    ]
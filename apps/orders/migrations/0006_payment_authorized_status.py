@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_cancellation_runs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', '未払い'), ('authorized', '与信済み'), ('completed', '完了'), ('failed', '失敗'), ('refunded', '返金済み')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:59
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_captured_at(apps, schema_editor):
+    """売上確定済みの既存の支払いに売上確定日時を設定する"""
+    Payment = apps.get_model('orders', 'Payment')
+    Payment.objects.filter(status='completed', captured_at__isnull=True).update(
+        captured_at=Coalesce('paid_at', 'created_at')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_payment_authorized_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='captured_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', '未払い'), ('authorized', '与信済み'), ('completed', '完了'), ('failed', '失敗'), ('refund_pending', '返金処理中'), ('refunded', '返金済み')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(populate_captured_at, migrations.RunPython.noop),
+    ]
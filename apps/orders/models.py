@@ -1,9 +1,21 @@
+from datetime import timedelta
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from apps.events.models import Event
 from apps.seats.models import Seat
 
 
+def default_cart_expiry():
+    """カートの有効期限（最初に商品を入れてから SEAT_HOLD_MINUTES 分）"""
+    return timezone.now() + timedelta(minutes=settings.SEAT_HOLD_MINUTES)
+
+
+def remaining_seconds(expires_at):
+    """有効期限までの残り秒数"""
+    return max(int((expires_at - timezone.now()).total_seconds()), 0)
+
+
 class Cart(models.Model):
     """カートモデル"""
     user = models.ForeignKey(
@@ -11,20 +23,35 @@ class Cart(models.Model):
         on_delete=models.CASCADE,
         related_name='carts'
     )
+    # 期限を過ぎたカートは座席・自由席の在庫ごと解放される
+    expires_at = models.DateTimeField(default=default_cart_expiry)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'carts'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['expires_at'], name='idx_carts_expires_at'),
+        ]
     
     def __str__(self):
         return f"Cart #{self.id} - {self.user.username}"
     
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+    
+    @property
+    def remaining_seconds(self):
+        """有効期限までの残り秒数"""
+        return remaining_seconds(self.expires_at)
+    
     @property
     def total_amount(self):
         """カート内の合計金額"""
-        return sum(item.seat.get_price() for item in self.items.all())
+        from apps.orders.pricing import price_cart_items
+        return price_cart_items(self.items.select_related('seat'))
     
     @property
     def item_count(self):
@@ -53,6 +80,13 @@ class CartItem(models.Model):
         null=True,
         blank=True
     )
+    event = models.ForeignKey(
+        Event,
+        on_delete=models.CASCADE,
+        related_name='cart_items',
+        null=True,
+        blank=True
+    )
     added_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -106,8 +140,10 @@ class Payment(models.Model):
 
     STATUS_CHOICES = [
         ('pending', '未払い'),
+        ('authorized', '与信済み'),
         ('completed', '完了'),
         ('failed', '失敗'),
+        ('refund_pending', '返金処理中'),
         ('refunded', '返金済み'),
     ]
 
@@ -121,6 +157,8 @@ class Payment(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     transaction_id = models.CharField(max_length=100, blank=True)
     paid_at = models.DateTimeField(null=True, blank=True)
+    # 売上確定日時（キャンセル時に返金するか与信を取り消すかを判断する）
+    captured_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -166,3 +204,61 @@ class Cancellation(models.Model):
     def __str__(self):
         return f"Cancellation #{self.id} - Order {self.order.order_number}"
 
+
+
+class CancellationRun(models.Model):
+    """
+    一括キャンセル・返金の実行記録
+    
+    対象の注文を注文ID順にチャンク単位で処理し、チャンクごとに処理済みの注文ID（last_order_id）を
+    同じトランザクションで記録する。中断した場合は記録した位置から再開できる。
+    """
+    STATUS_CHOICES = [
+        ('pending', '待機中'),
+        ('running', '実行中'),
+        ('completed', '完了'),
+        ('failed', '失敗'),
+    ]
+    
+    # 対象（イベントの全注文、または指定したキャンセル申請の注文）
+    event = models.ForeignKey(
+        Event,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='cancellation_runs',
+        verbose_name='イベント'
+    )
+    cancellation_ids = models.JSONField('キャンセル申請ID', default=list, blank=True)
+    reason = models.TextField('キャンセル理由', blank=True)
+    
+    status = models.CharField('ステータス', max_length=20, choices=STATUS_CHOICES, default='pending')
+    last_order_id = models.BigIntegerField('処理済みの注文ID', default=0)
+    processed_orders = models.PositiveIntegerField('キャンセルした注文数', default=0)
+    cancelled_tickets = models.PositiveIntegerField('無効化したチケット数', default=0)
+    refunded_amount = models.DecimalField('返金額', max_digits=14, decimal_places=2, default=0)
+    error = models.TextField('エラー', blank=True)
+    
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='cancellation_runs',
+        verbose_name='実行者'
+    )
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+    started_at = models.DateTimeField('開始日時', null=True, blank=True)
+    finished_at = models.DateTimeField('完了日時', null=True, blank=True)
+    
+    class Meta:
+        db_table = 'cancellation_runs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='idx_cancel_runs_status'),
+        ]
+    
+    def __str__(self):
+        target = f"Event #{self.event_id}" if self.event_id else f"{len(self.cancellation_ids)} cancellations"
+        return f"CancellationRun #{self.id} - {target}"
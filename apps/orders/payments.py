@@ -0,0 +1,216 @@
+"""
+決済ゲートウェイの接続
+
+購入確定では、ゲートウェイとの通信（与信）を座席ロックを持つトランザクションの外で行う。
+    1. 予約: 注文・支払いを「支払待ち」で作成し、カートの有効期限を与信の間だけ延長する（短いトランザクション）
+    2. 与信: ゲートウェイに与信を依頼する（トランザクションの外）
+    3. 確定: 座席を売約済みにしてチケットを発行する（短いトランザクション）。売上確定はコミット後にCeleryで行う
+座席ロックの保持時間はゲートウェイの応答時間に左右されない。
+
+接続先は設定 PAYMENT_PROVIDER で切り替える:
+    - 'stub': 通信せずに常に承認する（開発・テスト用）
+    - 'http': HTTPのゲートウェイ（PAYMENT_GATEWAY_URL。接続はプロセス内で使い回す）
+
+ゲートウェイの障害が続いた場合はサーキットブレーカーが開き、一定時間は通信せずに
+すぐに GatewayUnavailable を返す（購入者を待たせず、障害中のゲートウェイに負荷をかけない）。
+
+プロバイダーの操作（authorize・capture・void・refund）は、失敗をすべて PaymentError
+（拒否は PaymentDeclined、通信・応答の異常は GatewayUnavailable）として送出する。
+"""
+import threading
+import time
+import uuid
+from django.conf import settings
+
+
+class PaymentError(Exception):
+    """決済エラー"""
+
+
+class PaymentDeclined(PaymentError):
+    """カード会社などに決済を拒否された"""
+
+
+class GatewayUnavailable(PaymentError):
+    """ゲートウェイに接続できない・応答がない（サーキットブレーカーが開いている場合を含む）"""
+
+
+class Authorization:
+    """与信の結果"""
+
+    def __init__(self, transaction_id, amount):
+        self.transaction_id = transaction_id
+        self.amount = amount
+
+
+class CircuitBreaker:
+    """
+    サーキットブレーカー（スレッドセーフ）
+
+    連続して failure_threshold 回失敗すると開き、reset_timeout 秒は呼び出しを拒否する。
+    その後の1回の試行（半開）が成功すれば閉じ、失敗すれば再び開く。
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def before_call(self):
+        """呼び出し前の確認（開いている場合は GatewayUnavailable）"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial:
+                raise GatewayUnavailable('決済ゲートウェイが一時的に利用できません')
+            # 半開: 1回だけ試行を通す
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class StubProvider:
+    """通信しない決済プロバイダー（開発・テスト用。常に承認する）"""
+
+    def authorize(self, amount, reference, idempotency_key):
+        return Authorization(f'stub_{uuid.uuid4().hex}', amount)
+
+    def capture(self, transaction_id, amount, idempotency_key):
+        return None
+
+    def void(self, transaction_id, idempotency_key):
+        return None
+
+    def refund(self, transaction_id, amount, idempotency_key):
+        return None
+
+
+class HttpProvider:
+    """
+    HTTPの決済ゲートウェイ
+
+    接続はプロセス内の1つのセッションで使い回し（Keep-Alive・接続プール）、
+    接続・応答待ちにはタイムアウトを設定する。再送しても二重に処理されないよう冪等キーを付ける。
+    """
+
+    def __init__(self, base_url, api_key, timeout, pool_size, breaker):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.breaker = breaker
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Authorization'] = f'Bearer {self.api_key}'
+                self._session = session
+            return self._session
+
+    def _post(self, path, payload, idempotency_key):
+        import requests
+        session = self._get_session()
+        self.breaker.before_call()
+        try:
+            response = session.post(
+                f'{self.base_url}{path}',
+                json=payload,
+                headers={'Idempotency-Key': idempotency_key},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise GatewayUnavailable(f'決済ゲートウェイに接続できません: {e}') from e
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            raise GatewayUnavailable(f'決済ゲートウェイのエラーです（{response.status_code}）')
+        # 4xxはゲートウェイが正常に応答した結果のため、障害として数えない
+        self.breaker.record_success()
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('message', '')
+            except (ValueError, AttributeError):
+                message = ''
+            raise PaymentDeclined(message or f'決済が拒否されました（{response.status_code}）')
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise GatewayUnavailable('決済ゲートウェイの応答が不正です') from e
+        if not isinstance(data, dict):
+            raise GatewayUnavailable('決済ゲートウェイの応答が不正です')
+        return data
+
+    def authorize(self, amount, reference, idempotency_key):
+        data = self._post('/authorizations', {
+            'amount': str(amount),
+            'currency': 'JPY',
+            'reference': reference,
+        }, idempotency_key)
+        if not data.get('id'):
+            raise GatewayUnavailable('決済ゲートウェイの応答に与信IDがありません')
+        return Authorization(str(data['id']), amount)
+
+    def capture(self, transaction_id, amount, idempotency_key):
+        self._post(f'/authorizations/{transaction_id}/capture', {'amount': str(amount)}, idempotency_key)
+
+    def void(self, transaction_id, idempotency_key):
+        self._post(f'/authorizations/{transaction_id}/void', {}, idempotency_key)
+
+    def refund(self, transaction_id, amount, idempotency_key):
+        self._post(f'/authorizations/{transaction_id}/refunds', {'amount': str(amount)}, idempotency_key)
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """設定に応じた決済プロバイダーを取得（プロセス内で1つ）"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            provider = getattr(settings, 'PAYMENT_PROVIDER', 'stub')
+            if provider == 'http':
+                _provider = HttpProvider(
+                    settings.PAYMENT_GATEWAY_URL,
+                    settings.PAYMENT_GATEWAY_API_KEY,
+                    timeout=(settings.PAYMENT_GATEWAY_CONNECT_TIMEOUT, settings.PAYMENT_GATEWAY_READ_TIMEOUT),
+                    pool_size=settings.PAYMENT_GATEWAY_POOL_SIZE,
+                    breaker=CircuitBreaker(
+                        settings.PAYMENT_BREAKER_FAILURE_THRESHOLD,
+                        settings.PAYMENT_BREAKER_RESET_SECONDS,
+                    ),
+                )
+            elif provider == 'stub':
+                _provider = StubProvider()
+            else:
+                raise ValueError(f'不明な決済プロバイダーです: {provider}')
+        return _provider
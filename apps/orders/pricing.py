@@ -0,0 +1,110 @@
+"""
+料金計算
+
+カートアイテムを価格に解決する。イベントごとのチケット種別の価格表はプロセス内に短時間キャッシュし、
+カート表示・購入確認・購入確定のすべてで同じ価格表を使う。
+
+価格の解決順:
+    1. カートアイテムにチケット種別がある場合（自由席、座席選択画面で選んだ座席指定）はその価格
+    2. 座席の座席種別に対応する座席指定チケット種別の価格（チケット種別のない以前のカートアイテム）
+    3. 座席種別が未指定の座席指定チケット種別の価格（全座席共通の価格）
+座席のカートアイテムのチケット種別は、座席指定で、座席種別が未指定か座席と同じものに限る。
+"""
+import threading
+import time
+from decimal import Decimal
+from apps.events.models import TicketType
+
+
+# 価格表のキャッシュ時間（秒）。同じプロセスでの変更は invalidate_price_table で即時反映する
+PRICE_TABLE_TTL = 60
+
+_price_tables = {}
+_price_tables_lock = threading.Lock()
+
+
+class PricingError(Exception):
+    """価格を決定できない場合の例外"""
+
+
+class PriceTable:
+    """イベントの価格表"""
+
+    def __init__(self, ticket_types):
+        self.by_ticket_type = {}
+        self.seat_types = {}
+        self.by_seat_type = {}
+        self.reserved_default = None
+        for ticket_type in sorted(ticket_types, key=lambda ticket_type: ticket_type.pk):
+            self.by_ticket_type[ticket_type.pk] = ticket_type.price
+            if ticket_type.type != 'reserved':
+                continue
+            self.seat_types[ticket_type.pk] = ticket_type.seat_type
+            if ticket_type.seat_type:
+                self.by_seat_type.setdefault(ticket_type.seat_type, ticket_type.price)
+            elif self.reserved_default is None:
+                self.reserved_default = ticket_type.price
+
+    def price_for(self, cart_item):
+        """
+        カートアイテムの価格を取得する
+
+        Raises:
+            PricingError: 対応するチケット種別がない場合
+        """
+        if cart_item.ticket_type_id and cart_item.seat_id:
+            seat_type = self.seat_types.get(cart_item.ticket_type_id)
+            if seat_type is None or seat_type not in ('', cart_item.seat.seat_type):
+                raise PricingError(f'{cart_item.seat} はこのチケット種別では購入できません')
+            price = self.by_ticket_type[cart_item.ticket_type_id]
+        elif cart_item.ticket_type_id:
+            price = self.by_ticket_type.get(cart_item.ticket_type_id)
+        elif cart_item.seat_id:
+            price = self.by_seat_type.get(cart_item.seat.seat_type, self.reserved_default)
+        else:
+            price = None
+        if price is None:
+            raise PricingError(f'{cart_item.seat or "チケット"} の価格が設定されていません')
+        return price
+
+
+def get_price_table(event_id):
+    """イベントの価格表を取得（プロセス内キャッシュ）"""
+    now = time.monotonic()
+    cached = _price_tables.get(event_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    table = PriceTable(TicketType.objects.filter(event_id=event_id).only('id', 'type', 'seat_type', 'price'))
+    with _price_tables_lock:
+        _price_tables[event_id] = (now + PRICE_TABLE_TTL, table)
+    return table
+
+
+def invalidate_price_table(event_id):
+    """イベントの価格表のキャッシュを破棄（チケット種別の登録・編集・削除時）"""
+    with _price_tables_lock:
+        _price_tables.pop(event_id, None)
+
+
+def price_cart_items(cart_items):
+    """
+    カートアイテムの価格を解決し、合計金額を計算する
+
+    各アイテムには unit_price を設定する。座席種別を参照するため、
+    座席はselect_relatedで取得しておくこと。
+
+    Args:
+        cart_items: CartItemのリスト（またはQuerySet）
+
+    Returns:
+        Decimal: 合計金額
+
+    Raises:
+        PricingError: 価格を決定できないアイテムがある場合
+    """
+    total = Decimal('0')
+    for cart_item in cart_items:
+        cart_item.unit_price = get_price_table(cart_item.event_id).price_for(cart_item)
+        total += cart_item.unit_price
+    return total
@@ -1,53 +1,374 @@
-import uuid
+import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
-from .models import Order, Payment, Cancellation
+from django.db.models import Exists, F, OuterRef, Q
+from .cart_store import get_cart_store
+from .models import Order, Payment, Cancellation, CancellationRun, default_cart_expiry
+from .payments import Authorization, PaymentError, get_provider
+from .pricing import price_cart_items
+from apps.core.ids import generate_id
 from apps.tickets.models import Ticket
-from apps.seats.models import Seat
+from apps.tickets.services.ticket_service import issue_tickets
+from apps.seats.models import EventSeat
+from apps.seats.services import record_seat_changes
+from apps.events.stock import reserve_stock, release_stock
 
 
-def create_order(user, cart):
+logger = logging.getLogger(__name__)
+
+# 注文番号の接頭辞（接頭辞 + 時刻順の識別子14文字）
+ORDER_NUMBER_PREFIX = 'ORD'
+
+
+def reserve_seats(user, event_id, seat_ids, all_or_nothing=False, mode=None, ticket_type_id=None):
+    """
+    座席をまとめて仮予約し、カートに追加する
+    
+    確保の方式は設定 SEAT_CLAIM_MODE で切り替える（同じ負荷で比較できるよう結果は同じ形式）。
+        - 'pessimistic': 座席ID順の1文でロックし、空席だけを条件付きUPDATE 1回で予約中にする
+        - 'optimistic':  ロックせずに状態とversionを読み、比較付きUPDATE 1回の更新件数で確保を判定する
+    
+    Args:
+        user: 購入者
+        event_id: イベントID
+        seat_ids: 座席IDのリスト
+        all_or_nothing: Trueの場合、1席でも確保できなければ何も確保しない
+        mode: 確保の方式（未指定時は設定値）
+        ticket_type_id: 座席選択画面で選んだ座席指定のチケット種別ID（カートアイテムの価格になる）
+    
+    Returns:
+        dict: {
+            'reserved': 確保した座席IDのリスト,
+            'conflicts': [{'seat_id': 座席ID, 'status': 現在の状態（在庫がない場合は'not_found'）}, ...],
+            'expires_at': カートの有効期限（確保できなかった場合はNone）
+        }
+    """
+    mode = mode or getattr(settings, 'SEAT_CLAIM_MODE', 'pessimistic')
+    if mode == 'pessimistic':
+        claim_seats = _claim_seats_pessimistic
+    elif mode == 'optimistic':
+        claim_seats = _claim_seats_optimistic
+    else:
+        raise ValueError(f'不明な座席確保方式です: {mode}')
+    
+    seat_ids = sorted(set(seat_ids))
+    
+    with transaction.atomic():
+        reserved, conflicts = claim_seats(user, event_id, seat_ids, timezone.now(), all_or_nothing)
+        expires_at = None
+        if reserved:
+            with open_cart(user) as cart:
+                get_cart_store().add_items(cart, event_id, seat_ids=reserved, ticket_type_id=ticket_type_id)
+            record_seat_changes(event_id, reserved)
+            expires_at = cart.expires_at
+    
+    return {'reserved': reserved, 'conflicts': conflicts, 'expires_at': expires_at}
+
+
+def reserve_free_tickets(user, ticket_type, quantity):
+    """
+    自由席チケットを在庫から確保してカートに追加する
+    
+    在庫は在庫シャードの条件付きUPDATEで確保するため、同時に購入されても総販売枚数を超えない。
+    
+    Args:
+        user: 購入者
+        ticket_type: 自由席のTicketType
+        quantity: 枚数（1以上）
+    
+    Returns:
+        bool: 追加できた場合True（在庫不足の場合はFalse）
+    """
+    with transaction.atomic():
+        if not reserve_stock(ticket_type.pk, quantity):
+            return False
+        with open_cart(user) as cart:
+            # 枚数分のカートアイテムを作成（座席なしで管理）
+            get_cart_store().add_items(
+                cart, ticket_type.event_id, ticket_type_id=ticket_type.pk, quantity=quantity
+            )
+    return True
+
+
+@contextmanager
+def open_cart(user):
+    """
+    商品を追加するカートをロックして開く（with文で使い、ブロックを抜けるまでロックを保持する）
+    
+    カートがない場合は作成し、期限切れのカートは中身を解放してから、空のカートは有効期限を
+    新しくしてから渡す（有効期限は最初に商品を入れた時点から数え、追加のたびには延長しない）。
+    
+    Args:
+        user: 購入者
+    
+    Yields:
+        カート（保存先に応じた Cart または CachedCart）
+    """
+    store = get_cart_store()
+    with store.lock(user.pk) as cart:
+        if cart is None:
+            cart = store.create(user.pk)
+        elif cart.is_expired:
+            release_cart_items([(user.pk, store.items(cart))])
+            store.delete(cart)
+            cart = store.create(user.pk)
+        elif not store.has_items(cart):
+            store.set_expiry(cart, default_cart_expiry())
+        yield cart
+
+
+def release_cart_items(holds):
+    """
+    カートアイテムが確保していた座席を空席に、自由席の枚数を在庫に戻す（カートアイテムは削除しない）
+    
+    座席は1文でロックして1文で更新し、自由席はチケット種別ごとに1回在庫を戻す。
+    カートの件数・枚数によらず文の数は一定（自由席のチケット種別数を除く）。
+    
+    Args:
+        holds: [(利用者ID, カートアイテムのリスト), ...]
+    
+    Returns:
+        dict: {'seats': 解放した座席数, 'tickets': 在庫に戻した自由席の枚数}
+    """
+    # カートの持ち主が仮予約中の座席だけを戻す（期限切れで他の購入者が確保し直した座席は対象外）
+    seats = defaultdict(list)
+    quantities = Counter()
+    for user_id, items in holds:
+        for item in items:
+            if item.seat_id:
+                seats[(user_id, item.event_id)].append(item.seat_id)
+            elif item.ticket_type_id:
+                quantities[item.ticket_type_id] += 1
+    
+    held = []
+    if seats:
+        condition = Q()
+        for (user_id, event_id), seat_ids in seats.items():
+            condition |= Q(reserved_by_id=user_id, event_id=event_id, seat_id__in=seat_ids)
+        held = list(
+            EventSeat.objects.select_for_update().filter(
+                condition, status='reserved'
+            ).order_by('seat_id').values_list('id', 'event_id', 'seat_id')
+        )
+    if held:
+        EventSeat.objects.filter(
+            id__in=[event_seat_id for event_seat_id, event_id, seat_id in held]
+        ).update(status='available', reserved_by=None, reserved_at=None)
+        seats_by_event = defaultdict(list)
+        for event_seat_id, event_id, seat_id in held:
+            seats_by_event[event_id].append(seat_id)
+        for event_id, seat_ids in seats_by_event.items():
+            record_seat_changes(event_id, seat_ids)
+    
+    for ticket_type_id, quantity in sorted(quantities.items()):
+        release_stock(ticket_type_id, quantity)
+    
+    return {'seats': len(held), 'tickets': sum(quantities.values())}
+
+
+def release_cart_item(user, item_id):
+    """
+    カートアイテムを削除し、確保していた座席・在庫を戻す
+    
+    Args:
+        user: 購入者
+        item_id: カートアイテムID
+    
+    Returns:
+        bool: 削除した場合True（カート・カートアイテムがない場合はFalse）
+    """
+    store = get_cart_store()
+    with transaction.atomic(), store.lock(user.pk) as cart:
+        item = store.remove_item(cart, item_id) if cart is not None else None
+        if item is None:
+            return False
+        release_cart_items([(user.pk, [item])])
+    return True
+
+
+def _seat_conflicts(seat_ids, statuses):
+    """確保できなかった座席の一覧（座席ID順）"""
+    return [
+        {'seat_id': seat_id, 'status': statuses.get(seat_id, 'not_found')}
+        for seat_id in seat_ids
+    ]
+
+
+def _claim_seats_pessimistic(user, event_id, seat_ids, reserved_at, all_or_nothing):
+    """
+    行ロックで座席を確保する
+    
+    座席ID順の1文でロックするため、座席が重なる購入者同士でもデッドロックしない。
+    
+    Returns:
+        tuple: (確保した座席IDのリスト, 確保できなかった座席の一覧)
+    """
+    statuses = dict(
+        EventSeat.objects.select_for_update().filter(
+            event_id=event_id,
+            seat_id__in=seat_ids
+        ).order_by('seat_id').values_list('seat_id', 'status')
+    )
+    available = [seat_id for seat_id in seat_ids if statuses.get(seat_id) == 'available']
+    conflicts = _seat_conflicts([seat_id for seat_id in seat_ids if seat_id not in available], statuses)
+    
+    if not available or (all_or_nothing and conflicts):
+        return [], conflicts
+    
+    EventSeat.objects.filter(
+        event_id=event_id,
+        seat_id__in=available,
+        status='available'
+    ).update(status='reserved', reserved_by=user, reserved_at=reserved_at)
+    return available, conflicts
+
+
+def _claim_seats_optimistic(user, event_id, seat_ids, reserved_at, all_or_nothing):
+    """
+    比較付きUPDATE（compare-and-set）で座席を確保する
+    
+    読み取り時の状態が空席でversionが変わっていない座席だけを更新する。他の購入者と競合した
+    座席は更新件数から判定するため、全席確保できた場合は読み取りとUPDATEの2文で済む。
+    
+    Returns:
+        tuple: (確保した座席IDのリスト, 確保できなかった座席の一覧)
+    """
+    current = {
+        seat_id: (status, version)
+        for seat_id, status, version in EventSeat.objects.filter(
+            event_id=event_id,
+            seat_id__in=seat_ids
+        ).values_list('seat_id', 'status', 'version')
+    }
+    candidates = [seat_id for seat_id in seat_ids if current.get(seat_id, (None,))[0] == 'available']
+    statuses = {seat_id: status for seat_id, (status, version) in current.items()}
+    lost = [seat_id for seat_id in seat_ids if seat_id not in candidates]
+    
+    if not candidates or (all_or_nothing and lost):
+        return [], _seat_conflicts(lost, statuses)
+    
+    compare = Q()
+    for seat_id in candidates:
+        compare |= Q(seat_id=seat_id, version=current[seat_id][1])
+    
+    savepoint = transaction.savepoint()
+    claimed = EventSeat.objects.filter(compare, event_id=event_id, status='available').update(
+        status='reserved',
+        reserved_by=user,
+        reserved_at=reserved_at,
+        version=F('version') + 1
+    )
+    
+    reserved = candidates
+    if claimed < len(candidates):
+        # 他の購入者が先に更新した座席がある（確保できた座席を特定して最新の状態を返す）
+        reserved = sorted(EventSeat.objects.filter(
+            event_id=event_id,
+            seat_id__in=candidates,
+            reserved_by=user,
+            reserved_at=reserved_at
+        ).values_list('seat_id', flat=True))
+        lost = sorted(set(seat_ids) - set(reserved))
+        statuses.update(
+            EventSeat.objects.filter(event_id=event_id, seat_id__in=lost).values_list('seat_id', 'status')
+        )
+        if all_or_nothing:
+            transaction.savepoint_rollback(savepoint)
+            return [], _seat_conflicts(lost, statuses)
+    
+    transaction.savepoint_commit(savepoint)
+    return reserved, _seat_conflicts(lost, statuses)
+
+
+def create_order(user):
     """
     購入確定処理
     
+    ゲートウェイとの通信（与信）は座席ロックを持つトランザクションの外で行う。
+        1. 予約: 注文・支払いを支払待ちで作成し、与信の間は仮予約が期限切れにならないよう延長する
+        2. 与信: 決済プロバイダーに与信を依頼する（トランザクションの外）
+        3. 確定: 座席を売約済みにしてチケットを発行する。売上確定・メール送信はコミット後にCeleryで行う
+    与信・確定に失敗した場合は注文をキャンセル、支払いを失敗にする（カートは残るため再度購入できる）。
+    与信の失敗は例外の種類によらず注文を失敗にし、支払待ちの注文を残さない。
+    
     Args:
-        user: Userオブジェクト
-        cart: Cartオブジェクト
+        user: Userオブジェクト（この利用者のカートを購入する）
     
     Returns:
         Order: 作成された注文オブジェクト
+    
+    Raises:
+        ValueError: カートの内容で購入できない場合
+        PaymentError: 決済が拒否された・ゲートウェイが利用できない場合
     """
-    with transaction.atomic():
+    order, payment = _reserve_order(user)
+    
+    try:
+        authorization = get_provider().authorize(
+            order.total_amount, order.order_number, idempotency_key=f'{order.order_number}-authorize'
+        )
+    except Exception:
+        _fail_order(order, payment)
+        raise
+    
+    try:
+        _confirm_order(user, order, payment, authorization)
+    except Exception:
+        _fail_order(order, payment)
+        _void_authorization(order, authorization)
+        raise
+    return order
+
+
+def _reserve_order(user):
+    """
+    購入確定の予約（注文・支払いを支払待ちで作成）
+    
+    Returns:
+        tuple: (Order, Payment)
+    """
+    store = get_cart_store()
+    # カートをロック（期限切れの解放処理と同時に実行されないようにする）
+    with transaction.atomic(), store.lock(user.pk) as cart:
+        if cart is None or cart.is_expired:
+            raise ValueError('カートの有効期限が切れています。もう一度座席を選択してください')
+        
         # カートアイテム取得
-        cart_items = cart.items.select_related('seat__venue').all()
+        cart_items = store.items(cart)
         
         if not cart_items:
             raise ValueError('カートが空です')
         
-        # イベント取得（全座席が同じ会場と仮定）
-        first_seat = cart_items[0].seat
-        # 注意: 実際にはイベントIDをカートに保存するか、別途渡す必要があります
-        # 簡略化のため、ここではイベントを適当に取得
-        from apps.events.models import Event
-        event = Event.objects.filter(venue=first_seat.venue, is_public=True).first()
+        # イベント取得（カートアイテムに保存されたイベント）
+        event = cart_items[0].event
         
         if not event:
             raise ValueError('イベントが見つかりません')
         
-        # 合計金額計算（簡略化：固定価格）
-        # 実際にはticket_typeの価格を使用
-        total_amount = len(cart_items) * 5000  # 仮の価格
+        # 合計金額計算（カート表示・購入確認と同じ価格表）
+        total_amount = price_cart_items(cart_items)
         
-        # 注文番号生成
-        order_number = f"ORD{timezone.now().strftime('%Y%m%d')}{uuid.uuid4().hex[:8].upper()}"
+        # 仮予約が残っていることを確認し、与信の間に期限切れで解放されないよう延長する
+        now = timezone.now()
+        seat_ids = _lock_held_seats(user, event, cart_items)
+        EventSeat.objects.filter(event=event, seat_id__in=seat_ids).update(reserved_at=now)
+        hold_until = now + timedelta(seconds=settings.PAYMENT_HOLD_SECONDS)
+        if cart.expires_at < hold_until:
+            store.set_expiry(cart, hold_until)
         
-        # 注文作成
+        # 注文作成（注文番号は時刻順の識別子）
         order = Order.objects.create(
-            order_number=order_number,
+            order_number=generate_id(ORDER_NUMBER_PREFIX),
             user=user,
             event=event,
             total_amount=total_amount,
-            status='paid'  # MVP: 即座に支払い済みとする
+            status='pending'
         )
         
         # 支払い作成
@@ -55,36 +376,237 @@ def create_order(user, cart):
             order=order,
             method='credit_card',
             amount=total_amount,
-            status='completed',
-            transaction_id=uuid.uuid4().hex,
+            status='pending'
+        )
+    return order, payment
+
+
+def _confirm_order(user, order, payment, authorization):
+    """購入確定（与信済みの注文の座席を売約済みにしてチケットを発行）"""
+    store = get_cart_store()
+    with transaction.atomic(), store.lock(user.pk) as cart:
+        # 与信の間にキャンセル（開催中止の一括キャンセルなど）された注文は確定しない
+        status = Order.objects.select_for_update().filter(pk=order.pk).values_list('status', flat=True).first()
+        if status != 'pending':
+            raise ValueError('購入手続き中に注文がキャンセルされました')
+        
+        if cart is None:
+            raise ValueError('カートの有効期限が切れています。もう一度座席を選択してください')
+        
+        cart_items = store.items(cart)
+        if not cart_items or price_cart_items(cart_items) != order.total_amount:
+            raise ValueError('購入手続き中にカートの内容が変更されました。もう一度お試しください')
+        
+        # 座席をまとめて売約済みに更新
+        seat_ids = _lock_held_seats(order.user, order.event, cart_items)
+        EventSeat.objects.filter(event=order.event, seat_id__in=seat_ids).update(
+            status='sold',
+            reserved_by=None,
+            reserved_at=None
+        )
+        
+        # チケットを一括発行（QRコードの生成と購入完了メールはコミット後にCeleryで実行）
+        issue_tickets(order, [cart_item.seat_id for cart_item in cart_items])
+        
+        record_seat_changes(order.event_id, seat_ids)
+        
+        # 与信済みにする（売上確定はコミット後）
+        Payment.objects.filter(pk=payment.pk).update(
+            status='authorized',
+            transaction_id=authorization.transaction_id,
             paid_at=timezone.now()
         )
+        Order.objects.filter(pk=order.pk).update(status='paid', updated_at=timezone.now())
+        order.status = 'paid'
+        
+        # カート削除
+        store.delete(cart)
         
-        # チケット作成と座席ステータス更新
-        for cart_item in cart_items:
+        transaction.on_commit(lambda: enqueue_payment_capture(payment.pk))
+        transaction.on_commit(lambda: enqueue_order_confirmation(order.pk))
+
+
+def _lock_held_seats(user, event, cart_items):
+    """
+    カートの座席の仮予約をロックして確認する
+    
+    Returns:
+        list: 座席IDのリスト（座席ID順）
+    
+    Raises:
+        ValueError: 仮予約の期限切れで解放済みの座席がある場合
+    """
+    seat_ids = sorted(cart_item.seat_id for cart_item in cart_items if cart_item.seat_id)
+    held = set(
+        EventSeat.objects.select_for_update().filter(
+            event=event,
+            seat_id__in=seat_ids,
+            status='reserved',
+            reserved_by=user
+        ).order_by('seat_id').values_list('seat_id', flat=True)
+    )
+    for cart_item in cart_items:
+        if cart_item.seat_id and cart_item.seat_id not in held:
             seat = cart_item.seat
-            
-            # 座席を売約済みに更新
-            seat.status = 'sold'
-            seat.save()
-            
-            # チケット作成（簡略版）
-            # 実際にはtickets/services.pyでQRコードも生成
-            ticket_number = f"TKT{order.order_number}{seat.id}"
-            
-            # Ticketモデルは後で実装するため、コメントアウト
-            # Ticket.objects.create(
-            #     order=order,
-            #     seat=seat,
-            #     ticket_number=ticket_number,
-            #     status='active'
-            # )
+            raise ValueError(f'座席 {seat.block}-{seat.row}-{seat.number} の仮予約期限が切れています')
+    return seat_ids
+
+
+def _fail_order(order, payment):
+    """与信・確定に失敗した注文をキャンセルにする"""
+    Payment.objects.filter(pk=payment.pk).update(status='failed')
+    Order.objects.filter(pk=order.pk).update(status='cancelled', updated_at=timezone.now())
+
+
+def _void_authorization(order, authorization):
+    """確定できなかった与信を取り消す（失敗してもゲートウェイ側の与信期限で失効する）"""
+    try:
+        get_provider().void(authorization.transaction_id, idempotency_key=f'{order.order_number}-void')
+    except PaymentError:
+        logger.exception('与信を取り消せませんでした: order=%s', order.order_number)
+
+
+def fail_payment_capture(payment_id, reason):
+    """
+    売上を確定できなかった注文をキャンセルする
+    
+    決済が拒否された・ゲートウェイの障害で再試行の上限に達した場合に、支払いを失敗にして
+    注文をキャンセルし（チケットを無効化して座席を空席に戻す）、与信を取り消す。
+    運用者が購入者に連絡できるようエラーを記録する。
+    
+    Args:
+        payment_id: 支払いID
+        reason: 失敗の理由
+    
+    Returns:
+        bool: 注文をキャンセルした場合はTrue（与信済みの支払いでない場合はFalse）
+    """
+    payment = Payment.objects.select_related('order').get(pk=payment_id)
+    order = payment.order
+    with transaction.atomic():
+        # 一括キャンセルと同じく注文 → 支払いの順にロックする
+        locked = Order.objects.select_for_update().get(pk=order.pk)
+        if not Payment.objects.filter(pk=payment_id, status='authorized').update(status='failed'):
+            return False
+        cancel_orders([(locked.pk, locked.total_amount)], reason=f'売上確定の失敗: {reason}')
+    
+    logger.error(
+        '売上を確定できなかったため注文をキャンセルしました: order=%s payment_id=%s reason=%s',
+        order.order_number, payment_id, reason
+    )
+    _void_authorization(order, Authorization(payment.transaction_id, payment.amount))
+    return True
+
+
+def capture_payment(payment_id):
+    """
+    与信済みの支払いの売上を確定する
+    
+    支払いの行をロックしてから状態を確認し、ゲートウェイの応答までロックを保持する。
+    キャンセル（cancel_orders）も同じ行をロックしてから返金処理中にするため、
+    キャンセルされた注文の売上を確定することはない（確定が先ならキャンセル側が返金する）。
+    
+    Args:
+        payment_id: 支払いID
+    
+    Returns:
+        bool: 売上を確定した場合はTrue（与信済みでない場合はFalse）
+    
+    Raises:
+        PaymentError: 決済が拒否された・ゲートウェイが利用できない場合
+    """
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().select_related('order').filter(pk=payment_id).first()
+        if payment is None or payment.status != 'authorized':
+            return False
         
-        # カート削除
-        cart.items.all().delete()
-        cart.delete()
+        get_provider().capture(
+            payment.transaction_id, payment.amount, idempotency_key=f'{payment.order.order_number}-capture'
+        )
+        Payment.objects.filter(pk=payment_id).update(status='completed', captured_at=timezone.now())
+    return True
+
+
+def refund_payment(payment_id):
+    """
+    返金処理中の支払いを返金する（売上確定前の場合は与信を取り消す）
+    
+    ゲートウェイが返金・取り消しを受け付けた場合だけ返金済みにする。冪等キーを付けるため、
+    再試行や同じ支払いのタスクが重複しても二重に返金されない。
+    
+    Args:
+        payment_id: 支払いID
+    
+    Returns:
+        bool: 返金した場合はTrue（返金処理中でない場合はFalse）
+    
+    Raises:
+        PaymentError: 返金が拒否された・ゲートウェイが利用できない場合
+    """
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().select_related('order').filter(pk=payment_id).first()
+        if payment is None or payment.status != 'refund_pending':
+            return False
         
-        return order
+        order_number = payment.order.order_number
+        if payment.captured_at:
+            get_provider().refund(payment.transaction_id, payment.amount, idempotency_key=f'{order_number}-refund')
+        else:
+            get_provider().void(payment.transaction_id, idempotency_key=f'{order_number}-void')
+        Payment.objects.filter(pk=payment_id).update(status='refunded')
+    return True
+
+
+def enqueue_payment_capture(payment_id):
+    """
+    売上確定をCeleryに登録する
+    
+    登録に失敗しても購入は確定済みのため例外にしない。
+    
+    Args:
+        payment_id: 支払いID
+    """
+    from .tasks import capture_payment_task
+    
+    try:
+        capture_payment_task.delay(payment_id)
+    except Exception:
+        logger.exception('売上確定のタスクを登録できませんでした: payment_id=%s', payment_id)
+
+
+def enqueue_payment_refunds(payment_ids):
+    """
+    支払いごとの返金をCeleryに登録する
+    
+    登録に失敗してもキャンセルは確定済みのため例外にしない（支払いは返金処理中のまま残る）。
+    
+    Args:
+        payment_ids: 支払いIDのリスト
+    """
+    from .tasks import refund_payment_task
+    
+    for payment_id in payment_ids:
+        try:
+            refund_payment_task.delay(payment_id)
+        except Exception:
+            logger.exception('返金のタスクを登録できませんでした: payment_id=%s', payment_id)
+
+
+def enqueue_order_confirmation(order_id):
+    """
+    購入完了メールの送信をCeleryに登録する
+    
+    登録に失敗しても購入は確定済みのため例外にしない。
+    
+    Args:
+        order_id: 注文ID
+    """
+    from .tasks import send_order_confirmation_task
+    
+    try:
+        send_order_confirmation_task.delay(order_id)
+    except Exception:
+        logger.exception('購入完了メールのタスクを登録できませんでした: order_id=%s', order_id)
 
 
 def process_cancellation(cancellation, approved_by):
@@ -96,33 +618,316 @@ def process_cancellation(cancellation, approved_by):
         approved_by: 承認者（Userオブジェクト）
     """
     with transaction.atomic():
-        order = cancellation.order
-        
-        # 注文ステータスを更新
-        order.status = 'cancelled'
-        order.save()
+        order = Order.objects.select_for_update().get(pk=cancellation.order_id)
+        cancel_orders([(order.pk, order.total_amount)], processed_by=approved_by)
+    cancellation.refresh_from_db()
+
+
+def cancel_orders(orders, processed_by=None, reason='', now=None):
+    """
+    注文をまとめてキャンセルし、返金を依頼する
+    
+    チケット・座席・支払い・注文・キャンセル申請をそれぞれ1〜2文で更新するため、
+    文の数は注文数・チケット数によらず一定（座席を戻すイベント数を除く）。
+    支払いは返金処理中にし、ゲートウェイへの返金はコミット後に支払いごとのタスク（refund_payment）で行う。
+    
+    Args:
+        orders: [(注文ID, 合計金額), ...]（呼び出し側でロック済みであること）
+        processed_by: 処理者（Userオブジェクト）
+        reason: キャンセル申請がない注文に作成する申請の理由
+        now: 処理日時
+    
+    Returns:
+        dict: {'orders': 注文数, 'tickets': 無効化したチケット数, 'refunded_amount': 返金を依頼した金額}
+    """
+    now = now or timezone.now()
+    order_ids = [order_id for order_id, total_amount in orders]
+    active_tickets = Ticket.objects.filter(order_id__in=order_ids).exclude(status='cancelled')
+    
+    # チケットの座席を空席に戻す
+    sold = list(
+        EventSeat.objects.select_for_update().filter(
+            Exists(active_tickets.filter(order__event_id=OuterRef('event_id'), seat_id=OuterRef('seat_id'))),
+            status='sold',
+        ).order_by('seat_id').values_list('id', 'event_id', 'seat_id')
+    )
+    tickets = active_tickets.update(status='cancelled', updated_at=now)
+    if sold:
+        EventSeat.objects.filter(
+            id__in=[event_seat_id for event_seat_id, event_id, seat_id in sold]
+        ).update(status='available', reserved_by=None, reserved_at=None)
+        seats_by_event = defaultdict(list)
+        for event_seat_id, event_id, seat_id in sold:
+            seats_by_event[event_id].append(seat_id)
+        for event_id, seat_ids in seats_by_event.items():
+            record_seat_changes(event_id, seat_ids)
+    
+    # 支払いを返金処理中にし、コミット後に支払いごとの返金（売上確定前は与信の取り消し）を登録する
+    # 支払いの行をロックするため、実行中の売上確定（capture_payment）とは順に処理される
+    payments = list(
+        Payment.objects.select_for_update().filter(
+            order_id__in=order_ids, status__in=['authorized', 'completed']
+        ).order_by('id').values_list('id', 'amount')
+    )
+    payment_ids = [payment_id for payment_id, amount in payments]
+    if payment_ids:
+        Payment.objects.filter(id__in=payment_ids).update(status='refund_pending')
+        transaction.on_commit(lambda: enqueue_payment_refunds(payment_ids))
+    
+    Order.objects.filter(id__in=order_ids).update(status='cancelled', updated_at=now)
+    
+    # キャンセル申請を処理完了にし、申請のない注文（イベント中止など）は処理完了の申請を作成
+    Cancellation.objects.filter(order_id__in=order_ids).exclude(status='processed').update(
+        status='processed', processed_at=now, processed_by=processed_by
+    )
+    requested = set(Cancellation.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
+    Cancellation.objects.bulk_create([
+        Cancellation(
+            order_id=order_id,
+            reason=reason,
+            refund_amount=total_amount,
+            status='processed',
+            processed_at=now,
+            processed_by=processed_by,
+        )
+        for order_id, total_amount in orders if order_id not in requested
+    ])
+    
+    return {
+        'orders': len(order_ids),
+        'tickets': tickets,
+        'refunded_amount': sum((amount for payment_id, amount in payments), Decimal('0')),
+    }
+
+
+def create_cancellation_run(event=None, cancellations=None, reason='', created_by=None):
+    """
+    一括キャンセル・返金の実行記録を作成する
+    
+    同じイベントの未完了の実行記録がある場合は新しく作らずにそれを返す。
+    
+    Args:
+        event: イベント（イベントの全注文が対象）
+        cancellations: キャンセル申請のクエリセット（申請中の申請は承認済みにする）
+        reason: キャンセル申請がない注文に作成する申請の理由
+        created_by: 実行者
+    
+    Returns:
+        CancellationRun: 実行記録
+    """
+    with transaction.atomic():
+        if event is not None:
+            run = CancellationRun.objects.filter(event=event).exclude(status='completed').first()
+            return run or CancellationRun.objects.create(event=event, reason=reason, created_by=created_by)
         
-        # チケットを無効化
-        tickets = Ticket.objects.filter(order=order)
-        for ticket in tickets:
-            ticket.status = 'cancelled'
-            ticket.save()
+        cancellation_ids = list(cancellations.order_by('id').values_list('id', flat=True))
+        cancellations.filter(status='requested').update(status='approved')
+        return CancellationRun.objects.create(
+            cancellation_ids=cancellation_ids, reason=reason, created_by=created_by
+        )
+
+
+def start_cancellation_run(event=None, cancellations=None, reason='', created_by=None):
+    """
+    一括キャンセル・返金を登録し、コミット後にCeleryで実行する
+    
+    引数は create_cancellation_run と同じ。
+    
+    Returns:
+        CancellationRun: 実行記録
+    """
+    from .tasks import run_cancellation_task
+    
+    run = create_cancellation_run(event, cancellations, reason, created_by)
+    transaction.on_commit(lambda: run_cancellation_task.delay(run.pk))
+    return run
+
+
+def _cancellation_run_orders(run):
+    """実行記録の対象の注文"""
+    if run.event_id:
+        return Order.objects.filter(event_id=run.event_id)
+    return Order.objects.filter(
+        id__in=Cancellation.objects.filter(id__in=run.cancellation_ids).values('order_id')
+    )
+
+
+def run_cancellation(run, chunk_size=None, max_chunks=None, deadline=None):
+    """
+    一括キャンセル・返金を実行する（中断した位置から再開）
+    
+    対象の注文を注文ID順に chunk_size 件ずつロックしてキャンセルし、同じトランザクションで
+    処理済みの注文IDを記録する。実行記録の行をチャンクごとにロックするため、
+    同じ実行記録を複数のワーカーが実行しても同じ注文を二重に処理しない。
+    
+    Args:
+        run: CancellationRunオブジェクト
+        chunk_size: 1トランザクションで処理する注文数
+        max_chunks: 最大チャンク数（未指定時は完了まで）
+        deadline: time.monotonic() の期限（過ぎたら次のチャンクに進まずに返す）
+    
+    Returns:
+        CancellationRun: 更新後の実行記録
+    """
+    chunk_size = chunk_size or settings.CANCELLATION_CHUNK_SIZE
+    CancellationRun.objects.filter(pk=run.pk, status__in=['pending', 'failed']).update(
+        status='running', started_at=timezone.now(), error=''
+    )
+    chunks = 0
+    
+    try:
+        while max_chunks is None or chunks < max_chunks:
+            with transaction.atomic():
+                run = CancellationRun.objects.select_for_update().get(pk=run.pk)
+                if run.status == 'completed':
+                    break
+                
+                rows = list(
+                    _cancellation_run_orders(run).select_for_update().filter(
+                        id__gt=run.last_order_id
+                    ).order_by('id').values_list('id', 'status', 'total_amount')[:chunk_size]
+                )
+                if not rows:
+                    run.status = 'completed'
+                    run.finished_at = timezone.now()
+                    run.save(update_fields=['status', 'finished_at', 'updated_at'])
+                    break
+                
+                # キャンセル済みの注文は位置だけ進める
+                targets = [(order_id, total_amount) for order_id, status, total_amount in rows if status != 'cancelled']
+                if targets:
+                    result = cancel_orders(targets, processed_by=run.created_by, reason=run.reason)
+                    run.processed_orders += result['orders']
+                    run.cancelled_tickets += result['tickets']
+                    run.refunded_amount += result['refunded_amount']
+                run.last_order_id = rows[-1][0]
+                run.save(update_fields=[
+                    'last_order_id', 'processed_orders', 'cancelled_tickets', 'refunded_amount', 'updated_at'
+                ])
+            
+            chunks += 1
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+    except Exception as e:
+        CancellationRun.objects.filter(pk=run.pk).update(status='failed', error=str(e), updated_at=timezone.now())
+        raise
+    
+    run.refresh_from_db()
+    return run
+
+
+def release_expired_holds(batch_size=None, max_batches=None, now=None):
+    """
+    期限切れの仮予約（カート内の座席）を解放する
+    
+    reserved_atが保持時間を過ぎた座席を batch_size 件ずつ
+    SELECT ... FOR UPDATE SKIP LOCKED で取得し、空席に戻してカートから対応するアイテムを削除する。
+    購入処理中などでロックされている座席は待たずにスキップするため、長時間のロックは発生しない。
+    
+    Args:
+        batch_size: 1トランザクションで解放する最大件数
+        max_batches: 最大バッチ数（未指定時は対象がなくなるまで）
+        now: 基準日時（テスト用）
+    
+    Returns:
+        dict: {
+            'released': 解放した座席数,
+            'cart_items_deleted': 削除したカートアイテム数,
+            'batches': 実行したバッチ数,
+            'elapsed_ms': 所要時間（ミリ秒）
+        }
+    """
+    batch_size = batch_size or settings.SEAT_HOLD_RELEASE_BATCH_SIZE
+    cutoff = (now or timezone.now()) - timedelta(minutes=settings.SEAT_HOLD_MINUTES)
+    started = time.monotonic()
+    released = 0
+    cart_items_deleted = 0
+    batches = 0
+    
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            expired = list(
+                EventSeat.objects.select_for_update(skip_locked=True).filter(
+                    Q(reserved_at__lt=cutoff) | Q(reserved_at__isnull=True),
+                    status='reserved'
+                ).values_list('id', 'event_id', 'seat_id', 'reserved_by_id')[:batch_size]
+            )
+            if not expired:
+                break
+            
+            EventSeat.objects.filter(
+                id__in=[row[0] for row in expired]
+            ).update(status='available', reserved_by=None, reserved_at=None)
             
-            # 座席を空席に戻す
-            if ticket.seat:
-                seat = ticket.seat
-                seat.status = 'available'
-                seat.reserved_by = None
-                seat.save()
-        
-        # 支払いステータスを更新
-        if hasattr(order, 'payment'):
-            payment = order.payment
-            payment.status = 'refunded'
-            payment.save()
-        
-        # キャンセルステータスを更新
-        cancellation.status = 'processed'
-        cancellation.processed_at = timezone.now()
-        cancellation.processed_by = approved_by
-        cancellation.save()
+            cart_items_deleted += get_cart_store().discard_seats([
+                (user_id, event_id, seat_id) for event_seat_id, event_id, seat_id, user_id in expired
+            ])
+            
+            seats_by_event = defaultdict(list)
+            for event_seat_id, event_id, seat_id, user_id in expired:
+                seats_by_event[event_id].append(seat_id)
+            for event_id, seat_ids in seats_by_event.items():
+                record_seat_changes(event_id, seat_ids)
+        
+        released += len(expired)
+        batches += 1
+        if len(expired) < batch_size:
+            break
+    
+    return {
+        'released': released,
+        'cart_items_deleted': cart_items_deleted,
+        'batches': batches,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+    }
+
+
+def release_expired_carts(batch_size=None, max_batches=None, now=None):
+    """
+    有効期限の切れたカートを解放する
+    
+    期限切れのカートを batch_size 件ずつ確保して中身（座席・自由席の在庫）を解放し、カートを削除する。
+    キャッシュのカートはコミット後に削除するため、ロールバックしても在庫を戻せなくなることはない。
+    購入確定中（ロック中）のカートはスキップする。
+    
+    Args:
+        batch_size: 1トランザクションで解放する最大カート数
+        max_batches: 最大バッチ数（未指定時は対象がなくなるまで）
+        now: 基準日時（テスト用）
+    
+    Returns:
+        dict: {
+            'carts': 削除したカート数,
+            'seats': 解放した座席数,
+            'tickets': 在庫に戻した自由席の枚数,
+            'batches': 実行したバッチ数,
+            'elapsed_ms': 所要時間（ミリ秒）
+        }
+    """
+    batch_size = batch_size or settings.CART_RELEASE_BATCH_SIZE
+    now = now or timezone.now()
+    started = time.monotonic()
+    totals = {'carts': 0, 'seats': 0, 'tickets': 0}
+    batches = 0
+    
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            store = get_cart_store()
+            expired = store.claim_expired(now, batch_size)
+            if not expired:
+                break
+            released = release_cart_items(expired)
+            store.delete_expired(expired, now)
+        
+        totals['carts'] += len(expired)
+        totals['seats'] += released['seats']
+        totals['tickets'] += released['tickets']
+        batches += 1
+        if len(expired) < batch_size:
+            break
+    
+    return dict(
+        totals,
+        batches=batches,
+        elapsed_ms=round((time.monotonic() - started) * 1000, 1),
+    )
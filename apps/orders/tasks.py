@@ -0,0 +1,153 @@
+"""注文関連のCeleryタスク"""
+import logging
+import time
+from datetime import timedelta
+from celery import shared_task
+from django.conf import settings
+from django.core.mail import send_mail
+from django.template.loader import render_to_string
+from django.utils import timezone
+from apps.core.tasks import TimedTask
+from .models import CancellationRun, Order
+from .payments import GatewayUnavailable, PaymentError
+from .services import (
+    capture_payment, fail_payment_capture, refund_payment, release_expired_carts, release_expired_holds,
+    run_cancellation,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def release_expired_holds_task():
+    """期限切れの仮予約を解放（Celery beatで定期実行）"""
+    result = release_expired_holds()
+    logger.info(
+        '期限切れの仮予約を解放しました: released=%(released)s cart_items_deleted=%(cart_items_deleted)s '
+        'batches=%(batches)s elapsed_ms=%(elapsed_ms)s',
+        result
+    )
+    return result
+
+
+@shared_task
+def release_expired_carts_task():
+    """有効期限の切れたカートを解放（Celery beatで定期実行）"""
+    result = release_expired_carts()
+    logger.info(
+        '期限切れのカートを解放しました: carts=%(carts)s seats=%(seats)s tickets=%(tickets)s '
+        'batches=%(batches)s elapsed_ms=%(elapsed_ms)s',
+        result
+    )
+    return result
+
+
+@shared_task(
+    base=TimedTask,
+    autoretry_for=(OSError,),
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_jitter=True,
+    max_retries=5,
+)
+def send_order_confirmation_task(order_id):
+    """購入完了メールを送信（購入確定のコミット後に登録。SMTPの一時的なエラーは再試行）"""
+    order = Order.objects.select_related('user', 'event').get(pk=order_id)
+    if not order.user.email:
+        return False
+    
+    send_mail(
+        subject=f'【TicketPro】ご購入ありがとうございます（注文番号: {order.order_number}）',
+        message=render_to_string('orders/order_confirmation_email.txt', {
+            'order': order,
+            'ticket_count': order.tickets.count(),
+        }),
+        from_email=None,
+        recipient_list=[order.user.email],
+        fail_silently=False,
+    )
+    return True
+
+
+class CapturePaymentTask(TimedTask):
+    """売上確定のタスク（確定できないまま終了した場合は注文をキャンセルする）"""
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        # 決済の拒否、または再試行の上限に達したゲートウェイの障害
+        if isinstance(exc, PaymentError):
+            fail_payment_capture(args[0], str(exc))
+
+
+@shared_task(
+    base=CapturePaymentTask,
+    autoretry_for=(GatewayUnavailable,),
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_jitter=True,
+    max_retries=8,
+)
+def capture_payment_task(payment_id):
+    """
+    与信済みの支払いの売上を確定（購入確定のコミット後に登録。ゲートウェイの障害中は再試行）
+    
+    決済が拒否された場合と再試行の上限に達した場合は、支払いを失敗にして注文をキャンセルする。
+    """
+    return capture_payment(payment_id)
+
+
+class RefundPaymentTask(TimedTask):
+    """返金のタスク（返金できないまま終了した場合は運用者が対応できるようエラーを記録する）"""
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        if isinstance(exc, PaymentError):
+            logger.error('返金できませんでした（返金処理中のまま）: payment_id=%s reason=%s', args[0], exc)
+
+
+@shared_task(
+    base=RefundPaymentTask,
+    autoretry_for=(GatewayUnavailable,),
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_jitter=True,
+    max_retries=8,
+)
+def refund_payment_task(payment_id):
+    """返金処理中の支払いを返金（キャンセルのコミット後に登録。ゲートウェイの障害中は再試行）"""
+    return refund_payment(payment_id)
+
+
+@shared_task(base=TimedTask)
+def run_cancellation_task(run_id):
+    """
+    一括キャンセル・返金を実行
+    
+    1回のタスクは CANCELLATION_TASK_SECONDS 秒で区切り、未完了の場合は続きを新しいタスクとして登録する
+    （ワーカーを長時間占有せず、ワーカーの再起動時も記録した位置から再開できる）。
+    """
+    run = CancellationRun.objects.get(pk=run_id)
+    run = run_cancellation(run, deadline=time.monotonic() + settings.CANCELLATION_TASK_SECONDS)
+    logger.info(
+        '一括キャンセルを実行しました: run=%s status=%s orders=%s tickets=%s refunded_amount=%s',
+        run.pk, run.status, run.processed_orders, run.cancelled_tickets, run.refunded_amount
+    )
+    if run.status != 'completed':
+        run_cancellation_task.delay(run_id)
+    return run.status
+
+
+@shared_task
+def resume_cancellation_runs_task():
+    """ワーカーの異常終了などで止まった一括キャンセルを再開（Celery beatで定期実行）"""
+    stalled_before = timezone.now() - timedelta(seconds=settings.CANCELLATION_TASK_SECONDS * 5)
+    run_ids = list(
+        CancellationRun.objects.filter(
+            status__in=['pending', 'running'],
+            updated_at__lt=stalled_before
+        ).values_list('id', flat=True)
+    )
+    for run_id in run_ids:
+        run_cancellation_task.delay(run_id)
+    if run_ids:
+        logger.warning('停止していた一括キャンセルを再開しました: runs=%s', run_ids)
+    return run_ids
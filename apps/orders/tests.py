@@ -1,3 +1,1061 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+from datetime import timedelta
 
-# Create your tests here.
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from config.celery import app as celery_app
+from apps.core.tasks import get_task_metrics, reset_task_metrics
+from apps.orders.cart_store import CartLocked, get_cart_store
+from apps.orders.models import Cart, CartItem, Order, Payment, Cancellation, CancellationRun
+from apps.orders.services import (
+    release_expired_carts, release_expired_holds, reserve_free_tickets, reserve_seats, create_order,
+    create_cancellation_run, run_cancellation, process_cancellation, capture_payment, cancel_orders,
+)
+from apps.orders.tasks import capture_payment_task, refund_payment_task, send_order_confirmation_task
+from apps.orders.payments import CircuitBreaker, GatewayUnavailable, PaymentDeclined, StubProvider
+from apps.orders.pricing import price_cart_items, get_price_table, invalidate_price_table, PricingError
+from apps.events.models import TicketType
+from apps.tickets.models import Ticket
+from apps.tickets.tasks import render_missing_qr_codes_task
+from apps.seats.models import Seat, EventSeat
+from apps.seats.services import open_event_seats, generate_seats
+from apps.seats.tests import SeatTestMixin, User
+
+
+class OrderTestMixin(SeatTestMixin):
+    """注文テスト用の共通データ"""
+    
+    def setUp(self):
+        super().setUp()
+        open_event_seats(self.event)
+        invalidate_price_table(self.event.pk)
+        self.customer = User.objects.create_user(username='customer', password='testpass123')
+        self.seat_ids = list(Seat.objects.order_by('id').values_list('id', flat=True))
+    
+    def add_to_cart(self, seat_ids, user=None, ticket_type=None):
+        self.client.force_login(user or self.customer)
+        data = {'event_id': self.event.pk, 'seat_ids': seat_ids}
+        if ticket_type is not None:
+            data['ticket_type_id'] = ticket_type.pk
+        return self.client.post(reverse('orders:cart_add'), data=json.dumps(data), content_type='application/json')
+
+
+class ReserveSeatsTest(OrderTestMixin, TestCase):
+    """座席の一括仮予約のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(username='other', password='testpass123')
+    
+    def test_conflicts_are_reported_per_seat(self):
+        """確保できた座席はカートに入り、確保できなかった座席は状態付きで返る"""
+        self.add_to_cart(self.seat_ids[1:2], user=self.other)
+        EventSeat.objects.filter(event=self.event, seat_id=self.seat_ids[2]).update(status='sold')
+        
+        response = self.add_to_cart(self.seat_ids[:4])
+        self.assertEqual(response.status_code, 409)
+        data = response.json()
+        self.assertEqual(data['reserved'], [self.seat_ids[0], self.seat_ids[3]])
+        self.assertEqual(data['conflicts'], [
+            {'seat_id': self.seat_ids[1], 'status': 'reserved'},
+            {'seat_id': self.seat_ids[2], 'status': 'sold'},
+        ])
+        cart = Cart.objects.get(user=self.customer)
+        self.assertCountEqual(cart.items.values_list('seat_id', flat=True), data['reserved'])
+    
+    def test_all_or_nothing(self):
+        """all_or_nothingの場合は1席でも確保できなければ何も確保しない"""
+        self.add_to_cart(self.seat_ids[1:2], user=self.other)
+        result = reserve_seats(self.customer, self.event.pk, self.seat_ids[:3], all_or_nothing=True)
+        self.assertEqual(result['reserved'], [])
+        self.assertEqual([c['seat_id'] for c in result['conflicts']], [self.seat_ids[1]])
+        self.assertFalse(EventSeat.objects.filter(event=self.event, reserved_by=self.customer).exists())
+    
+    def test_query_count_does_not_grow_with_seats(self):
+        """座席数によらずクエリ数は一定"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:1])
+        with CaptureQueriesContext(connection) as one_seat:
+            reserve_seats(self.customer, self.event.pk, self.seat_ids[1:2])
+        with CaptureQueriesContext(connection) as five_seats:
+            reserve_seats(self.customer, self.event.pk, self.seat_ids[5:10])
+        self.assertEqual(len(one_seat), len(five_seats))
+        self.assertEqual(
+            EventSeat.objects.filter(event=self.event, seat_id__in=self.seat_ids[5:10], status='reserved').count(), 5
+        )
+
+
+@override_settings(SEAT_CLAIM_MODE='optimistic')
+class OptimisticReserveSeatsTest(ReserveSeatsTest):
+    """座席の一括仮予約のテスト（楽観的確保）"""
+    
+    def test_seat_taken_after_read_is_lost(self):
+        """読み取り後に他の購入者が確保した座席は比較付きUPDATEで負け、状態付きで返る"""
+        savepoint = transaction.savepoint
+        
+        def take_seat_then_savepoint(*args, **kwargs):
+            # 読み取りとUPDATEの間に他の購入者が確保
+            EventSeat.objects.filter(event=self.event, seat_id=self.seat_ids[1]).update(
+                status='reserved', reserved_by=self.other, version=99
+            )
+            return savepoint(*args, **kwargs)
+        
+        with mock.patch('apps.orders.services.transaction.savepoint', side_effect=take_seat_then_savepoint):
+            result = reserve_seats(self.customer, self.event.pk, self.seat_ids[:3])
+        
+        self.assertEqual(result['reserved'], [self.seat_ids[0], self.seat_ids[2]])
+        self.assertEqual(result['conflicts'], [{'seat_id': self.seat_ids[1], 'status': 'reserved'}])
+        self.assertEqual(
+            EventSeat.objects.get(event=self.event, seat_id=self.seat_ids[1]).reserved_by, self.other
+        )
+        self.assertEqual(Cart.objects.get(user=self.customer).items.count(), 2)
+
+
+class ReleaseExpiredHoldsTest(OrderTestMixin, TestCase):
+    """期限切れの仮予約解放のテスト"""
+    
+    def test_add_to_cart_sets_reserved_at(self):
+        """カート投入時に仮予約日時が記録される"""
+        response = self.add_to_cart(self.seat_ids[:2])
+        self.assertEqual(response.status_code, 200)
+        event_seat = EventSeat.objects.get(event=self.event, seat_id=self.seat_ids[0])
+        self.assertEqual(event_seat.status, 'reserved')
+        self.assertIsNotNone(event_seat.reserved_at)
+    
+    def test_expired_holds_are_released_in_batches(self):
+        """期限切れの座席のみ解放され、カートアイテムも削除される"""
+        self.add_to_cart(self.seat_ids[:5])
+        EventSeat.objects.filter(event=self.event, seat_id__in=self.seat_ids[:3]).update(
+            reserved_at=timezone.now() - timedelta(minutes=30)
+        )
+        
+        result = release_expired_holds(batch_size=2)
+        self.assertEqual(result['released'], 3)
+        self.assertEqual(result['cart_items_deleted'], 3)
+        self.assertEqual(result['batches'], 2)
+        
+        statuses = dict(EventSeat.objects.filter(event=self.event).values_list('seat_id', 'status'))
+        self.assertEqual([statuses[seat_id] for seat_id in self.seat_ids[:5]],
+                         ['available', 'available', 'available', 'reserved', 'reserved'])
+        cart = Cart.objects.get(user=self.customer)
+        self.assertCountEqual(CartItem.objects.filter(cart=cart).values_list('seat_id', flat=True), self.seat_ids[3:5])
+    
+    def test_nothing_to_release(self):
+        """期限内の仮予約は解放しない"""
+        self.add_to_cart(self.seat_ids[:1])
+        result = release_expired_holds()
+        self.assertEqual(result['released'], 0)
+        self.assertEqual(result['batches'], 0)
+    
+    def test_discard_seats_keeps_other_users_items(self):
+        """解放した座席のカートアイテムは、その座席を確保していた利用者のカートからだけ削除する"""
+        self.add_to_cart(self.seat_ids[:1])
+        other = User.objects.create_user(username='other', password='testpass123')
+        
+        self.assertEqual(get_cart_store().discard_seats([(other.pk, self.event.pk, self.seat_ids[0])]), 0)
+        self.assertTrue(CartItem.objects.filter(cart__user=self.customer, seat_id=self.seat_ids[0]).exists())
+
+
+def use_temporary_media_root(testcase):
+    """テスト中のファイル保存先を一時ディレクトリにする"""
+    media_root = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    media = override_settings(MEDIA_ROOT=media_root)
+    media.enable()
+    testcase.addCleanup(media.disable)
+
+
+def use_eager_celery(testcase):
+    """テスト中のCeleryタスクを登録時にその場で実行する"""
+    # 設定はDjangoの設定（CELERY_ 接頭辞）から読み込んでいるため、同じ名前で上書きする
+    previous = celery_app.conf['CELERY_TASK_ALWAYS_EAGER']
+    celery_app.conf['CELERY_TASK_ALWAYS_EAGER'] = True
+    testcase.addCleanup(celery_app.conf.__setitem__, 'CELERY_TASK_ALWAYS_EAGER', previous)
+
+
+class CreateOrderTest(OrderTestMixin, TestCase):
+    """購入確定のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        use_temporary_media_root(self)
+        use_eager_celery(self)
+    
+    def test_tickets_are_issued_in_bulk(self):
+        """全座席が売約済みになり、チケットが発行されてQRコードはコミット後に生成される"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:4])
+        
+        with self.captureOnCommitCallbacks() as callbacks:
+            order = create_order(self.customer)
+        
+        tickets = Ticket.objects.filter(order=order)
+        self.assertCountEqual(tickets.values_list('seat_id', flat=True), self.seat_ids[:4])
+        # 番号は時刻順の識別子（発行順に昇順）
+        self.assertTrue(order.order_number.startswith('ORD'))
+        ticket_numbers = list(tickets.order_by('id').values_list('ticket_number', flat=True))
+        self.assertEqual(ticket_numbers, sorted(ticket_numbers))
+        self.assertFalse(tickets.exclude(qr_code='').exists())
+        self.assertEqual(
+            EventSeat.objects.filter(event=self.event, seat_id__in=self.seat_ids[:4], status='sold').count(), 4
+        )
+        self.assertFalse(Cart.objects.filter(user=self.customer).exists())
+        
+        for callback in callbacks:
+            callback()
+        self.assertFalse(tickets.filter(qr_code='').exists())
+    
+    def test_query_count_does_not_grow_with_seats(self):
+        """購入確定のクエリ数は座席数によらず一定"""
+        other = User.objects.create_user(username='other', password='testpass123')
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:1])
+        reserve_seats(other, self.event.pk, self.seat_ids[1:9])
+        get_price_table(self.event.pk)
+        
+        with CaptureQueriesContext(connection) as one_seat:
+            create_order(self.customer)
+        with CaptureQueriesContext(connection) as eight_seats:
+            create_order(other)
+        self.assertEqual(len(one_seat), len(eight_seats))
+    
+    def test_expired_hold_cannot_be_purchased(self):
+        """仮予約が解放された座席を含む場合は購入できない"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:2])
+        EventSeat.objects.filter(event=self.event, seat_id=self.seat_ids[1]).update(
+            status='available', reserved_by=None, reserved_at=None
+        )
+        with self.assertRaises(ValueError):
+            create_order(self.customer)
+        self.assertFalse(Ticket.objects.exists())
+
+
+class PostPurchasePipelineTest(OrderTestMixin, TestCase):
+    """購入確定後のタスク（QRコード生成・購入完了メール）のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        use_temporary_media_root(self)
+        reset_task_metrics()
+        self.customer.email = 'customer@example.com'
+        self.customer.save()
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:2])
+    
+    def test_checkout_only_enqueues_tasks(self):
+        """購入確定はコミット後にタスクを登録するだけで、QRコード生成やメール送信を待たない"""
+        with mock.patch('apps.tickets.tasks.render_ticket_qr_codes_task.delay') as render, \
+                mock.patch('apps.orders.tasks.capture_payment_task.delay') as capture, \
+                mock.patch('apps.orders.tasks.send_order_confirmation_task.delay') as notify:
+            with self.captureOnCommitCallbacks() as callbacks:
+                order = create_order(self.customer)
+            render.assert_not_called()
+            capture.assert_not_called()
+            notify.assert_not_called()
+            
+            for callback in callbacks:
+                callback()
+        
+        ticket_ids = list(Ticket.objects.filter(order=order).values_list('id', flat=True))
+        self.assertCountEqual(render.call_args.args[0], ticket_ids)
+        capture.assert_called_once_with(order.payment.pk)
+        notify.assert_called_once_with(order.pk)
+        self.assertFalse(Ticket.objects.filter(order=order).exclude(qr_code='').exists())
+        self.assertEqual(mail.outbox, [])
+    
+    def test_pipeline_runs_eagerly(self):
+        """eagerモードではコミット後にQRコード生成とメール送信がその場で実行され、所要時間が記録される"""
+        use_eager_celery(self)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = create_order(self.customer)
+        
+        self.assertFalse(Ticket.objects.filter(order=order, qr_code='').exists())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(order.order_number, mail.outbox[0].subject)
+        self.assertIn('2枚', mail.outbox[0].body)
+        
+        self.assertEqual(Payment.objects.get(order=order).status, 'completed')
+        metrics = get_task_metrics()
+        self.assertEqual(metrics['apps.tickets.tasks.render_ticket_qr_codes_task']['success'], 1)
+        self.assertEqual(metrics['apps.orders.tasks.capture_payment_task']['success'], 1)
+        self.assertEqual(metrics['apps.orders.tasks.send_order_confirmation_task']['success'], 1)
+    
+    def test_email_is_retried(self):
+        """SMTPの一時的なエラーは再試行する"""
+        order = create_order(self.customer)
+        
+        # 例外を送出せずに実行し、ワーカーと同じく再試行させる
+        with mock.patch('apps.orders.tasks.send_mail', side_effect=[ConnectionRefusedError(), 1]) as send:
+            result = send_order_confirmation_task.apply(args=[order.pk], throw=False)
+        
+        self.assertTrue(result.successful())
+        self.assertEqual(send.call_count, 2)
+        metrics = get_task_metrics()['apps.orders.tasks.send_order_confirmation_task']
+        self.assertEqual((metrics['retry'], metrics['success']), (1, 1))
+    
+    def test_enqueue_failure_is_recovered(self):
+        """タスクを登録できなくても購入は確定し、未生成のQRコードは定期処理で生成される"""
+        with mock.patch('apps.tickets.tasks.render_ticket_qr_codes_task.delay', side_effect=OSError), \
+                mock.patch('apps.orders.tasks.capture_payment_task.delay', side_effect=OSError), \
+                mock.patch('apps.orders.tasks.send_order_confirmation_task.delay', side_effect=OSError), \
+                self.assertLogs('apps', level='ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                order = create_order(self.customer)
+        
+        tickets = Ticket.objects.filter(order=order)
+        self.assertEqual(render_missing_qr_codes_task(), 0)
+        tickets.update(created_at=timezone.now() - timedelta(minutes=10))
+        with self.assertLogs('apps.tickets.tasks', level='WARNING'):
+            self.assertEqual(render_missing_qr_codes_task(), 2)
+        self.assertFalse(tickets.filter(qr_code='').exists())
+
+
+class PaymentTest(OrderTestMixin, TestCase):
+    """決済（予約 → 与信 → 確定）のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:2])
+        self.provider = mock.Mock(wraps=StubProvider())
+        patcher = mock.patch('apps.orders.services.get_provider', return_value=self.provider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_authorized_order(self):
+        """与信が通ると注文は支払済み、支払いは与信済み（売上確定はコミット後）になる"""
+        order = create_order(self.customer)
+        
+        self.provider.authorize.assert_called_once_with(
+            order.total_amount, order.order_number, idempotency_key=f'{order.order_number}-authorize'
+        )
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'paid')
+        self.assertEqual(order.payment.status, 'authorized')
+        self.assertTrue(order.payment.transaction_id.startswith('stub_'))
+    
+    def test_declined_payment_keeps_cart(self):
+        """決済が拒否された場合は注文をキャンセルにし、カートと仮予約は残して再度購入できる"""
+        self.provider.authorize.side_effect = PaymentDeclined('カードの有効期限が切れています')
+        with self.assertRaises(PaymentDeclined):
+            create_order(self.customer)
+        
+        failed = Order.objects.get(user=self.customer)
+        self.assertEqual((failed.status, failed.payment.status), ('cancelled', 'failed'))
+        self.assertEqual(
+            EventSeat.objects.filter(event=self.event, reserved_by=self.customer, status='reserved').count(), 2
+        )
+        
+        self.provider.authorize.side_effect = None
+        order = create_order(self.customer)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'paid')
+    
+    def test_cart_changed_during_authorization_voids(self):
+        """与信中にカートの内容が変わった場合は確定せず、与信を取り消す"""
+        def authorize(amount, reference, idempotency_key):
+            CartItem.objects.filter(cart__user=self.customer, seat_id=self.seat_ids[1]).delete()
+            return StubProvider().authorize(amount, reference, idempotency_key)
+        self.provider.authorize.side_effect = authorize
+        
+        with self.assertRaisesMessage(ValueError, 'カートの内容が変更されました'):
+            create_order(self.customer)
+        
+        self.provider.void.assert_called_once()
+        self.assertEqual(Order.objects.get(user=self.customer).status, 'cancelled')
+        self.assertFalse(Ticket.objects.exists())
+    
+    def test_order_cancelled_during_authorization_is_not_confirmed(self):
+        """与信中に注文がキャンセルされた場合は売約済みにせず、与信を取り消す"""
+        def authorize(amount, reference, idempotency_key):
+            order = Order.objects.select_for_update().get(order_number=reference)
+            cancel_orders([(order.pk, order.total_amount)], reason='開催中止')
+            return StubProvider().authorize(amount, reference, idempotency_key)
+        self.provider.authorize.side_effect = authorize
+        
+        with self.assertRaisesMessage(ValueError, '注文がキャンセルされました'):
+            create_order(self.customer)
+        
+        self.provider.void.assert_called_once()
+        self.assertEqual(Order.objects.get(user=self.customer).status, 'cancelled')
+        self.assertFalse(Ticket.objects.exists())
+        self.assertFalse(EventSeat.objects.filter(event=self.event, status='sold').exists())
+    
+    def test_hold_is_extended_for_authorization(self):
+        """与信の間に期限切れにならないよう、カートの有効期限を延長する"""
+        Cart.objects.filter(user=self.customer).update(expires_at=timezone.now() + timedelta(seconds=5))
+        
+        def authorize(amount, reference, idempotency_key):
+            cart = Cart.objects.get(user=self.customer)
+            self.assertGreater(cart.remaining_seconds, 60)
+            return StubProvider().authorize(amount, reference, idempotency_key)
+        self.provider.authorize.side_effect = authorize
+        
+        create_order(self.customer)
+        self.provider.authorize.assert_called_once()
+    
+    def test_unexpected_authorize_error_fails_order(self):
+        """与信で想定外の例外が起きても支払待ちの注文を残さない"""
+        self.provider.authorize.side_effect = KeyError('id')
+        with self.assertRaises(KeyError):
+            create_order(self.customer)
+        
+        failed = Order.objects.get(user=self.customer)
+        self.assertEqual((failed.status, failed.payment.status), ('cancelled', 'failed'))
+
+
+class CaptureFailureTest(OrderTestMixin, TestCase):
+    """売上を確定できなかった注文のキャンセルのテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:2])
+        self.provider = mock.Mock(wraps=StubProvider())
+        patcher = mock.patch('apps.orders.services.get_provider', return_value=self.provider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with mock.patch('apps.orders.services.enqueue_payment_capture'), \
+                mock.patch('apps.orders.services.enqueue_order_confirmation'), \
+                mock.patch('apps.tickets.services.ticket_service.enqueue_ticket_rendering'):
+            self.order = create_order(self.customer)
+    
+    def assert_order_cancelled(self):
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.payment.status), ('cancelled', 'failed'))
+        self.assertFalse(Ticket.objects.filter(order=self.order).exclude(status='cancelled').exists())
+        self.assertEqual(
+            EventSeat.objects.filter(event=self.event, seat_id__in=self.seat_ids[:2], status='available').count(), 2
+        )
+        self.provider.void.assert_called_once_with(
+            self.order.payment.transaction_id, idempotency_key=f'{self.order.order_number}-void'
+        )
+    
+    def test_declined_capture_cancels_order(self):
+        """売上確定が拒否された場合は再試行せず、注文をキャンセルして座席を戻す"""
+        self.provider.capture.side_effect = PaymentDeclined('与信の有効期限が切れています')
+        with self.assertLogs('apps.orders.services', level='ERROR'):
+            result = capture_payment_task.apply(args=[self.order.payment.pk], throw=False)
+        
+        self.assertTrue(result.failed())
+        self.assertEqual(self.provider.capture.call_count, 1)
+        self.assert_order_cancelled()
+    
+    def test_exhausted_retries_cancel_order(self):
+        """ゲートウェイの障害で再試行の上限に達した場合は注文をキャンセルする"""
+        self.provider.capture.side_effect = GatewayUnavailable('timeout')
+        with self.assertLogs('apps.orders.services', level='ERROR'):
+            capture_payment_task.apply(
+                args=[self.order.payment.pk], retries=capture_payment_task.max_retries, throw=False
+            )
+        self.assert_order_cancelled()
+
+
+class PaymentTransactionTest(OrderTestMixin, TransactionTestCase):
+    """決済ゲートウェイとの通信がトランザクションの外で行われることのテスト"""
+    
+    def test_authorize_runs_outside_transaction(self):
+        """与信の呼び出し中はトランザクション（座席ロック）を保持しない"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:1])
+        in_transaction = []
+        
+        def authorize(amount, reference, idempotency_key):
+            in_transaction.append(connection.in_atomic_block)
+            return StubProvider().authorize(amount, reference, idempotency_key)
+        
+        provider = mock.Mock(wraps=StubProvider())
+        provider.authorize.side_effect = authorize
+        with mock.patch('apps.orders.services.get_provider', return_value=provider), \
+                mock.patch('apps.orders.services.enqueue_payment_capture'), \
+                mock.patch('apps.orders.services.enqueue_order_confirmation'), \
+                mock.patch('apps.tickets.services.ticket_service.enqueue_ticket_rendering'):
+            create_order(self.customer)
+        
+        self.assertEqual(in_transaction, [False])
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    """サーキットブレーカーのテスト"""
+    
+    def test_opens_after_consecutive_failures(self):
+        """連続して失敗すると開き、期間中は呼び出しをすぐに拒否する"""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        
+        self.assertTrue(breaker.is_open)
+        with self.assertRaises(GatewayUnavailable):
+            breaker.before_call()
+    
+    def test_half_open_trial(self):
+        """期間を過ぎると1回だけ試行を通し、成功すれば閉じ、失敗すれば再び開く"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        with mock.patch('apps.orders.payments.time.monotonic', return_value=100):
+            breaker.record_failure()
+        
+        with mock.patch('apps.orders.payments.time.monotonic', return_value=131):
+            breaker.before_call()
+            with self.assertRaises(GatewayUnavailable):
+                breaker.before_call()
+            breaker.record_failure()
+            with self.assertRaises(GatewayUnavailable):
+                breaker.before_call()
+        
+        with mock.patch('apps.orders.payments.time.monotonic', return_value=162):
+            breaker.before_call()
+            breaker.record_success()
+            breaker.before_call()
+        self.assertFalse(breaker.is_open)
+
+
+class PricingTest(OrderTestMixin, TestCase):
+    """料金計算のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        # A席は専用の価格、S席は座席種別未指定の座席指定チケットの価格
+        generate_seats(self.venue, 'B', 'A', '1', '1', 1, 2)
+        self.a_seat_ids = list(Seat.objects.filter(venue=self.venue, block='B').order_by('id').values_list('id', flat=True))
+        TicketType.objects.create(
+            event=self.event, name='A席', type='reserved', seat_type='A', price=5000, total_quantity=2
+        )
+        self.free = TicketType.objects.create(
+            event=self.event, name='自由席', type='free', price=3000, total_quantity=100
+        )
+        invalidate_price_table(self.event.pk)
+    
+    def test_prices_are_resolved_per_seat_type(self):
+        """座席種別・自由席ごとに価格が決まり、購入確定の合計と一致する"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:2] + self.a_seat_ids[:1])
+        cart = Cart.objects.get(user=self.customer)
+        CartItem.objects.create(cart=cart, ticket_type=self.free, event=self.event)
+        
+        items = list(cart.items.select_related('seat'))
+        self.assertEqual(price_cart_items(items), 8000 * 2 + 5000 + 3000)
+        self.assertEqual(sorted(item.unit_price for item in items), [3000, 5000, 8000, 8000])
+        self.assertEqual(cart.total_amount, 24000)
+        
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('orders:checkout'))
+        self.assertEqual(response.context['total_amount'], 24000)
+        
+        order = create_order(self.customer)
+        self.assertEqual(order.total_amount, 24000)
+        self.assertEqual(order.payment.amount, 24000)
+    
+    def test_seat_items_are_priced_by_selected_ticket_type(self):
+        """座席選択画面で選んだチケット種別の価格で購入し、座席種別の違うチケット種別では購入できない"""
+        premium = TicketType.objects.create(
+            event=self.event, name='プレミアム', type='reserved', price=12000, total_quantity=10
+        )
+        invalidate_price_table(self.event.pk)
+        self.assertEqual(self.add_to_cart(self.seat_ids[:2], ticket_type=premium).status_code, 200)
+        self.assertEqual(price_cart_items(Cart.objects.get(user=self.customer).items.select_related('seat')), 24000)
+        self.assertEqual(create_order(self.customer).total_amount, 24000)
+        
+        a_ticket_type = TicketType.objects.get(event=self.event, seat_type='A')
+        self.assertEqual(self.add_to_cart(self.seat_ids[2:3], ticket_type=a_ticket_type).status_code, 200)
+        with self.assertRaises(PricingError):
+            create_order(self.customer)
+        self.assertEqual(self.add_to_cart(self.seat_ids[3:4], ticket_type=self.free).status_code, 400)
+    
+    def test_price_table_is_cached_per_event(self):
+        """価格表はイベントごとにキャッシュされ、破棄するまでDBを参照しない"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:3])
+        items = list(Cart.objects.get(user=self.customer).items.select_related('seat'))
+        price_cart_items(items)
+        
+        TicketType.objects.filter(pk=self.ticket_type.pk).update(price=9000)
+        with self.assertNumQueries(0):
+            self.assertEqual(price_cart_items(items), 24000)
+        
+        invalidate_price_table(self.event.pk)
+        self.assertEqual(price_cart_items(items), 27000)
+    
+    def test_missing_price_is_an_error(self):
+        """対応するチケット種別がない座席は購入できない"""
+        TicketType.objects.filter(pk=self.ticket_type.pk).delete()
+        invalidate_price_table(self.event.pk)
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:1])
+        with self.assertRaises(PricingError):
+            create_order(self.customer)
+
+
+class FreeTicketCartTest(OrderTestMixin, TestCase):
+    """自由席チケットのカート追加のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        self.free = TicketType.objects.create(
+            event=self.event, name='自由席', type='free', price=3000, total_quantity=5
+        )
+        self.client.force_login(self.customer)
+    
+    def add_free(self, quantity):
+        return self.client.post(
+            reverse('orders:add_to_cart_free'),
+            {'ticket_type_id': self.free.pk, 'quantity': quantity}
+        )
+    
+    def test_add_within_stock(self):
+        """在庫の範囲内で追加でき、超える枚数は追加しない"""
+        self.assertRedirects(self.add_free(3), reverse('orders:cart'), fetch_redirect_response=False)
+        self.add_free(3)
+        self.add_free(0)
+        
+        self.assertEqual(CartItem.objects.filter(ticket_type=self.free).count(), 3)
+        self.assertEqual(TicketType.objects.get(pk=self.free.pk).remaining_quantity, 2)
+    
+    def test_remove_returns_stock(self):
+        """カートから削除した枚数は在庫に戻る"""
+        self.add_free(5)
+        item = CartItem.objects.filter(ticket_type=self.free).first()
+        self.client.post(reverse('orders:cart_remove', args=[item.pk]))
+        
+        self.assertEqual(TicketType.objects.get(pk=self.free.pk).remaining_quantity, 1)
+        self.add_free(1)
+        self.assertEqual(CartItem.objects.filter(ticket_type=self.free).count(), 5)
+
+
+class CartExpiryTest(OrderTestMixin, TestCase):
+    """カートの有効期限と期限切れカートの解放のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        self.free = TicketType.objects.create(
+            event=self.event, name='自由席', type='free', price=3000, total_quantity=10
+        )
+    
+    def expire(self, user):
+        Cart.objects.filter(user=user).update(expires_at=timezone.now() - timedelta(seconds=1))
+    
+    def test_add_returns_remaining_time(self):
+        """カート追加の応答に有効期限と残り秒数を含み、追加しても期限は延長しない"""
+        data = self.add_to_cart(self.seat_ids[:1]).json()
+        self.assertTrue(590 <= data['remaining_seconds'] <= 600)
+        
+        expires_at = timezone.now() + timedelta(minutes=1)
+        Cart.objects.filter(user=self.customer).update(expires_at=expires_at)
+        reserve_free_tickets(self.customer, self.free, 1)
+        self.assertEqual(Cart.objects.get(user=self.customer).expires_at, expires_at)
+        self.assertContains(self.client.get(reverse('orders:cart')), 'id="cart-timer"')
+    
+    def test_expired_carts_are_released_in_batches(self):
+        """期限切れのカートは座席と自由席の在庫を戻して削除し、期限内のカートは残す"""
+        users = [self.customer] + [
+            User.objects.create_user(username=f'user{i}', password='testpass123') for i in range(3)
+        ]
+        for i, user in enumerate(users):
+            reserve_seats(user, self.event.pk, self.seat_ids[i * 2:i * 2 + 2])
+            reserve_free_tickets(user, self.free, 2)
+        for user in users[:3]:
+            self.expire(user)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            result = release_expired_carts(batch_size=2)
+        
+        self.assertEqual(
+            (result['carts'], result['seats'], result['tickets'], result['batches']), (3, 6, 6, 2)
+        )
+        self.assertEqual(list(Cart.objects.values_list('user', flat=True)), [users[3].pk])
+        self.assertEqual(
+            EventSeat.objects.filter(event=self.event, status='reserved').count(), 2
+        )
+        self.assertEqual(TicketType.objects.get(pk=self.free.pk).remaining_quantity, 8)
+    
+    def test_expired_cart_cannot_be_checked_out(self):
+        """期限切れのカートは購入確定できず、カート画面には表示しない"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:1])
+        self.expire(self.customer)
+        
+        with self.assertRaisesMessage(ValueError, '有効期限'):
+            create_order(self.customer)
+        
+        self.client.force_login(self.customer)
+        self.assertRedirects(self.client.get(reverse('orders:checkout')), reverse('orders:cart'))
+        response = self.client.get(reverse('orders:cart'))
+        self.assertEqual(response.context['cart_items'], [])
+        self.assertContains(response, '有効期限が切れた')
+    
+    def test_adding_to_expired_cart_starts_over(self):
+        """期限切れのカートに追加すると、以前の中身を解放して新しい期限で始める"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:1])
+        reserve_free_tickets(self.customer, self.free, 3)
+        self.expire(self.customer)
+        
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[1:2])
+        
+        cart = Cart.objects.get(user=self.customer)
+        self.assertFalse(cart.is_expired)
+        self.assertEqual(list(cart.items.values_list('seat_id', flat=True)), self.seat_ids[1:2])
+        self.assertEqual(
+            EventSeat.objects.get(event=self.event, seat_id=self.seat_ids[0]).status, 'available'
+        )
+        self.assertEqual(TicketType.objects.get(pk=self.free.pk).remaining_quantity, 10)
+
+
+@override_settings(CART_STORE='cache')
+class CacheCartStoreTest(OrderTestMixin, TransactionTestCase):
+    """
+    キャッシュのカートのテスト（DBには座席の状態・在庫と注文だけを保存する）
+    
+    カートのロックはトランザクションのコミット後に解放されるため、実際にコミットする。
+    """
+    
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        for name in (
+            'apps.orders.services.enqueue_payment_capture',
+            'apps.orders.services.enqueue_order_confirmation',
+            'apps.tickets.services.ticket_service.enqueue_ticket_rendering',
+        ):
+            patcher = mock.patch(name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.free = TicketType.objects.create(
+            event=self.event, name='自由席', type='free', price=3000, total_quantity=10
+        )
+        self.store = get_cart_store()
+    
+    def expire(self, user):
+        with self.store.lock(user.pk) as cart:
+            self.store.set_expiry(cart, timezone.now() - timedelta(seconds=1))
+    
+    def test_cart_is_kept_in_cache(self):
+        """カートの追加・表示・削除・購入確定でカートのテーブルを使わない"""
+        use_temporary_media_root(self)
+        self.assertEqual(self.add_to_cart(self.seat_ids[:3]).status_code, 200)
+        reserve_free_tickets(self.customer, self.free, 2)
+        
+        response = self.client.get(reverse('orders:cart'))
+        items = response.context['cart_items']
+        self.assertEqual(len(items), 5)
+        self.assertContains(response, 'id="cart-timer"')
+        
+        seat_item = next(item for item in items if item.seat_id == self.seat_ids[0])
+        free_item = next(item for item in items if item.ticket_type_id)
+        for item in (seat_item, free_item):
+            self.client.post(reverse('orders:cart_remove', args=[item.id]))
+        self.assertEqual(
+            EventSeat.objects.get(event=self.event, seat_id=self.seat_ids[0]).status, 'available'
+        )
+        self.assertEqual(TicketType.objects.get(pk=self.free.pk).remaining_quantity, 9)
+        
+        order = create_order(self.customer)
+        self.assertEqual(order.status, 'paid')
+        self.assertCountEqual(
+            Ticket.objects.filter(order=order, seat__isnull=False).values_list('seat_id', flat=True),
+            self.seat_ids[1:3]
+        )
+        self.assertIsNone(self.store.get(self.customer.pk))
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+    
+    def test_lock_is_held_until_commit(self):
+        """カートのロックはトランザクションのコミットまで解放しない"""
+        with mock.patch.object(self.store, 'LOCK_WAIT', 0):
+            with transaction.atomic():
+                with self.store.lock(self.customer.pk):
+                    pass
+                with self.assertRaises(CartLocked), self.store.lock(self.customer.pk):
+                    pass
+            with self.store.lock(self.customer.pk):
+                pass
+            
+            # 例外で抜けた場合（ロールバック）はその場で解放する
+            with self.assertRaises(RuntimeError), transaction.atomic(), self.store.lock(self.customer.pk):
+                raise RuntimeError('ロールバック')
+            with self.store.lock(self.customer.pk):
+                pass
+    
+    def test_seat_items_keep_selected_ticket_type(self):
+        """座席のカートアイテムに選んだチケット種別を保存し、その価格で計算する"""
+        premium = TicketType.objects.create(
+            event=self.event, name='プレミアム', type='reserved', price=12000, total_quantity=10
+        )
+        invalidate_price_table(self.event.pk)
+        self.assertEqual(self.add_to_cart(self.seat_ids[:2], ticket_type=premium).status_code, 200)
+        
+        items = self.store.items(self.store.get(self.customer.pk))
+        self.assertEqual([item.ticket_type for item in items], [premium, premium])
+        self.assertEqual(price_cart_items(items), 24000)
+    
+    def test_expired_carts_are_released_in_batches(self):
+        """期限切れのカートは座席と自由席の在庫を戻して削除し、期限内のカートは残す"""
+        users = [self.customer] + [
+            User.objects.create_user(username=f'user{i}', password='testpass123') for i in range(3)
+        ]
+        for i, user in enumerate(users):
+            reserve_seats(user, self.event.pk, self.seat_ids[i * 2:i * 2 + 2])
+            reserve_free_tickets(user, self.free, 2)
+        for user in users[:3]:
+            self.expire(user)
+        
+        result = release_expired_carts(batch_size=2)
+        
+        self.assertEqual(
+            (result['carts'], result['seats'], result['tickets'], result['batches']), (3, 6, 6, 2)
+        )
+        self.assertEqual([self.store.get(user.pk) is not None for user in users], [False, False, False, True])
+        self.assertEqual(
+            EventSeat.objects.filter(event=self.event, status='reserved').count(), 2
+        )
+        self.assertEqual(TicketType.objects.get(pk=self.free.pk).remaining_quantity, 8)
+        self.assertEqual(release_expired_carts()['carts'], 0)
+    
+    def test_expiry_index_is_lock_free(self):
+        """有効期限の索引の書き込みはロックを取らず、同じ分のカートをすべて期限切れで見つける"""
+        users = [User.objects.create_user(username=f'user{i}', password='testpass123') for i in range(3)]
+        expires_at = timezone.now() + timedelta(minutes=5)
+        with mock.patch.object(self.store, '_lock', side_effect=AssertionError('ロックを取得しました')):
+            for user in users:
+                cart = self.store.create(user.pk)
+                self.store.set_expiry(cart, expires_at)
+        
+        expired = self.store.claim_expired(expires_at + timedelta(minutes=1), limit=10)
+        self.assertCountEqual([user_id for user_id, items in expired], [user.pk for user in users])
+        self.assertEqual(self.store.claim_expired(expires_at + timedelta(minutes=1), limit=10), [])
+    
+    def test_rolled_back_release_keeps_cart(self):
+        """在庫を戻すトランザクションがロールバックした場合はカートを残し、ロックの期限後に再び解放する"""
+        reserve_free_tickets(self.customer, self.free, 2)
+        self.expire(self.customer)
+        
+        with mock.patch('apps.orders.services.release_stock', side_effect=RuntimeError('接続断')):
+            with self.assertRaises(RuntimeError):
+                release_expired_carts()
+        self.assertIsNotNone(self.store.get(self.customer.pk))
+        self.assertEqual(TicketType.objects.get(pk=self.free.pk).remaining_quantity, 8)
+        
+        cache.delete(self.store.LOCK_KEY.format(user_id=self.customer.pk))
+        self.assertEqual(release_expired_carts()['tickets'], 2)
+        self.assertIsNone(self.store.get(self.customer.pk))
+        self.assertEqual(TicketType.objects.get(pk=self.free.pk).remaining_quantity, 10)
+    
+    def test_expired_holds_are_removed_from_cart(self):
+        """保持時間を過ぎて解放した座席はキャッシュのカートからも削除する"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:2])
+        reserve_free_tickets(self.customer, self.free, 1)
+        
+        result = release_expired_holds(now=timezone.now() + timedelta(minutes=30))
+        
+        self.assertEqual((result['released'], result['cart_items_deleted']), (2, 2))
+        items = self.store.items(self.store.get(self.customer.pk))
+        self.assertEqual([item.ticket_type_id for item in items], [self.free.pk])
+    
+    def test_locked_cart_is_skipped_when_releasing_holds(self):
+        """購入確定中のカートは待たずにスキップし、座席の解放は続ける"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:2])
+        
+        with self.store.lock(self.customer.pk):
+            result = release_expired_holds(now=timezone.now() + timedelta(minutes=30))
+        
+        self.assertEqual((result['released'], result['cart_items_deleted']), (2, 0))
+        self.assertFalse(EventSeat.objects.filter(event=self.event, status='reserved').exists())
+        with self.assertRaisesMessage(ValueError, '仮予約期限が切れています'):
+            create_order(self.customer)
+
+
+class MassCancellationTest(OrderTestMixin, TestCase):
+    """一括キャンセル・返金のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        use_eager_celery(self)
+        self.provider = mock.Mock(wraps=StubProvider())
+        patcher = mock.patch('apps.orders.services.get_provider', return_value=self.provider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.orders = []
+        for i in range(5):
+            user = User.objects.create_user(username=f'buyer{i}', password='testpass123')
+            reserve_seats(user, self.event.pk, self.seat_ids[i * 2:i * 2 + 2])
+            self.orders.append(create_order(user))
+        self.orders.sort(key=lambda order: order.pk)
+    
+    def assertAllCancelled(self, orders):
+        order_ids = [order.pk for order in orders]
+        self.assertFalse(Order.objects.filter(id__in=order_ids).exclude(status='cancelled').exists())
+        self.assertFalse(Ticket.objects.filter(order_id__in=order_ids).exclude(status='cancelled').exists())
+        self.assertFalse(Payment.objects.filter(order_id__in=order_ids).exclude(status='refunded').exists())
+        self.assertEqual(
+            Cancellation.objects.filter(order_id__in=order_ids, status='processed').count(), len(orders)
+        )
+    
+    def test_event_run_refunds_all_orders_in_chunks(self):
+        """イベントの全注文をチャンク単位でキャンセルし、座席を空席に戻す"""
+        run = create_cancellation_run(event=self.event, reason='開催中止', created_by=self.organizer.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            run = run_cancellation(run, chunk_size=2)
+        
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual((run.processed_orders, run.cancelled_tickets), (5, 10))
+        self.assertEqual(run.refunded_amount, sum(order.total_amount for order in self.orders))
+        self.assertAllCancelled(self.orders)
+        self.assertEqual(Cancellation.objects.filter(reason='開催中止').count(), 5)
+        self.assertFalse(EventSeat.objects.filter(event=self.event).exclude(status='available').exists())
+    
+    def test_run_resumes_after_interruption(self):
+        """中断した実行は記録した位置から再開し、同じ注文を二重に処理しない"""
+        run = create_cancellation_run(event=self.event)
+        with self.captureOnCommitCallbacks(execute=True):
+            run = run_cancellation(run, chunk_size=2, max_chunks=1)
+        self.assertEqual((run.status, run.last_order_id, run.processed_orders), ('running', self.orders[1].pk, 2))
+        
+        with mock.patch('apps.orders.services.cancel_orders', side_effect=RuntimeError('接続断')):
+            with self.assertRaises(RuntimeError):
+                run_cancellation(run, chunk_size=2)
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.error, run.last_order_id), ('failed', '接続断', self.orders[1].pk))
+        self.assertEqual(Order.objects.filter(status='cancelled').count(), 2)
+        
+        # 同じイベントの未完了の実行記録を再利用して再開する
+        self.assertEqual(create_cancellation_run(event=self.event).pk, run.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            run = run_cancellation(run, chunk_size=2)
+        self.assertEqual((run.status, run.processed_orders, run.cancelled_tickets), ('completed', 5, 10))
+        self.assertAllCancelled(self.orders)
+    
+    def test_query_count_does_not_grow_with_orders(self):
+        """1チャンクのクエリ数は注文数・チケット数によらず一定"""
+        def cancellation_run(orders):
+            for order in orders:
+                Cancellation.objects.create(order=order, reason='都合', refund_amount=order.total_amount)
+            return create_cancellation_run(
+                cancellations=Cancellation.objects.filter(order__in=orders)
+            )
+        
+        one = cancellation_run(self.orders[:1])
+        four = cancellation_run(self.orders[1:])
+        # 返金は支払いごとのタスクのため、コミット後の処理は数えない
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as one_order:
+                run_cancellation(one, max_chunks=1)
+            with CaptureQueriesContext(connection) as four_orders:
+                run_cancellation(four, max_chunks=1)
+        self.assertEqual(len(one_order), len(four_orders))
+        self.assertAllCancelled(self.orders)
+    
+    def test_bulk_approval_view(self):
+        """選択したキャンセル申請を一括承認するとCeleryで返金まで処理する"""
+        use_eager_celery(self)
+        cancellations = [
+            Cancellation.objects.create(order=order, reason='都合', refund_amount=order.total_amount)
+            for order in self.orders[:3]
+        ]
+        self.client.force_login(self.organizer.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('organizers:cancellation_bulk_approval'),
+                {'cancellation_ids': [cancellation.pk for cancellation in cancellations]}
+            )
+        
+        self.assertRedirects(response, reverse('organizers:cancellation_list'), fetch_redirect_response=False)
+        self.assertAllCancelled(self.orders[:3])
+        self.assertEqual(Order.objects.filter(status='paid').count(), 2)
+    
+    def test_event_cancel_starts_run(self):
+        """イベントを開催中止にすると全注文の一括キャンセルを開始する"""
+        use_eager_celery(self)
+        self.client.force_login(self.organizer.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('events:event_update', args=[self.event.pk]), {
+                'name': self.event.name,
+                'description': self.event.description,
+                'category': self.event.category,
+                'venue': self.venue.pk,
+                'start_datetime': timezone.localtime(self.event.start_datetime).strftime('%Y-%m-%dT%H:%M'),
+                'is_public': 'on',
+                'status': 'cancelled',
+            })
+        
+        self.assertEqual(CancellationRun.objects.get(event=self.event).status, 'completed')
+        self.assertAllCancelled(self.orders)
+    
+    def test_process_cancellation(self):
+        """個別のキャンセル承認も同じ処理でキャンセル・返金する"""
+        order = self.orders[0]
+        cancellation = Cancellation.objects.create(order=order, reason='都合', refund_amount=order.total_amount)
+        with self.captureOnCommitCallbacks(execute=True):
+            process_cancellation(cancellation, approved_by=self.organizer.user)
+        
+        self.assertEqual(cancellation.status, 'processed')
+        self.assertEqual(cancellation.processed_by, self.organizer.user)
+        self.assertAllCancelled([order])
+        self.assertEqual(Order.objects.filter(status='paid').count(), 4)
+    
+    def test_refund_waits_for_gateway(self):
+        """売上確定済みの支払いはゲートウェイが返金を受け付けてから返金済みにする"""
+        order = self.orders[0]
+        Payment.objects.filter(order=order).update(status='completed', captured_at=timezone.now())
+        self.provider.refund.side_effect = GatewayUnavailable('timeout')
+        cancellation = Cancellation.objects.create(order=order, reason='都合', refund_amount=order.total_amount)
+        with mock.patch('apps.orders.tasks.refund_payment_task.delay') as refund:
+            with self.captureOnCommitCallbacks(execute=True):
+                process_cancellation(cancellation, approved_by=self.organizer.user)
+        refund.assert_called_once_with(order.payment.pk)
+        self.assertEqual(Payment.objects.get(order=order).status, 'refund_pending')
+        
+        with self.assertLogs('apps.orders.tasks', level='ERROR'):
+            refund_payment_task.apply(args=[order.payment.pk], retries=refund_payment_task.max_retries, throw=False)
+        self.assertEqual(Payment.objects.get(order=order).status, 'refund_pending')
+        
+        self.provider.refund.side_effect = None
+        refund_payment_task.apply(args=[order.payment.pk])
+        self.assertEqual(Payment.objects.get(order=order).status, 'refunded')
+        self.provider.refund.assert_called_with(
+            Payment.objects.get(order=order).transaction_id, order.total_amount, idempotency_key=f'{order.order_number}-refund'
+        )
+        self.provider.void.assert_not_called()
+    
+    def test_cancelled_order_is_not_captured(self):
+        """キャンセルされた注文の売上は確定せず、与信を取り消す"""
+        order = self.orders[0]
+        cancellation = Cancellation.objects.create(order=order, reason='都合', refund_amount=order.total_amount)
+        with mock.patch('apps.orders.tasks.refund_payment_task.delay'):
+            with self.captureOnCommitCallbacks(execute=True):
+                process_cancellation(cancellation, approved_by=self.organizer.user)
+        
+        self.assertFalse(capture_payment(order.payment.pk))
+        self.provider.capture.assert_not_called()
+        
+        refund_payment_task.apply(args=[order.payment.pk])
+        self.provider.void.assert_called_once_with(
+            Payment.objects.get(order=order).transaction_id, idempotency_key=f'{order.order_number}-void'
+        )
+        self.provider.refund.assert_not_called()
+        self.assertEqual(Payment.objects.get(order=order).status, 'refunded')
+
+
+class IdempotentCheckoutTest(OrderTestMixin, TestCase):
+    """購入確定の二重送信のテスト"""
+    
+    def test_double_submit_creates_one_order(self):
+        """同じ冪等キーの購入確定は1回だけ実行し、同じ完了画面に誘導する"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:2])
+        self.client.force_login(self.customer)
+        
+        first = self.client.post(reverse('orders:checkout'), {'idempotency_key': 'checkout-1'})
+        second = self.client.post(reverse('orders:checkout'), {'idempotency_key': 'checkout-1'})
+        
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+        order = Order.objects.get(user=self.customer)
+        self.assertEqual(first.url, reverse('orders:purchase_complete', args=[order.order_number]))
+        self.assertEqual(second.status_code, 302)
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+    
+    def test_checkout_form_has_key(self):
+        """購入確認画面のフォームに冪等キーを埋め込む"""
+        reserve_seats(self.customer, self.event.pk, self.seat_ids[:1])
+        self.client.force_login(self.customer)
+        self.assertContains(self.client.get(reverse('orders:checkout')), 'name="idempotency_key"')
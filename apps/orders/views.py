@@ -4,48 +4,67 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import ListView
 from django.views import View
 from django.http import JsonResponse
-from django.db import transaction
 from django.contrib import messages
+from django.utils.decorators import method_decorator
 import json
-from .models import Cart, CartItem, Order, Payment, Cancellation
-from apps.seats.models import Seat
+from apps.core.idempotency import idempotent
+from .cart_store import get_cart_store
+from .models import Order, Payment, Cancellation, remaining_seconds
 from apps.events.models import TicketType
 
 
 class AddToCartView(LoginRequiredMixin, View):
     """カートに追加"""
     
+    @method_decorator(idempotent('cart_add'))
     def post(self, request):
+        from .services import reserve_seats
+        
         try:
             data = json.loads(request.body)
+            event_id = data.get('event_id')
             seat_ids = data.get('seat_ids', [])
+            ticket_type_id = data.get('ticket_type_id')
+            
+            if not event_id:
+                return JsonResponse({'error': 'No event specified'}, status=400)
             
             if not seat_ids:
                 return JsonResponse({'error': 'No seats selected'}, status=400)
             
-            with transaction.atomic():
-                # カート取得または作成
-                cart, created = Cart.objects.get_or_create(user=request.user)
-                
-                # 座席をロックして追加
-                for seat_id in seat_ids:
-                    seat = Seat.objects.select_for_update().get(
-                        id=seat_id,
-                        status='available'
-                    )
-                    
-                    # カートに追加
-                    CartItem.objects.create(cart=cart, seat=seat)
-                    
-                    # 座席を予約中に変更
-                    seat.status = 'reserved'
-                    seat.reserved_by = request.user
-                    seat.save()
+            # 座席選択画面で選んだチケット種別（価格の根拠になるため、イベントの座席指定に限る）
+            if ticket_type_id is not None and not TicketType.objects.filter(
+                pk=int(ticket_type_id), event_id=int(event_id), type='reserved'
+            ).exists():
+                return JsonResponse({'error': 'Invalid ticket type'}, status=400)
+            
+            result = reserve_seats(
+                request.user,
+                int(event_id),
+                [int(seat_id) for seat_id in seat_ids],
+                all_or_nothing=bool(data.get('all_or_nothing', False)),
+                ticket_type_id=int(ticket_type_id) if ticket_type_id is not None else None,
+            )
             
-            return JsonResponse({'success': True})
+            # 確保できなかった座席がある場合は409（確保できた座席はカートに追加済み）
+            if result['conflicts']:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Seat not available',
+                    'reserved': result['reserved'],
+                    'conflicts': result['conflicts'],
+                }, status=409)
             
-        except Seat.DoesNotExist:
-            return JsonResponse({'error': 'Seat not available'}, status=400)
+            return JsonResponse({
+                'success': True,
+                'reserved': result['reserved'],
+                'conflicts': [],
+                'expires_at': result['expires_at'].isoformat(),
+                'remaining_seconds': remaining_seconds(result['expires_at']),
+            })
+            
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'Invalid request'}, status=400)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
 
@@ -54,16 +73,28 @@ class CartView(LoginRequiredMixin, View):
     """カート表示"""
     
     def get(self, request):
+        from .pricing import price_cart_items, PricingError
+        
+        store = get_cart_store()
+        total_amount = None
+        cart_items = []
         try:
-            cart = Cart.objects.get(user=request.user)
-            cart_items = cart.items.select_related('seat__venue').all()
-        except Cart.DoesNotExist:
-            cart = None
-            cart_items = []
+            cart = store.get(request.user.pk)
+            if cart is not None and cart.is_expired:
+                # 中身は定期処理（または次のカート追加）で解放される
+                if store.has_items(cart):
+                    messages.warning(request, 'カートの有効期限が切れたため、座席・チケットの確保を解除しました。')
+                cart = None
+            if cart is not None:
+                cart_items = store.items(cart)
+                total_amount = price_cart_items(cart_items)
+        except PricingError as e:
+            messages.error(request, str(e))
         
         return render(request, 'orders/cart.html', {
             'cart': cart,
             'cart_items': cart_items,
+            'total_amount': total_amount,
         })
 
 
@@ -71,22 +102,12 @@ class RemoveFromCartView(LoginRequiredMixin, View):
     """カートから削除"""
     
     def post(self, request, item_id):
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
-            
-            with transaction.atomic():
-                # 座席を空席に戻す
-                seat = cart_item.seat
-                seat.status = 'available'
-                seat.reserved_by = None
-                seat.save()
-                
-                # カートアイテム削除
-                cart_item.delete()
-            
+        from .services import release_cart_item
+        
+        # 座席を空席に戻す（自由席は在庫を戻す）
+        if release_cart_item(request.user, item_id):
             messages.success(request, '座席をカートから削除しました。')
-        except (Cart.DoesNotExist, CartItem.DoesNotExist):
+        else:
             messages.error(request, 'カートアイテムが見つかりません。')
         
         return redirect('orders:cart')
@@ -97,38 +118,43 @@ class CheckoutView(LoginRequiredMixin, View):
     """購入確認・確定"""
     
     def get(self, request):
+        from .pricing import price_cart_items, PricingError
+        
+        store = get_cart_store()
         try:
-            cart = Cart.objects.get(user=request.user)
-            cart_items = cart.items.select_related('seat__venue').all()
+            cart = store.get(request.user.pk)
+            if cart is not None and cart.is_expired:
+                # カート画面で期限切れを案内する
+                return redirect('orders:cart')
+            cart_items = store.items(cart) if cart is not None else []
             
             if not cart_items:
                 messages.warning(request, 'カートが空です。')
                 return redirect('orders:cart')
             
-        except Cart.DoesNotExist:
-            messages.warning(request, 'カートが空です。')
+            total_amount = price_cart_items(cart_items)
+            
+        except PricingError as e:
+            messages.error(request, str(e))
             return redirect('orders:cart')
         
         return render(request, 'orders/checkout.html', {
             'cart': cart,
             'cart_items': cart_items,
+            'total_amount': total_amount,
         })
     
+    @method_decorator(idempotent('checkout'))
     def post(self, request):
         from .services import create_order
         
         try:
-            cart = Cart.objects.get(user=request.user)
-            
             # 購入確定処理
-            order = create_order(user=request.user, cart=cart)
+            order = create_order(user=request.user)
             
             messages.success(request, f'購入が完了しました。注文番号: {order.order_number}')
             return redirect('orders:purchase_complete', order_number=order.order_number)
             
-        except Cart.DoesNotExist:
-            messages.error(request, 'カートが見つかりません。')
-            return redirect('orders:cart')
         except Exception as e:
             messages.error(request, f'購入処理に失敗しました: {str(e)}')
             return redirect('orders:cart')
@@ -146,44 +172,28 @@ class PurchaseCompleteView(LoginRequiredMixin, View):
 
 
 @login_required
+@idempotent('cart_add_free')
 def add_to_cart_free_view(request):
     """自由席チケットをカートに追加"""
     if request.method == 'POST':
-        ticket_type_id = request.POST.get('ticket_type_id')
-        quantity = int(request.POST.get('quantity', 1))
+        from .services import reserve_free_tickets
         
+        ticket_type = get_object_or_404(TicketType, pk=request.POST.get('ticket_type_id'), type='free')
         try:
-            ticket_type = get_object_or_404(TicketType, pk=ticket_type_id, type='free')
-            
-            # 在庫チェック
-            if ticket_type.remaining_quantity < quantity:
-                messages.error(request, '指定された枚数が在庫を超えています。')
-                return redirect('events:event_detail', pk=ticket_type.event.pk)
-            
-            with transaction.atomic():
-                # カート取得または作成
-                cart, created = Cart.objects.get_or_create(user=request.user)
-                
-                # 自由席チケットをカートに追加（seat=Nullで管理）
-                # 注: CartItemモデルにticket_typeとquantityフィールドが必要
-                # 簡易実装として、枚数分のCartItemを作成
-                for _ in range(quantity):
-                    CartItem.objects.create(
-                        cart=cart,
-                        seat=None,
-                        ticket_type=ticket_type
-                    )
-                
-                # 販売済枚数を増加（仮予約）
-                ticket_type.sold_quantity += quantity
-                ticket_type.save()
-            
-            messages.success(request, f'{ticket_type.name} を {quantity}枚カートに追加しました。')
-            return redirect('orders:cart')
-            
-        except Exception as e:
-            messages.error(request, f'カートへの追加に失敗しました: {str(e)}')
-            return redirect('events:event_detail', pk=ticket_type.event.pk)
+            quantity = int(request.POST.get('quantity', 1))
+        except ValueError:
+            quantity = 0
+        if quantity < 1:
+            messages.error(request, '枚数は1以上を指定してください。')
+            return redirect('events:public_event_detail', pk=ticket_type.event_id)
+        
+        # 在庫の確認と確保は在庫シャードの条件付きUPDATEで同時に行う
+        if not reserve_free_tickets(request.user, ticket_type, quantity):
+            messages.error(request, '指定された枚数が在庫を超えています。')
+            return redirect('events:public_event_detail', pk=ticket_type.event_id)
+        
+        messages.success(request, f'{ticket_type.name} を {quantity}枚カートに追加しました。')
+        return redirect('orders:cart')
     
     return redirect('events:public_event_list')
 
@@ -4,6 +4,7 @@ from django.utils import timezone
 from datetime import timedelta
 from apps.orders.models import Order
 from apps.events.models import Event
+from apps.events.stock import with_shard_sold
 
 
 def calculate_sales_summary(organizer):
@@ -36,8 +37,8 @@ def calculate_sales_summary(organizer):
     # 完売イベント数（全チケットタイプが売り切れ）
     sold_out_count = 0
     for event in events:
-        ticket_types = event.ticket_types.all()
-        if ticket_types and all(tt.sold_quantity >= tt.total_quantity for tt in ticket_types):
+        ticket_types = with_shard_sold(event.ticket_types.all())
+        if ticket_types and all(tt.is_sold_out for tt in ticket_types):
             sold_out_count += 1
     
     # 開催予定イベント数（未来のイベント）
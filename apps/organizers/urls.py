@@ -14,5 +14,6 @@ urlpatterns = [
     
     # キャンセル管理
     path('cancellations/', views.cancellation_list_view, name='cancellation_list'),
+    path('cancellations/approve/', views.cancellation_bulk_approval_view, name='cancellation_bulk_approval'),
     path('cancellations/<int:cancellation_id>/', views.cancellation_approval_view, name='cancellation_approval'),
 ]
@@ -7,6 +7,7 @@ from django.utils import timezone
 from apps.organizers.models import Organizer
 from apps.organizers.services import calculate_sales_summary, get_sales_trend, get_event_sales
 from apps.orders.models import Cancellation
+from apps.core.pagination import paginate_keyset
 import csv
 
 
@@ -103,13 +104,42 @@ def cancellation_list_view(request):
     # 主催者のイベントに関するキャンセル申請を取得
     cancellations = Cancellation.objects.filter(
         order__event__organizer=organizer
-    ).select_related('order__user', 'order__event').order_by('-requested_at')
+    ).select_related('order__user', 'order__event')
+    page = paginate_keyset(request, cancellations, ['-requested_at', '-id'], 50)
     
     return render(request, 'organizers/cancellation_list.html', {
-        'cancellations': cancellations,
+        'cancellations': page,
+        'page_obj': page,
     })
 
 
+@login_required
+def cancellation_bulk_approval_view(request):
+    """キャンセル申請の一括承認（Celeryで一括キャンセル・返金）"""
+    try:
+        organizer = request.user.organizer
+    except Organizer.DoesNotExist:
+        messages.error(request, '主催者アカウントが見つかりません。')
+        return redirect('home')
+    
+    if request.method == 'POST':
+        cancellations = Cancellation.objects.filter(
+            pk__in=request.POST.getlist('cancellation_ids'),
+            order__event__organizer=organizer,
+            status='requested'
+        )
+        if cancellations.exists():
+            from apps.orders.services import start_cancellation_run
+            run = start_cancellation_run(cancellations=cancellations, created_by=request.user)
+            messages.success(
+                request, f'{len(run.cancellation_ids)}件のキャンセル申請を承認しました。返金処理は順次行われます。'
+            )
+        else:
+            messages.warning(request, '承認するキャンセル申請を選択してください。')
+    
+    return redirect('organizers:cancellation_list')
+
+
 @login_required
 def cancellation_approval_view(request, cancellation_id):
     """キャンセル承認・却下"""
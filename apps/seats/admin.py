@@ -1,10 +1,17 @@
 from django.contrib import admin
-from .models import Seat
+from .models import Seat, EventSeat
 
 
 @admin.register(Seat)
 class SeatAdmin(admin.ModelAdmin):
-    list_display = ['venue', 'block', 'row', 'number', 'seat_type', 'status']
-    list_filter = ['venue', 'seat_type', 'status', 'created_at']
+    list_display = ['venue', 'block', 'row', 'number', 'seat_type']
+    list_filter = ['venue', 'seat_type', 'created_at']
     search_fields = ['block', 'row', 'number']
 
+
+@admin.register(EventSeat)
+class EventSeatAdmin(admin.ModelAdmin):
+    list_display = ['event', 'seat', 'status', 'reserved_by', 'reserved_at']
+    list_filter = ['status']
+    search_fields = ['event__name', 'seat__block', 'seat__row', 'seat__number']
+    raw_id_fields = ['seat', 'reserved_by']
@@ -0,0 +1,240 @@
+"""
+おまかせ座席割当（Best Available）
+
+同じ列で連続する空席をまとめた「空席ラン」を座席種別・ブロック・列ごとに事前計算してキャッシュし、
+指定枚数が並んで座れる候補を 座席種別 → ブロック → 列（前方優先） → 列の中央からの距離
+の順で評価する。候補は優先順に列を見ていき、並んで座れる最初の列で打ち切る（列の中の位置は
+中央からの距離で直接求める）ため、前方に空席があれば会場の広さによらず数列を見るだけで決まる。
+確保は SELECT ... FOR UPDATE SKIP LOCKED と条件付きUPDATEで行い、他の購入者と競合した座席は
+除外して再試行する。
+
+販売中は座席ステータスが頻繁に変わるため、空席ランは変更のたびに破棄せず短時間だけ
+キャッシュする。確保時にDBで空席を再確認するため、古いランを使っても二重確保は起きない。
+"""
+import math
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from apps.seats.models import EventSeat
+from apps.seats.services import get_venue_layout, get_seat_status_overlay, record_seat_changes
+
+
+AVAILABLE_RUNS_CACHE_KEY = 'seats:runs:{event_id}'
+AVAILABLE_RUNS_CACHE_TIMEOUT = 2
+
+
+# 一度に割り当てる最大枚数
+MAX_QUANTITY = 10
+
+# 競合時の再試行回数
+MAX_ATTEMPTS = 5
+
+
+class SeatAllocationError(Exception):
+    """座席を割り当てられない場合の例外"""
+
+
+def build_available_runs(event):
+    """
+    座席種別・ブロック・列ごとの空席ランを構築する
+
+    会場の座席配置とステータスの重ね合わせ（いずれもキャッシュ）から組み立てる。
+    座席配置は列・番号の並び順キー順のため、列内の並べ替えは不要。
+
+    Returns:
+        dict: {seat_type: {block: [[(row_center, start, seat_ids), ...], ...]}}
+            列のリストはブロック内の列の順番（先頭が最前列）で、空席ランのない列は空のリスト
+            row_center: 列の中央の位置
+            start: ランの先頭の列内位置
+    """
+    layout = get_venue_layout(event.venue_id)
+    statuses = get_seat_status_overlay(event)
+
+    runs = {}
+    for block, rows in layout['blocks'].items():
+        for row_rank, seats in enumerate(rows.values()):
+            row_center = (len(seats) - 1) / 2
+
+            def add_run(seat_type, start, run):
+                block_rows = runs.setdefault(seat_type, {}).setdefault(block, [])
+                while len(block_rows) <= row_rank:
+                    block_rows.append([])
+                block_rows[row_rank].append((row_center, start, run))
+
+            run = []
+            previous = None
+            for position, (seat_id, number, seat_type) in enumerate(seats):
+                adjacent = (
+                    previous is not None
+                    and previous[2] == seat_type
+                    and (not number.isdigit() or not previous[1].isdigit() or int(number) == int(previous[1]) + 1)
+                )
+                if not adjacent or seat_id in statuses:
+                    if run:
+                        add_run(previous[2], start, run)
+                    run = []
+                if seat_id not in statuses:
+                    if not run:
+                        start = position
+                    run.append(seat_id)
+                previous = (seat_id, number, seat_type)
+            if run:
+                add_run(previous[2], start, run)
+    return runs
+
+
+def get_available_runs(event):
+    """座席種別・ブロック・列ごとの空席ランを取得（短時間キャッシュ）"""
+    key = AVAILABLE_RUNS_CACHE_KEY.format(event_id=event.pk)
+    runs = cache.get(key)
+    if runs is None:
+        runs = build_available_runs(event)
+        cache.set(key, runs, AVAILABLE_RUNS_CACHE_TIMEOUT)
+    return runs
+
+
+def _split_excluded(start, run, excluded):
+    """除外する座席でランを分割する"""
+    pieces = []
+    piece_start = start
+    piece = []
+    for position, seat_id in enumerate(run, start):
+        if seat_id in excluded:
+            if piece:
+                pieces.append((piece_start, piece))
+            piece = []
+            piece_start = position + 1
+        else:
+            piece.append(seat_id)
+    if piece:
+        pieces.append((piece_start, piece))
+    return pieces
+
+
+def _best_in_row(row_runs, quantity, excluded):
+    """
+    列の中で中央に最も近い並びを探す
+
+    ランごとに、中央に並びの中心を合わせた位置をランの範囲に収めて直接求める
+    （同じ距離なら前の並び）。
+
+    Returns:
+        tuple: (列の中央からの距離, 座席IDのリスト)（並んで座れない場合はNone）
+    """
+    best = None
+    for row_center, start, run in row_runs:
+        if len(run) < quantity:
+            continue
+        pieces = [(start, run)]
+        if excluded and not excluded.isdisjoint(run):
+            pieces = _split_excluded(start, run, excluded)
+        for piece_start, piece in pieces:
+            if len(piece) < quantity:
+                continue
+            ideal = row_center - (quantity - 1) / 2 - piece_start
+            offset = min(max(math.ceil(ideal - 0.5), 0), len(piece) - quantity)
+            distance = abs(piece_start + offset + (quantity - 1) / 2 - row_center)
+            if best is None or distance < best[0]:
+                best = (distance, piece[offset:offset + quantity])
+    return best
+
+
+def find_best_seats(event, quantity, seat_types=None, blocks=None, excluded=frozenset()):
+    """
+    並んで座れる最良の座席を探す
+
+    座席種別・ブロックの希望順に前方の列から見ていき、並んで座れる最初の列で打ち切る。
+    ブロックの指定がない場合は全ブロックの同じ順番の列を比べ、中央に最も近い並びを選ぶ。
+
+    Args:
+        event: Eventオブジェクト
+        quantity: 枚数
+        seat_types: 座席種別の希望順（例: ['S', 'A']、未指定時は全種別をS→A→Bの順）
+        blocks: ブロックの希望順（未指定時は全ブロックを同順位）
+        excluded: 除外する座席ID（競合で確保できなかった座席）
+
+    Returns:
+        list: 座席IDのリスト（見つからない場合はNone）
+    """
+    runs = get_available_runs(event)
+
+    for seat_type in seat_types or ['S', 'A', 'B']:
+        type_runs = runs.get(seat_type)
+        if not type_runs:
+            continue
+        if blocks:
+            block_groups = [[type_runs[block]] for block in blocks if block in type_runs]
+        else:
+            block_groups = [list(type_runs.values())]
+
+        for block_rows in block_groups:
+            for row_rank in range(max(len(rows) for rows in block_rows)):
+                best = None
+                for rows in block_rows:
+                    if row_rank >= len(rows):
+                        continue
+                    found = _best_in_row(rows[row_rank], quantity, excluded)
+                    if found is not None and (best is None or found[0] < best[0]):
+                        best = found
+                if best is not None:
+                    return best[1]
+    return None
+
+
+def allocate_best_seats(event, user, quantity, seat_types=None, blocks=None, ticket_type_id=None):
+    """
+    おまかせで座席を割り当て、仮予約してカートに追加する
+
+    Args:
+        event: Eventオブジェクト
+        user: 購入者
+        quantity: 枚数
+        seat_types: 座席種別の希望順
+        blocks: ブロックの希望順
+        ticket_type_id: 座席指定のチケット種別ID（カートアイテムの価格になる）
+
+    Returns:
+        list: 確保したEventSeatのリスト（座席情報付き）
+
+    Raises:
+        SeatAllocationError: 条件に合う座席がない場合
+    """
+    from apps.orders.cart_store import get_cart_store
+    from apps.orders.services import open_cart
+
+    if not 1 <= quantity <= MAX_QUANTITY:
+        raise SeatAllocationError(f'枚数は1〜{MAX_QUANTITY}枚で指定してください')
+
+    excluded = set()
+    for attempt in range(MAX_ATTEMPTS):
+        seat_ids = find_best_seats(event, quantity, seat_types, blocks, excluded)
+        if seat_ids is None:
+            break
+
+        with transaction.atomic():
+            # 他の購入者が処理中の座席は待たずにスキップ
+            locked = dict(
+                EventSeat.objects.select_for_update(skip_locked=True).filter(
+                    event=event,
+                    seat_id__in=seat_ids,
+                    status='available'
+                ).order_by('seat_id').values_list('seat_id', 'id')
+            )
+            if len(locked) == quantity:
+                EventSeat.objects.filter(id__in=locked.values()).update(
+                    status='reserved',
+                    reserved_by=user,
+                    reserved_at=timezone.now()
+                )
+                with open_cart(user) as cart:
+                    get_cart_store().add_items(cart, event.pk, seat_ids=seat_ids, ticket_type_id=ticket_type_id)
+                record_seat_changes(event.pk, seat_ids)
+                return list(
+                    EventSeat.objects.filter(id__in=locked.values()).select_related('seat').order_by('seat_id')
+                )
+
+        # 確保できなかった座席を除外し、空席ランを最新の状態から作り直して再試行
+        excluded.update(seat_id for seat_id in seat_ids if seat_id not in locked)
+        cache.delete(AVAILABLE_RUNS_CACHE_KEY.format(event_id=event.pk))
+
+    raise SeatAllocationError('条件に合う連続した空席が見つかりませんでした')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SeatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.seats'
+    
+    def ready(self):
+        # シグナルの受信を登録
+        from . import signals
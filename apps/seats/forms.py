@@ -43,3 +43,38 @@ class SeatBulkCreateForm(forms.Form):
         label='終了番号',
         widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': '20'})
     )
+
+
+class SeatImportForm(forms.Form):
+    """座席配置ファイルインポートフォーム"""
+    
+    FORMAT_CHOICES = [
+        ('', '拡張子から判定'),
+        ('csv', 'CSV'),
+        ('json', 'JSON'),
+        ('jsonl', 'JSON Lines'),
+    ]
+    
+    layout_file = forms.FileField(
+        label='座席配置ファイル',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.json,.jsonl,.ndjson'})
+    )
+    
+    file_format = forms.ChoiceField(
+        label='ファイル形式',
+        choices=FORMAT_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    
+    def clean(self):
+        from apps.seats.importers import detect_format, SeatImportError
+        
+        cleaned_data = super().clean()
+        layout_file = cleaned_data.get('layout_file')
+        if layout_file and not cleaned_data.get('file_format'):
+            try:
+                cleaned_data['file_format'] = detect_format(layout_file.name)
+            except SeatImportError as e:
+                raise forms.ValidationError(str(e))
+        return cleaned_data
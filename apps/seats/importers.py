@@ -0,0 +1,296 @@
+"""
+座席配置ファイルの一括インポート
+
+CSV / JSON（配列）/ JSON Lines の座席配置ファイルを先頭から順に読み込んで1行ずつ検証し、
+一定件数ごとに取り込む。ファイル全体をメモリに載せないため、数万席規模の会場でも扱える。
+
+    - PostgreSQL: COPYで一時テーブルに流し込み、INSERT ... ON CONFLICT DO NOTHING で登録
+    - その他のDB: チャンクごとのbulk_create(ignore_conflicts=True)で登録
+
+いずれも登録済みの座席（会場・ブロック・列・番号が同じもの）はスキップする。
+
+ファイルの列（JSONではキー）: block, row, number, seat_type
+"""
+import codecs
+import csv
+import io
+import json
+import re
+from django.db import connection, transaction
+from apps.seats.models import Seat, seat_sort_key
+from apps.seats.services import refresh_venue_seats
+
+
+# bulk_create・ファイル読み込みの単位
+IMPORT_CHUNK_SIZE = 5000
+JSON_READ_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'\s*')
+
+# 結果に含めるエラーメッセージの上限
+MAX_REPORTED_ERRORS = 20
+
+FORMAT_CHOICES = [
+    ('csv', 'CSV'),
+    ('json', 'JSON'),
+    ('jsonl', 'JSON Lines'),
+]
+
+FORMAT_EXTENSIONS = {
+    '.csv': 'csv',
+    '.json': 'json',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+}
+
+SEAT_FIELDS = ('block', 'row', 'number', 'seat_type')
+
+
+class SeatImportError(Exception):
+    """ファイル全体を取り込めない場合の例外（形式エラーなど）"""
+
+
+def detect_format(filename):
+    """
+    ファイル名の拡張子から形式を判定する
+
+    Returns:
+        str: 'csv' / 'json' / 'jsonl'
+
+    Raises:
+        SeatImportError: 対応していない拡張子の場合
+    """
+    for extension, file_format in FORMAT_EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return file_format
+    raise SeatImportError('CSV（.csv）・JSON（.json）・JSON Lines（.jsonl）のいずれかを指定してください')
+
+
+def iter_csv_records(stream):
+    """CSVを1行ずつ読み込む（1行目はヘッダー）"""
+    reader = csv.DictReader(stream)
+    missing = [name for name in SEAT_FIELDS if name not in (reader.fieldnames or [])]
+    if missing:
+        raise SeatImportError(f'CSVのヘッダーに列がありません: {", ".join(missing)}')
+    for record in reader:
+        yield f'{reader.line_num}行目', record
+
+
+def iter_jsonl_records(stream):
+    """JSON Linesを1行ずつ読み込む"""
+    for line_num, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise SeatImportError(f'{line_num}行目: JSONとして読み込めません')
+        yield f'{line_num}行目', record
+
+
+def iter_json_records(stream):
+    """
+    JSON配列の要素を先頭から1つずつ読み込む
+
+    配列全体をjson.loadで読み込むとファイルサイズ分のメモリを使うため、
+    一定サイズずつ読み込み、要素ごとにデコードして読み終えた部分は捨てる。
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    started = False
+    index = 0
+
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()
+        # 読み込み済みの残りが少なくなったら続きを読む
+        if not eof and len(buffer) - pos < JSON_READ_SIZE:
+            chunk = stream.read(JSON_READ_SIZE)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            eof = not chunk
+            continue
+        if pos >= len(buffer):
+            raise SeatImportError('JSONが途中で終わっています')
+
+        if not started:
+            if buffer[pos] != '[':
+                raise SeatImportError('JSONは座席オブジェクトの配列で指定してください')
+            started = True
+            pos += 1
+            continue
+        if buffer[pos] == ']':
+            return
+        if index and buffer[pos] == ',':
+            pos += 1
+            continue
+
+        try:
+            record, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            if eof:
+                raise SeatImportError(f'{index + 1}件目: JSONとして読み込めません')
+            # 要素が読み込み単位より大きい場合は続きを読んで再試行
+            chunk = stream.read(JSON_READ_SIZE)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            eof = not chunk
+            continue
+        index += 1
+        yield f'{index}件目', record
+
+
+RECORD_READERS = {
+    'csv': iter_csv_records,
+    'json': iter_json_records,
+    'jsonl': iter_jsonl_records,
+}
+
+
+def clean_seat_record(record):
+    """
+    座席1件分を検証する
+
+    Returns:
+        tuple: (block, row, number, seat_type)
+
+    Raises:
+        ValueError: 不正な値の場合
+    """
+    if not isinstance(record, dict):
+        raise ValueError('座席はオブジェクトで指定してください')
+
+    values = []
+    for name in SEAT_FIELDS:
+        value = record.get(name)
+        value = '' if value is None else str(value).strip()
+        if not value:
+            raise ValueError(f'{name} が空です')
+        max_length = Seat._meta.get_field(name).max_length
+        if len(value) > max_length:
+            raise ValueError(f'{name} は{max_length}文字以内で指定してください')
+        values.append(value)
+
+    if values[3] not in dict(Seat.SEAT_TYPE_CHOICES):
+        raise ValueError(f'seat_type が不正です: {values[3]}')
+    return tuple(values)
+
+
+class _CopySource:
+    """検証済みの座席をCOPY用のCSVとして少しずつ読み出すファイルオブジェクト"""
+
+    def __init__(self, seats):
+        self.seats = seats
+        self.pending = ''
+        self.line = io.StringIO()
+        self.writer = csv.writer(self.line)
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            seat = next(self.seats, None)
+            if seat is None:
+                break
+            self.line.seek(0)
+            self.line.truncate()
+            self.writer.writerow(seat)
+            self.pending += self.line.getvalue()
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def _copy_seats(venue, seats):
+    """PostgreSQLのCOPYで座席を登録する"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE seat_import ('
+            'block varchar(50), "row" varchar(10), number varchar(10), seat_type varchar(1), '
+            'row_sort integer, number_sort integer'
+            ') ON COMMIT DROP'
+        )
+        cursor.copy_expert(
+            'COPY seat_import (block, "row", number, seat_type, row_sort, number_sort) '
+            'FROM STDIN WITH (FORMAT csv)',
+            _CopySource(
+                (block, row, number, seat_type, seat_sort_key(row), seat_sort_key(number))
+                for block, row, number, seat_type in seats
+            ),
+        )
+        cursor.execute(
+            f'INSERT INTO {Seat._meta.db_table} '
+            '(venue_id, block, "row", number, seat_type, row_sort, number_sort, created_at, updated_at) '
+            'SELECT %s, block, "row", number, seat_type, row_sort, number_sort, now(), now() FROM seat_import '
+            'ON CONFLICT (venue_id, block, "row", number) DO NOTHING',
+            [venue.pk]
+        )
+        return cursor.rowcount
+
+
+def _bulk_create_seats(venue, seats, chunk_size):
+    """チャンクごとのbulk_createで座席を登録する"""
+    before = Seat.objects.filter(venue=venue).count()
+    chunk = []
+    for block, row, number, seat_type in seats:
+        chunk.append(
+            Seat(venue=venue, block=block, row=row, number=number, seat_type=seat_type).set_sort_keys()
+        )
+        if len(chunk) >= chunk_size:
+            Seat.objects.bulk_create(chunk, ignore_conflicts=True)
+            chunk = []
+    if chunk:
+        Seat.objects.bulk_create(chunk, ignore_conflicts=True)
+    return Seat.objects.filter(venue=venue).count() - before
+
+
+def import_seat_layout(venue, fileobj, file_format, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    座席配置ファイルを取り込む
+
+    不正な行は登録せずにエラーとして報告し、残りの行を取り込む。
+    ファイル自体が読み込めない場合は何も登録しない。
+
+    Args:
+        venue: Venueオブジェクト
+        fileobj: ファイルオブジェクト（バイナリ、UTF-8。BOM付きも可）
+        file_format: 'csv' / 'json' / 'jsonl'
+        chunk_size: bulk_createの単位
+
+    Returns:
+        dict: {'total': 読み込んだ件数, 'created': 登録件数,
+               'skipped': 登録済み・ファイル内重複でスキップした件数,
+               'invalid': 不正な件数, 'errors': エラーメッセージ（先頭のみ）}
+
+    Raises:
+        SeatImportError: ファイル形式が不正な場合
+    """
+    if file_format not in RECORD_READERS:
+        raise SeatImportError(f'不明なファイル形式です: {file_format}')
+
+    stream = codecs.getreader('utf-8-sig')(fileobj)
+    result = {'total': 0, 'created': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+
+    def valid_seats():
+        for location, record in RECORD_READERS[file_format](stream):
+            result['total'] += 1
+            try:
+                yield clean_seat_record(record)
+            except ValueError as e:
+                result['invalid'] += 1
+                if len(result['errors']) < MAX_REPORTED_ERRORS:
+                    result['errors'].append(f'{location}: {e}')
+
+    try:
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                result['created'] = _copy_seats(venue, valid_seats())
+            else:
+                result['created'] = _bulk_create_seats(venue, valid_seats(), chunk_size)
+    except UnicodeDecodeError:
+        raise SeatImportError('ファイルはUTF-8で保存してください')
+    except csv.Error as e:
+        raise SeatImportError(f'CSVを読み込めません: {e}')
+
+    result['skipped'] = result['total'] - result['invalid'] - result['created']
+    refresh_venue_seats(venue)
+    return result
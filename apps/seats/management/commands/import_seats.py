@@ -0,0 +1,39 @@
+"""座席配置ファイル（CSV / JSON / JSON Lines）を会場に取り込むコマンド"""
+from django.core.management.base import BaseCommand, CommandError
+from apps.events.models import Venue
+from apps.seats.importers import (
+    import_seat_layout, detect_format, SeatImportError, FORMAT_CHOICES, IMPORT_CHUNK_SIZE,
+)
+
+
+class Command(BaseCommand):
+    help = '座席配置ファイルを会場に一括登録します（登録済みの座席はスキップ）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('venue_id', type=int, help='会場ID')
+        parser.add_argument('path', help='座席配置ファイルのパス')
+        parser.add_argument(
+            '--format', dest='file_format', choices=[value for value, label in FORMAT_CHOICES],
+            default=None, help='ファイル形式（省略時は拡張子から判定）'
+        )
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='bulk_createの単位')
+
+    def handle(self, *args, **options):
+        try:
+            venue = Venue.objects.get(pk=options['venue_id'])
+        except Venue.DoesNotExist:
+            raise CommandError(f"会場が見つかりません: {options['venue_id']}")
+
+        try:
+            file_format = options['file_format'] or detect_format(options['path'])
+            with open(options['path'], 'rb') as fileobj:
+                result = import_seat_layout(venue, fileobj, file_format, chunk_size=options['chunk_size'])
+        except (OSError, SeatImportError) as e:
+            raise CommandError(f'座席配置ファイルを取り込めませんでした: {e}')
+
+        for error in result['errors']:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f"{venue.name}: 読み込み {result['total']}件 / 登録 {result['created']}件 / "
+            f"スキップ {result['skipped']}件 / 不正 {result['invalid']}件"
+        ))
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_initial'),
+        ('seats', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSeat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('available', '空席'), ('reserved', '予約中'), ('sold', '売約済')], default='available', max_length=20, verbose_name='ステータス')),
+                ('reserved_at', models.DateTimeField(blank=True, null=True, verbose_name='仮予約日時')),
+                ('version', models.IntegerField(default=0, verbose_name='バージョン')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='event_seats', to='events.event', verbose_name='イベント')),
+                ('reserved_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reserved_event_seats', to=settings.AUTH_USER_MODEL, verbose_name='仮予約者')),
+                ('seat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='event_seats', to='seats.seat', verbose_name='座席')),
+            ],
+            options={
+                'verbose_name': 'イベント座席',
+                'verbose_name_plural': 'イベント座席',
+                'db_table': 'event_seats',
+                'indexes': [models.Index(fields=['event', 'status'], name='idx_evseats_event_status'), models.Index(fields=['status', 'reserved_at'], name='idx_evseats_status_reserved_at')],
+                'unique_together': {('event', 'seat')},
+            },
+        ),
+    ]
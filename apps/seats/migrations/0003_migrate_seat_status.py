@@ -0,0 +1,84 @@
+# 会場単位の座席ステータスをイベント別在庫（EventSeat）へ移行する
+
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+
+
+def forwards(apps, schema_editor):
+    """
+    既存のSeat.status/reserved_by/reserved_atをEventSeatへコピーする
+
+    - 全イベントについて、会場の全座席分のEventSeatを作成（初期値は空席）
+    - チケットが発行済みの座席は、そのチケットの注文イベントで売約済とする
+    - チケットに紐付かない予約中・売約済の座席は、旧create_orderと同じ規則
+      （会場の公開イベントのうち開始日時が最も新しいもの）で割り当てる
+    """
+    Event = apps.get_model('events', 'Event')
+    Seat = apps.get_model('seats', 'Seat')
+    EventSeat = apps.get_model('seats', 'EventSeat')
+    Ticket = apps.get_model('tickets', 'Ticket')
+
+    for event in Event.objects.all().iterator():
+        seat_ids = Seat.objects.filter(venue_id=event.venue_id).values_list('id', flat=True)
+        EventSeat.objects.bulk_create(
+            (EventSeat(event_id=event.pk, seat_id=seat_id) for seat_id in seat_ids.iterator()),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    # チケット発行済みの座席
+    sold_pairs = Ticket.objects.filter(
+        seat__isnull=False,
+        status__in=['valid', 'used'],
+    ).values_list('order__event_id', 'seat_id')
+    ticketed_seat_ids = set()
+    for event_id, seat_id in sold_pairs.iterator():
+        EventSeat.objects.filter(event_id=event_id, seat_id=seat_id).update(status='sold')
+        ticketed_seat_ids.add(seat_id)
+
+    # チケットに紐付かない予約中・売約済の座席
+    legacy_seats = Seat.objects.exclude(status='available').exclude(id__in=ticketed_seat_ids)
+    default_events = {}
+    for seat in legacy_seats.iterator():
+        if seat.venue_id not in default_events:
+            default_events[seat.venue_id] = Event.objects.filter(
+                venue_id=seat.venue_id,
+                is_public=True,
+            ).order_by('-start_datetime').values_list('id', flat=True).first()
+        event_id = default_events[seat.venue_id]
+        if event_id is None:
+            continue
+        EventSeat.objects.filter(event_id=event_id, seat_id=seat.pk).update(
+            status=seat.status,
+            reserved_by_id=seat.reserved_by_id,
+            reserved_at=seat.reserved_at,
+            version=seat.version,
+        )
+
+
+def backwards(apps, schema_editor):
+    """EventSeatのステータスをSeatへ書き戻す（同一座席に複数イベントがある場合は売約済を優先）"""
+    Seat = apps.get_model('seats', 'Seat')
+    EventSeat = apps.get_model('seats', 'EventSeat')
+
+    for status in ['reserved', 'sold']:
+        for event_seat in EventSeat.objects.filter(status=status).iterator():
+            Seat.objects.filter(pk=event_seat.seat_id).update(
+                status=status,
+                reserved_by_id=event_seat.reserved_by_id,
+                reserved_at=event_seat.reserved_at,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seats', '0002_eventseat'),
+        ('tickets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
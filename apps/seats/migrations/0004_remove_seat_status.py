@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seats', '0003_migrate_seat_status'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='seat',
+            name='idx_seats_venue_status',
+        ),
+        migrations.RemoveIndex(
+            model_name='seat',
+            name='idx_seats_status_reserved_at',
+        ),
+        migrations.RemoveField(
+            model_name='seat',
+            name='reserved_at',
+        ),
+        migrations.RemoveField(
+            model_name='seat',
+            name='reserved_by',
+        ),
+        migrations.RemoveField(
+            model_name='seat',
+            name='status',
+        ),
+        migrations.RemoveField(
+            model_name='seat',
+            name='version',
+        ),
+    ]
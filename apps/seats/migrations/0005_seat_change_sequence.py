@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_initial'),
+        ('seats', '0004_remove_seat_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatChangeSequence',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='seat_change_sequence', serialize=False, to='events.event', verbose_name='イベント')),
+                ('value', models.IntegerField(default=0, verbose_name='シーケンス値')),
+            ],
+            options={
+                'verbose_name': '座席変更シーケンス',
+                'verbose_name_plural': '座席変更シーケンス',
+                'db_table': 'seat_change_sequences',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='eventseat',
+            index=models.Index(fields=['event', 'version'], name='idx_evseats_event_version'),
+        ),
+    ]
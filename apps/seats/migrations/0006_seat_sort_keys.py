@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+
+def populate_sort_keys(apps, schema_editor):
+    """既存の座席の並び順キーを計算する"""
+    from apps.seats.models import seat_sort_key
+
+    Seat = apps.get_model('seats', 'Seat')
+    batch = []
+    for seat in Seat.objects.only('id', 'row', 'number').iterator(chunk_size=2000):
+        seat.row_sort = seat_sort_key(seat.row)
+        seat.number_sort = seat_sort_key(seat.number)
+        batch.append(seat)
+        if len(batch) >= 2000:
+            Seat.objects.bulk_update(batch, ['row_sort', 'number_sort'])
+            batch = []
+    if batch:
+        Seat.objects.bulk_update(batch, ['row_sort', 'number_sort'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_initial'),
+        ('seats', '0005_seat_change_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seat',
+            name='row_sort',
+            field=models.IntegerField(default=0, editable=False, verbose_name='列の並び順'),
+        ),
+        migrations.AddField(
+            model_name='seat',
+            name='number_sort',
+            field=models.IntegerField(default=0, editable=False, verbose_name='番号の並び順'),
+        ),
+        migrations.RunPython(populate_sort_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='seat',
+            index=models.Index(
+                fields=['venue', 'block', 'row_sort', 'row', 'number_sort', 'number'],
+                name='idx_seats_layout_order'
+            ),
+        ),
+    ]
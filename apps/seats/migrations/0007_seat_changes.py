@@ -0,0 +1,48 @@
+# Generated by Django 5.1.5 on 2026-10-18 02:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def reset_versions(apps, schema_editor):
+    """イベントごとのシーケンス値だったversionを座席変更IDと比較できるよう0に戻す"""
+    EventSeat = apps.get_model('seats', 'EventSeat')
+    EventSeat.objects.exclude(version=0).update(version=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0006_event_waiting_room_rate'),
+        ('seats', '0006_seat_sort_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventseat',
+            name='version',
+            field=models.BigIntegerField(default=0, verbose_name='バージョン'),
+        ),
+        migrations.CreateModel(
+            name='SeatChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='記録日時')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_changes', to='events.event', verbose_name='イベント')),
+            ],
+            options={
+                'verbose_name': '座席変更',
+                'verbose_name_plural': '座席変更',
+                'db_table': 'seat_changes',
+            },
+        ),
+        migrations.DeleteModel(
+            name='SeatChangeSequence',
+        ),
+        migrations.RunPython(reset_versions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='seatchange',
+            index=models.Index(fields=['event', 'id'], name='idx_seat_changes_event_id'),
+        ),
+    ]
@@ -1,16 +1,53 @@
 from django.db import models
-from apps.events.models import Venue
+from django.utils import timezone
+from apps.events.models import Venue, Event
 from apps.members.models import User
 
 
-class Seat(models.Model):
-    """座席モデル"""
+# 並び順キー: 数字 < アルファベット < その他 の順に並ぶ整数（同じキーの中は文字列順）
+SORT_KEY_ALPHA_BASE = 1_000_000_000
+SORT_KEY_OTHER = 2_000_000_000
+
+
+def row_label_to_index(label):
+    """アルファベットの列名を番号に変換する（A=1, Z=26, AA=27）"""
+    index = 0
+    for char in label.upper():
+        index = index * 26 + ord(char) - ord('A') + 1
+    return index
+
+
+def index_to_row_label(index):
+    """番号をアルファベットの列名に変換する（1=A, 26=Z, 27=AA）"""
+    label = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        label = chr(ord('A') + remainder) + label
+    return label
+
+
+def seat_sort_key(value):
+    """
+    列・番号の並び順キーを計算する
     
-    STATUS_CHOICES = [
-        ('available', '空席'),
-        ('reserved', '予約中'),
-        ('sold', '売約済'),
-    ]
+    数字は数値順（"2" < "10"）、アルファベットは列名順（"Z" < "AA"）に並ぶ整数を返す。
+    
+    Args:
+        value: 列または番号 (str)
+    
+    Returns:
+        int: 並び順キー
+    """
+    value = value.strip()
+    if value.isascii() and value.isdigit():
+        return min(int(value), SORT_KEY_ALPHA_BASE - 1)
+    if value.isascii() and value.isalpha():
+        return min(SORT_KEY_ALPHA_BASE + row_label_to_index(value), SORT_KEY_OTHER - 1)
+    return SORT_KEY_OTHER
+
+
+class Seat(models.Model):
+    """座席モデル（会場の座席配置）"""
     
     SEAT_TYPE_CHOICES = [
         ('S', 'S席'),
@@ -26,31 +63,105 @@ class Seat(models.Model):
     number = models.CharField('番号', max_length=10)
     seat_type = models.CharField('座席種別', max_length=1, choices=SEAT_TYPE_CHOICES)
     
+    # 並び順キー（登録時に列・番号から計算）
+    row_sort = models.IntegerField('列の並び順', default=0, editable=False)
+    number_sort = models.IntegerField('番号の並び順', default=0, editable=False)
+    
+    # タイムスタンプ
+    created_at = models.DateTimeField('登録日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+    
+    # 座席配置順（idx_seats_layout_order の列順と一致させること）
+    LAYOUT_ORDER = ['block', 'row_sort', 'row', 'number_sort', 'number']
+    
+    class Meta:
+        db_table = 'seats'
+        verbose_name = '座席'
+        verbose_name_plural = '座席'
+        unique_together = [['venue', 'block', 'row', 'number']]
+        indexes = [
+            models.Index(
+                fields=['venue', 'block', 'row_sort', 'row', 'number_sort', 'number'],
+                name='idx_seats_layout_order'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.venue.name} {self.block}-{self.row}-{self.number}"
+    
+    def save(self, *args, **kwargs):
+        self.set_sort_keys()
+        super().save(*args, **kwargs)
+    
+    def set_sort_keys(self):
+        """列・番号から並び順キーを設定（bulk_createする場合は呼び出し側で実行）"""
+        self.row_sort = seat_sort_key(self.row)
+        self.number_sort = seat_sort_key(self.number)
+        return self
+
+
+class EventSeat(models.Model):
+    """イベント別座席在庫モデル（座席の販売状態はイベント単位で管理）"""
+    
+    STATUS_CHOICES = [
+        ('available', '空席'),
+        ('reserved', '予約中'),
+        ('sold', '売約済'),
+    ]
+    
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='event_seats', verbose_name='イベント')
+    seat = models.ForeignKey(Seat, on_delete=models.CASCADE, related_name='event_seats', verbose_name='座席')
+    
     # ステータス
     status = models.CharField('ステータス', max_length=20, choices=STATUS_CHOICES, default='available')
     
     # 仮予約情報
-    reserved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, 
-                                     related_name='reserved_seats', verbose_name='仮予約者')
+    reserved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='reserved_event_seats', verbose_name='仮予約者')
     reserved_at = models.DateTimeField('仮予約日時', null=True, blank=True)
     
-    # 楽観的ロック用
-    version = models.IntegerField('バージョン', default=0)
+    # 楽観的ロック用（最後の変更の座席変更ID）
+    version = models.BigIntegerField('バージョン', default=0)
     
     # タイムスタンプ
     created_at = models.DateTimeField('登録日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
     
     class Meta:
-        db_table = 'seats'
-        verbose_name = '座席'
-        verbose_name_plural = '座席'
-        unique_together = [['venue', 'block', 'row', 'number']]
+        db_table = 'event_seats'
+        verbose_name = 'イベント座席'
+        verbose_name_plural = 'イベント座席'
+        unique_together = [['event', 'seat']]
         indexes = [
-            models.Index(fields=['venue', 'status'], name='idx_seats_venue_status'),
-            models.Index(fields=['status', 'reserved_at'], name='idx_seats_status_reserved_at'),
+            models.Index(fields=['event', 'status'], name='idx_evseats_event_status'),
+            models.Index(fields=['status', 'reserved_at'], name='idx_evseats_status_reserved_at'),
+            models.Index(fields=['event', 'version'], name='idx_evseats_event_version'),
         ]
     
     def __str__(self):
-        return f"{self.venue.name} {self.block}-{self.row}-{self.number}"
+        return f"{self.event.name} {self.seat.block}-{self.seat.row}-{self.seat.number}"
+
 
+class SeatChange(models.Model):
+    """
+    座席変更の記録（追記のみ。座席マップ差分取得のカーソル）
+    
+    IDはデータベースの連番で、行ロックを取らずに採番する。採番順とコミット順は一致しないため、
+    差分のカーソルは十分に時間の経った（コミット済みと見なせる）変更までしか進めない。
+    保持期間を過ぎた行は prune_seat_changes で定期的に削除する。
+    """
+    
+    id = models.BigAutoField(primary_key=True)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='seat_changes', verbose_name='イベント')
+    created_at = models.DateTimeField('記録日時', default=timezone.now)
+    
+    class Meta:
+        db_table = 'seat_changes'
+        verbose_name = '座席変更'
+        verbose_name_plural = '座席変更'
+        indexes = [
+            models.Index(fields=['event', 'id'], name='idx_seat_changes_event_id'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_id}: {self.pk}"
@@ -0,0 +1,232 @@
+"""
+座席ステータス変更の配信（Pub/Sub）
+
+座席の状態変更はrecord_seat_changesから1箇所で publish_seat_changes に渡され、
+イベントごとのチャンネルで購読中のクライアント（SSE）へ配信される。
+
+ブローカーは設定 SEAT_EVENTS_BROKER で切り替える:
+    - 'memory': プロセス内ブローカー（単一ノード・テスト用）
+    - 'redis':  Redis Pub/Sub（複数ノード用、SEAT_EVENTS_REDIS_URL に接続）
+
+どちらのブローカーも、購読者ごとのメッセージはプロセス内のキュー（QueueSubscription）に積む。
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from django.conf import settings
+
+
+CHANNEL_NAME = 'seats:event:{event_id}'
+
+# 購読者ごとのキュー上限（超えた場合は再同期を要求）
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# 配信が追いつかなかった購読者に送るメッセージ
+RESYNC = {'resync': True}
+
+# Redisとの接続が切れた場合に再接続を試みる間隔（秒）
+REDIS_RECONNECT_SECONDS = 1
+
+logger = logging.getLogger(__name__)
+
+
+class QueueSubscription:
+    """購読（ブローカーが受信したメッセージをプロセス内のキューに積む）"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def offer(self, message):
+        """イベントループ上でメッセージをキューに積む"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # 取りこぼしが発生するため、溜まった分を捨てて再同期させる
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self, timeout=None):
+        """
+        メッセージを受信する
+
+        Returns:
+            dict: メッセージ（タイムアウト時はNone）
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        await self.broker.unsubscribe(self)
+
+
+class InMemoryBroker:
+    """プロセス内ブローカー（単一ノード・テスト用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            # 公開側は同期ビュー（別スレッド）から呼ばれるため、購読側のループに委譲する
+            subscription.loop.call_soon_threadsafe(subscription.offer, message)
+
+    async def subscribe(self, channel):
+        subscription = QueueSubscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+
+class RedisBroker:
+    """
+    Redis Pub/Subブローカー（複数ノード用）
+
+    購読はプロセス内の1つのPub/Sub接続にまとめ、チャンネルごとに最初の購読者が来たときだけ
+    Redisに購読を依頼する。受信したメッセージは1つのタスクで購読者ごとのキューに配るため、
+    SSEの接続数によらずRedisへの購読の接続はプロセスごとに1つになる。
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+        self._lock = threading.Lock()
+        # 購読側（イベントループ上でのみ使う）
+        self._loop = None
+        self._pubsub = None
+        self._listener = None
+        self._subscribe_lock = None
+        self._subscriptions = defaultdict(set)
+
+    def _get_client(self):
+        import redis
+        with self._lock:
+            if self._client is None:
+                self._client = redis.Redis.from_url(self.url)
+            return self._client
+
+    def publish(self, channel, message):
+        self._get_client().publish(channel, json.dumps(message))
+
+    def _get_pubsub(self):
+        """実行中のイベントループのPub/Sub接続を取得（ループが替わった場合は作り直す）"""
+        import redis.asyncio
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._pubsub = redis.asyncio.Redis.from_url(self.url).pubsub()
+            self._listener = None
+            self._subscribe_lock = asyncio.Lock()
+            self._subscriptions = defaultdict(set)
+        return self._pubsub
+
+    async def subscribe(self, channel):
+        pubsub = self._get_pubsub()
+        subscription = QueueSubscription(self, channel)
+        async with self._subscribe_lock:
+            if not self._subscriptions[channel]:
+                await pubsub.subscribe(channel)
+            self._subscriptions[channel].add(subscription)
+            if self._listener is None:
+                self._listener = asyncio.create_task(self._listen(pubsub))
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        if self._loop is not subscription.loop:
+            return
+        async with self._subscribe_lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.channel]
+                await self._pubsub.unsubscribe(subscription.channel)
+
+    async def _listen(self, pubsub):
+        """受信したメッセージを購読者のキューに配る"""
+        import redis
+        while True:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+            except (redis.ConnectionError, redis.TimeoutError):
+                # 再接続すると購読中のチャンネルは再購読される。それまでの取りこぼしは再同期させる
+                logger.warning('座席ステータス変更の購読が切断されました。再接続します')
+                self._offer_all(RESYNC)
+                await asyncio.sleep(REDIS_RECONNECT_SECONDS)
+                continue
+            except Exception:
+                logger.exception('座席ステータス変更の受信に失敗しました')
+                self._offer_all(RESYNC)
+                await asyncio.sleep(REDIS_RECONNECT_SECONDS)
+                continue
+            if message is None:
+                continue
+            channel = message['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            data = json.loads(message['data'])
+            for subscription in list(self._subscriptions.get(channel, ())):
+                subscription.offer(data)
+
+    def _offer_all(self, message):
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in list(subscriptions):
+                subscription.offer(message)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """設定に応じたブローカーを取得（プロセス内で1つ）"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            backend = getattr(settings, 'SEAT_EVENTS_BROKER', 'memory')
+            if backend == 'redis':
+                _broker = RedisBroker(settings.SEAT_EVENTS_REDIS_URL)
+            elif backend == 'memory':
+                _broker = InMemoryBroker()
+            else:
+                raise ValueError(f'不明なブローカーです: {backend}')
+        return _broker
+
+
+def publish_seat_changes(event_id, cursor, changes):
+    """
+    座席ステータス変更を配信する
+
+    Args:
+        event_id: イベントID
+        cursor: 座席変更ID
+        changes: [[seat_id, status], ...]
+    """
+    get_broker().publish(CHANNEL_NAME.format(event_id=event_id), {
+        'cursor': cursor,
+        'changes': changes,
+    })
+
+
+async def subscribe_seat_changes(event_id):
+    """イベントの座席ステータス変更を購読する"""
+    return await get_broker().subscribe(CHANNEL_NAME.format(event_id=event_id))
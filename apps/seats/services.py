@@ -1,4 +1,37 @@
-from apps.seats.models import Seat
+import base64
+import hashlib
+import logging
+import time
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from apps.seats.models import Seat, EventSeat, SeatChange, row_label_to_index, index_to_row_label
+from apps.seats.pubsub import publish_seat_changes
+
+
+logger = logging.getLogger(__name__)
+
+
+EVENT_SEAT_BATCH_SIZE = 1000
+
+# 座席インデックス・空席ビットマップのキャッシュ
+SEAT_INDEX_CACHE_KEY = 'seats:index:{venue_id}'
+AVAILABILITY_CACHE_KEY = 'seats:availability:{event_id}:{generation}'
+VENUE_LAYOUT_CACHE_KEY = 'seats:layout:{venue_id}'
+SEAT_STATUS_CACHE_KEY = 'seats:status:{event_id}:{generation}'
+# 空席ビットマップ・座席ステータスのキャッシュの世代（座席ステータスの変更をコミットするたびに進める）
+SEAT_GENERATION_CACHE_KEY = 'seats:generation:{event_id}'
+SEAT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# 座席マップ差分の上限（超える場合は全量スナップショットを返す）
+SEAT_DELTA_MAX_CHANGES = 2000
+# 差分のカーソルを進める変更の経過秒数（これより新しい変更より前に採番され、後からコミットされる変更を取りこぼさない）
+SEAT_CHANGE_SETTLE_SECONDS = 5
+# 座席変更の保持期間と削除のバッチサイズ（保持期間より古いカーソルにはスナップショットを返す）
+SEAT_CHANGE_RETENTION_MINUTES = 60
+SEAT_CHANGE_PRUNE_BATCH_SIZE = 5000
 
 
 def generate_seats(venue, block, seat_type, row_start, row_end, number_start, number_end):
@@ -20,14 +53,16 @@ def generate_seats(venue, block, seat_type, row_start, row_end, number_start, nu
     seats_to_create = []
     
     # 列の範囲を生成
-    # 数字の場合は数値範囲、文字の場合はアルファベット範囲
+    # 数字の場合は数値範囲、文字の場合はアルファベット範囲（Z の次は AA）
     if row_start.isdigit() and row_end.isdigit():
         rows = [str(i) for i in range(int(row_start), int(row_end) + 1)]
+    elif row_start.isalpha() and row_end.isalpha() and row_start.isascii() and row_end.isascii():
+        rows = [
+            index_to_row_label(i)
+            for i in range(row_label_to_index(row_start), row_label_to_index(row_end) + 1)
+        ]
     else:
-        # アルファベット範囲 (A-Z)
-        start_ord = ord(row_start.upper())
-        end_ord = ord(row_end.upper())
-        rows = [chr(i) for i in range(start_ord, end_ord + 1)]
+        raise ValueError('開始列と終了列は数字同士またはアルファベット同士で指定してください')
     
     # 座席を生成
     for row in rows:
@@ -38,20 +73,64 @@ def generate_seats(venue, block, seat_type, row_start, row_end, number_start, nu
                 row=row,
                 number=str(number),
                 seat_type=seat_type,
-                status='available'
-            )
+            ).set_sort_keys()
             seats_to_create.append(seat)
     
     # 一括作成
     created_seats = Seat.objects.bulk_create(seats_to_create, ignore_conflicts=True)
+    refresh_venue_seats(venue)
     
     return created_seats
 
 
+def refresh_venue_seats(venue):
+    """
+    会場の座席を追加した後の後処理
+    
+    座席インデックスのキャッシュを破棄し、販売中のイベントには追加した座席の在庫を作成する。
+    
+    Args:
+        venue: Venueオブジェクト
+    """
+    invalidate_seat_index(venue.pk)
+    for event in venue.events.filter(status='on_sale'):
+        open_event_seats(event)
+
+
+def open_event_seats(event):
+    """
+    イベントの座席在庫（EventSeat）を一括作成する
+    
+    販売開始時に呼び出す。作成済みの座席はスキップするため、何度呼び出しても安全。
+    
+    Args:
+        event: Eventオブジェクト
+    
+    Returns:
+        int: 新たに作成した在庫の件数
+    """
+    existing_seat_ids = set(
+        EventSeat.objects.filter(event=event).values_list('seat_id', flat=True)
+    )
+    seat_ids = Seat.objects.filter(venue_id=event.venue_id).values_list('id', flat=True)
+    
+    event_seats = [
+        EventSeat(event=event, seat_id=seat_id)
+        for seat_id in seat_ids
+        if seat_id not in existing_seat_ids
+    ]
+    EventSeat.objects.bulk_create(event_seats, batch_size=EVENT_SEAT_BATCH_SIZE, ignore_conflicts=True)
+    invalidate_availability(event.pk)
+    
+    return len(event_seats)
+
+
 def get_seat_map(event, ticket_type):
     """
     座席選択UI用のデータを取得
     
+    会場の座席配置（キャッシュ済み）に、イベントの座席ステータスを重ね合わせて返す。
+    
     Args:
         event: Eventオブジェクト
         ticket_type: TicketTypeオブジェクト
@@ -59,33 +138,76 @@ def get_seat_map(event, ticket_type):
     Returns:
         dict: 座席データ（ブロック・列・番号でグループ化）
     """
-    # イベントの会場の座席を取得
-    seats = Seat.objects.filter(
-        venue=event.venue
-    ).select_related('venue').order_by('block', 'row', 'number')
+    layout = get_venue_layout(event.venue_id)
+    statuses = get_seat_status_overlay(event)
     
-    # 座席データをグループ化
     seat_map = {}
-    for seat in seats:
-        block = seat.block
-        if block not in seat_map:
-            seat_map[block] = {}
-        
-        row = seat.row
-        if row not in seat_map[block]:
-            seat_map[block][row] = []
-        
-        seat_map[block][row].append({
-            'id': seat.id,
-            'number': seat.number,
-            'seat_type': seat.seat_type,
-            'status': seat.status,
-            'price': ticket_type.price,
-        })
+    for block, rows in layout['blocks'].items():
+        seat_map[block] = {
+            row: [
+                {
+                    'id': seat_id,
+                    'number': number,
+                    'seat_type': seat_type,
+                    'status': statuses.get(seat_id, 'available'),
+                    'price': ticket_type.price,
+                }
+                for seat_id, number, seat_type in seats
+            ]
+            for row, seats in rows.items()
+        }
     
     return seat_map
 
 
+def get_venue_layout(venue_id):
+    """
+    会場の座席配置（ブロック→列→座席）を取得（キャッシュ）
+    
+    座席インデックス（座席配置順）から組み立てるためDBは参照しない。座席の追加・削除で
+    インデックスのバージョンが変わると再構築される。
+    
+    Args:
+        venue_id: 会場ID
+    
+    Returns:
+        dict: {
+            'index_version': 座席インデックスのバージョン,
+            'blocks': {block: {row: [(id, number, seat_type), ...]}}
+        }
+    """
+    key = VENUE_LAYOUT_CACHE_KEY.format(venue_id=venue_id)
+    seat_index = get_seat_index(venue_id)
+    layout = cache.get(key)
+    if layout is None or layout['index_version'] != seat_index['version']:
+        blocks = {}
+        for seat_id, block, row, number, seat_type in seat_index['seats']:
+            blocks.setdefault(block, {}).setdefault(row, []).append((seat_id, number, seat_type))
+        layout = {
+            'index_version': seat_index['version'],
+            'blocks': blocks,
+        }
+        cache.set(key, layout, SEAT_CACHE_TIMEOUT)
+    return layout
+
+
+def get_seat_status_overlay(event):
+    """
+    イベントの座席ステータス（空席以外）を取得（キャッシュ）
+    
+    Returns:
+        dict: {seat_id: status}（含まれない座席は空席）
+    """
+    key = SEAT_STATUS_CACHE_KEY.format(event_id=event.pk, generation=get_availability_generation(event.pk))
+    statuses = cache.get(key)
+    if statuses is None:
+        statuses = dict(
+            EventSeat.objects.filter(event=event).exclude(status='available').values_list('seat_id', 'status')
+        )
+        cache.set(key, statuses, SEAT_CACHE_TIMEOUT)
+    return statuses
+
+
 def get_available_seats_json(event, ticket_type):
     """
     Ajax用の座席データをJSON形式で返す
@@ -97,23 +219,271 @@ def get_available_seats_json(event, ticket_type):
     Returns:
         list: 座席データのリスト
     """
-    seats = Seat.objects.filter(
-        venue=event.venue,
-        status='available'
-    ).order_by('block', 'row', 'number')
+    seat_index = get_seat_index(event.venue_id)
+    statuses = get_seat_status_overlay(event)
+    seat_type_display = dict(Seat.SEAT_TYPE_CHOICES)
     
+    # 座席インデックスは座席配置順のため並べ替えは不要
     seats_data = []
-    for seat in seats:
+    for seat_id, block, row, number, seat_type in seat_index['seats']:
+        if seat_id in statuses:
+            continue
         seats_data.append({
-            'id': seat.id,
-            'block': seat.block,
-            'row': seat.row,
-            'number': seat.number,
-            'seat_type': seat.seat_type,
-            'seat_type_display': seat.get_seat_type_display(),
-            'status': seat.status,
+            'id': seat_id,
+            'block': block,
+            'row': row,
+            'number': number,
+            'seat_type': seat_type,
+            'seat_type_display': seat_type_display[seat_type],
+            'status': 'available',
             'price': float(ticket_type.price),
-            'label': f"{seat.block}-{seat.row}-{seat.number}",
+            'label': f"{block}-{row}-{number}",
         })
     
     return seats_data
+
+
+def get_seat_index(venue_id):
+    """
+    会場の座席インデックスを取得（キャッシュ）
+    
+    座席配置順（ブロック→列→番号、数字は数値順）に並べた座席一覧で、
+    リスト内の位置が空席ビットマップのビット位置に対応する。
+    座席の追加・削除がない限り変わらないため、クライアント側でもversionをキーにキャッシュできる。
+    
+    Args:
+        venue_id: 会場ID
+    
+    Returns:
+        dict: {
+            'version': インデックスのバージョン,
+            'seats': [[id, block, row, number, seat_type], ...]
+        }
+    """
+    key = SEAT_INDEX_CACHE_KEY.format(venue_id=venue_id)
+    seat_index = cache.get(key)
+    if seat_index is None:
+        seats = [
+            list(values)
+            for values in Seat.objects.filter(venue_id=venue_id).order_by(*Seat.LAYOUT_ORDER).values_list(
+                'id', 'block', 'row', 'number', 'seat_type'
+            )
+        ]
+        digest = hashlib.sha1(','.join(str(seat[0]) for seat in seats).encode()).hexdigest()
+        seat_index = {
+            'version': digest[:16],
+            'seats': seats,
+        }
+        cache.set(key, seat_index, SEAT_CACHE_TIMEOUT)
+    return seat_index
+
+
+def invalidate_seat_index(venue_id):
+    """座席インデックスのキャッシュを破棄（座席の追加・削除時、座席配置も再構築される）"""
+    transaction.on_commit(lambda: cache.delete(SEAT_INDEX_CACHE_KEY.format(venue_id=venue_id)))
+
+
+def get_availability_bitmap(event):
+    """
+    イベントの空席ビットマップを取得（キャッシュ）
+    
+    ビットiが1の場合、座席インデックスのi番目の座席が空席。
+    ビットはバイト内で下位ビットから詰める（i番目 = bytes[i // 8] の (i % 8) ビット目）。
+    
+    Args:
+        event: Eventオブジェクト
+    
+    Returns:
+        dict: {
+            'index_version': 対応する座席インデックスのバージョン,
+            'version': ビットマップのバージョン,
+            'count': 座席数,
+            'bitmap': bytes
+        }
+    """
+    key = AVAILABILITY_CACHE_KEY.format(event_id=event.pk, generation=get_availability_generation(event.pk))
+    seat_index = get_seat_index(event.venue_id)
+    availability = cache.get(key)
+    if availability is None or availability['index_version'] != seat_index['version']:
+        availability = build_availability_bitmap(event, seat_index)
+        cache.set(key, availability, SEAT_CACHE_TIMEOUT)
+    return availability
+
+
+def build_availability_bitmap(event, seat_index):
+    """空席ビットマップをDBから構築"""
+    positions = {seat[0]: i for i, seat in enumerate(seat_index['seats'])}
+    bits = bytearray((len(positions) + 7) // 8)
+    
+    available_seat_ids = EventSeat.objects.filter(
+        event=event,
+        status='available'
+    ).values_list('seat_id', flat=True)
+    for seat_id in available_seat_ids.iterator():
+        i = positions.get(seat_id)
+        if i is not None:
+            bits[i >> 3] |= 1 << (i & 7)
+    
+    bitmap = bytes(bits)
+    return {
+        'index_version': seat_index['version'],
+        'version': hashlib.sha1(bitmap).hexdigest()[:16],
+        'count': len(positions),
+        'bitmap': bitmap,
+    }
+
+
+def encode_bitmap(bitmap):
+    """ビットマップをbase64文字列に変換"""
+    return base64.b64encode(bitmap).decode('ascii')
+
+
+def get_availability_generation(event_id):
+    """
+    空席ビットマップ・座席ステータスのキャッシュの世代を取得
+    
+    キャッシュのキーに世代を含め、DBを読む前に世代を取得する。DBを読んでからキャッシュに書くまでの間に
+    座席ステータスの変更がコミットされても、古い内容は破棄済みの世代のキーに書かれるため読まれない。
+    世代がキャッシュから消えた場合は、以前の世代と重ならないよう現在時刻から採番し直す。
+    
+    Args:
+        event_id: イベントID
+    
+    Returns:
+        int: 世代
+    """
+    key = SEAT_GENERATION_CACHE_KEY.format(event_id=event_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def invalidate_availability(event_id):
+    """空席ビットマップ・座席ステータスのキャッシュを破棄（座席ステータス変更時、コミット後に世代を進める）"""
+    def advance_generation():
+        try:
+            cache.incr(SEAT_GENERATION_CACHE_KEY.format(event_id=event_id))
+        except ValueError:
+            # 世代が未採番の場合は、次に読むときに新しい世代で採番される
+            pass
+    
+    transaction.on_commit(advance_generation)
+
+
+def record_seat_changes(event_id, seat_ids):
+    """
+    座席ステータスの変更を記録する
+    
+    座席変更（SeatChange）を1行追加し、変更した座席のversionにそのIDを設定する。
+    IDはデータベースの連番で採番し、行ロックを取らないため、同じイベントの購入が並行してもここで待たない。
+    ステータス更新と同じトランザクションの最後に呼び出すこと（採番からコミットまでを短くする）。
+    
+    Args:
+        event_id: イベントID
+        seat_ids: ステータスを変更した座席IDのリスト
+    
+    Returns:
+        int: 座席変更ID（変更がない場合はNone）
+    """
+    seat_ids = list(seat_ids)
+    if not seat_ids:
+        return None
+    
+    with transaction.atomic():
+        change = SeatChange.objects.create(event_id=event_id)
+        changed_seats = EventSeat.objects.filter(event_id=event_id, seat_id__in=seat_ids)
+        changed_seats.update(version=change.pk)
+        changes = [list(change) for change in changed_seats.values_list('seat_id', 'status')]
+    
+    invalidate_availability(event_id)
+    transaction.on_commit(lambda: broadcast_seat_changes(event_id, change.pk, changes))
+    return change.pk
+
+
+def broadcast_seat_changes(event_id, cursor, changes):
+    """座席ステータス変更を購読中のクライアントへ配信（失敗してもリクエストは成功させる）"""
+    try:
+        publish_seat_changes(event_id, cursor, changes)
+    except Exception:
+        logger.exception('座席ステータス変更の配信に失敗しました: event_id=%s', event_id)
+
+
+def get_seat_changes(event, cursor=None, now=None):
+    """
+    座席マップの差分を取得する
+    
+    cursorより後に変更された座席のみを返す。cursorが未指定・不正、保持している最古の座席変更より前
+    （prune_seat_changes で削除済み）、または差分が多すぎる場合は、空席以外の全座席を
+    スナップショットとして返す（スナップショットに含まれない座席は空席）。
+    
+    座席変更IDの順序はコミット順と一致しないため、返すカーソルは SEAT_CHANGE_SETTLE_SECONDS 以上
+    前の変更（それより前に採番された変更はすべてコミット済み）までしか進めない。それより新しい変更は
+    次回も返すため、クライアントは差分を冪等に適用すること（ステータスは変更後の値なので再適用してよい）。
+    
+    Args:
+        event: Eventオブジェクト
+        cursor: クライアントが最後に受け取ったカーソル (int or None)
+        now: 取得日時（テスト用）
+    
+    Returns:
+        dict: {
+            'cursor': 次回リクエストで送るカーソル,
+            'snapshot': スナップショットかどうか,
+            'changes': [[seat_id, status], ...]
+        }
+    """
+    now = now or timezone.now()
+    # 先にカーソルを読む（この値以下の変更はすべてコミット済み）
+    changes = SeatChange.objects.filter(event=event).order_by('-id').values_list('id', flat=True)
+    settled = changes.filter(created_at__lte=now - timedelta(seconds=SEAT_CHANGE_SETTLE_SECONDS)).first() or 0
+    latest = changes.first() or 0
+    oldest = changes.last() or 0
+    
+    if cursor is not None and oldest <= cursor <= latest:
+        changes = list(
+            EventSeat.objects.filter(
+                event=event,
+                version__gt=cursor
+            ).values_list('seat_id', 'status')[:SEAT_DELTA_MAX_CHANGES + 1]
+        )
+        if len(changes) <= SEAT_DELTA_MAX_CHANGES:
+            return {
+                'cursor': max(cursor, settled),
+                'snapshot': False,
+                'changes': [list(change) for change in changes],
+            }
+    
+    changes = EventSeat.objects.filter(event=event).exclude(status='available').values_list('seat_id', 'status')
+    return {
+        'cursor': settled,
+        'snapshot': True,
+        'changes': [list(change) for change in changes],
+    }
+
+
+def prune_seat_changes(now=None):
+    """
+    保持期間を過ぎた座席変更を削除する（Celery beatで定期実行）
+    
+    イベントごとに最新の座席変更は残す（カーソルの上限・確定済みの位置が0に戻らないようにする）。
+    削除した範囲のカーソルを送ってきたクライアントには、get_seat_changes がスナップショットを返す。
+    
+    Args:
+        now: 基準日時（テスト用）
+    
+    Returns:
+        int: 削除した座席変更の件数
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(minutes=SEAT_CHANGE_RETENTION_MINUTES)
+    latest_ids = SeatChange.objects.values('event_id').annotate(latest=Max('id')).values('latest')
+    expired = SeatChange.objects.filter(created_at__lt=cutoff).exclude(id__in=latest_ids)
+    
+    deleted = 0
+    while True:
+        ids = list(expired.order_by('id').values_list('id', flat=True)[:SEAT_CHANGE_PRUNE_BATCH_SIZE])
+        if not ids:
+            return deleted
+        deleted += SeatChange.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,20 @@
+"""座席関連のシグナル"""
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from apps.events.models import Event
+from .services import open_event_seats
+
+
+@receiver(post_save, sender=Event)
+def open_seats_for_on_sale_event(sender, instance, update_fields=None, **kwargs):
+    """
+    販売中のイベントの保存後に座席在庫（EventSeat）を作成
+    
+    管理画面・管理コマンド・シェルなど、保存の経路によらず販売中のイベントには在庫がそろうようにする。
+    ステータスを含まない update_fields 指定の保存では、販売状態が変わらないため何もしない。
+    """
+    if instance.status != 'on_sale':
+        return
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    open_event_seats(instance)
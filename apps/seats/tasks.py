@@ -0,0 +1,17 @@
+"""座席関連のCeleryタスク"""
+import logging
+from celery import shared_task
+from apps.core.tasks import TimedTask
+from .services import prune_seat_changes
+
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(base=TimedTask)
+def prune_seat_changes_task():
+    """保持期間を過ぎた座席変更を削除（Celery beatで定期実行）"""
+    deleted = prune_seat_changes()
+    if deleted:
+        logger.info('座席変更を削除しました: deleted=%s', deleted)
+    return deleted
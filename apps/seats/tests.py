@@ -1,3 +1,582 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.events.models import Venue, Event, TicketType
+from apps.organizers.models import Organizer
+from apps.seats.models import Seat, EventSeat, SeatChange, seat_sort_key
+from apps.seats import importers, services
+from apps.seats.pubsub import RedisBroker
+from apps.seats.allocation import (
+    allocate_best_seats, find_best_seats, SeatAllocationError, AVAILABLE_RUNS_CACHE_KEY,
+)
+from apps.seats.services import (
+    generate_seats, open_event_seats, get_seat_map, get_available_seats_json,
+    get_seat_index, get_availability_bitmap, invalidate_availability,
+    record_seat_changes, get_seat_changes, prune_seat_changes, SEAT_CHANGE_SETTLE_SECONDS,
+    SEAT_CHANGE_RETENTION_MINUTES,
+)
+
+User = get_user_model()
+
+# おまかせ座席割当の1回の探索時間の上限（ミリ秒）
+FIND_BEST_SEATS_BUDGET_MS = 10
+
+
+class SeatTestMixin:
+    """座席テスト用の共通データ"""
+    
+    def setUp(self):
+        cache.clear()
+        organizer_user = User.objects.create_user(username='organizer', password='testpass123')
+        self.organizer = Organizer.objects.create(
+            user=organizer_user,
+            organization_name='テスト主催者',
+            role='admin'
+        )
+        self.venue = Venue.objects.create(name='テスト会場', address='東京都渋谷区', capacity=100)
+        generate_seats(self.venue, 'A', 'S', '1', '2', 1, 5)
+        
+        now = timezone.now()
+        self.event = self.create_event('イベント1', now + timedelta(days=1))
+        self.other_event = self.create_event('イベント2', now + timedelta(days=2))
+        self.ticket_type = TicketType.objects.create(
+            event=self.event,
+            name='S席',
+            type='reserved',
+            price=8000,
+            total_quantity=10
+        )
+    
+    def create_event(self, name, start_datetime):
+        return Event.objects.create(
+            name=name,
+            description='テスト',
+            category='concert',
+            venue=self.venue,
+            organizer=self.organizer,
+            start_datetime=start_datetime,
+            is_public=True,
+            status='on_sale'
+        )
+
+
+class EventSeatInventoryTest(SeatTestMixin, TestCase):
+    """イベント別座席在庫のテスト"""
+    
+    def test_open_event_seats_is_idempotent(self):
+        """在庫作成は会場の座席数分だけ行われ、再実行しても増えない"""
+        EventSeat.objects.filter(event=self.event).delete()
+        self.assertEqual(open_event_seats(self.event), 10)
+        self.assertEqual(open_event_seats(self.event), 0)
+        self.assertEqual(EventSeat.objects.filter(event=self.event).count(), 10)
+    
+    def test_saving_on_sale_event_opens_seats(self):
+        """画面を経由せずに販売中にしたイベントにも在庫が作成される"""
+        self.assertEqual(EventSeat.objects.filter(event=self.event).count(), 10)
+        
+        event = Event.objects.create(
+            name='イベント3', description='テスト', category='concert', venue=self.venue,
+            organizer=self.organizer, start_datetime=timezone.now() + timedelta(days=3)
+        )
+        self.assertFalse(EventSeat.objects.filter(event=event).exists())
+        event.status = 'on_sale'
+        event.save()
+        self.assertEqual(EventSeat.objects.filter(event=event).count(), 10)
+    
+    def test_generate_seats_extends_on_sale_inventory(self):
+        """販売中イベントの会場に座席を追加すると在庫も追加される"""
+        open_event_seats(self.event)
+        generate_seats(self.venue, 'B', 'A', '1', '1', 1, 3)
+        self.assertEqual(EventSeat.objects.filter(event=self.event).count(), 13)
+    
+    def test_status_is_scoped_to_event(self):
+        """同じ会場の別イベントの在庫状態は共有されない"""
+        open_event_seats(self.event)
+        open_event_seats(self.other_event)
+        seat = Seat.objects.get(block='A', row='1', number='1')
+        EventSeat.objects.filter(event=self.event, seat=seat).update(status='sold')
+        
+        available_ids = [s['id'] for s in get_available_seats_json(self.event, self.ticket_type)]
+        other_ids = [s['id'] for s in get_available_seats_json(self.other_event, self.ticket_type)]
+        self.assertNotIn(seat.id, available_ids)
+        self.assertIn(seat.id, other_ids)
+        
+        seat_map = get_seat_map(self.event, self.ticket_type)
+        statuses = {s['id']: s['status'] for s in seat_map['A']['1']}
+        self.assertEqual(statuses[seat.id], 'sold')
+
+
+class SeatLayoutImportTest(SeatTestMixin, TestCase):
+    """座席配置ファイルインポートのテスト"""
+    
+    CSV = (
+        '\ufeffblock,row,number,seat_type\n'
+        'A,1,1,S\n'       # 登録済み
+        'C,12,1,A\n'
+        'C,12,2,A\n'
+        'C,12,2,A\n'      # ファイル内の重複
+        'C,13,1,X\n'      # 不正な座席種別
+        'C,,2,A\n'        # 列が空
+    )
+    
+    def test_csv_import_reports_created_and_skipped(self):
+        """登録件数・スキップ件数・不正行が報告され、販売中イベントの在庫も作成される"""
+        open_event_seats(self.event)
+        result = importers.import_seat_layout(self.venue, BytesIO(self.CSV.encode()), 'csv', chunk_size=1)
+        
+        self.assertEqual(result['total'], 6)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['skipped'], 2)
+        self.assertEqual(result['invalid'], 2)
+        self.assertEqual(len(result['errors']), 2)
+        self.assertIn('6行目', result['errors'][0])
+        self.assertEqual(Seat.objects.filter(venue=self.venue, block='C').count(), 2)
+        self.assertEqual(EventSeat.objects.filter(event=self.event).count(), 12)
+        self.assertEqual(len(get_seat_index(self.venue.pk)['seats']), 12)
+    
+    def test_json_array_is_read_incrementally(self):
+        """JSON配列は読み込み単位をまたいでも要素ごとに取り込める"""
+        seats = [{'block': 'D', 'row': row, 'number': number, 'seat_type': 'B'} for row in range(1, 4) for number in range(1, 6)]
+        data = json.dumps(seats, indent=2).encode()
+        with mock.patch.object(importers, 'JSON_READ_SIZE', 16):
+            result = importers.import_seat_layout(self.venue, BytesIO(data), 'json')
+        self.assertEqual(result['created'], 15)
+        self.assertEqual(Seat.objects.get(venue=self.venue, block='D', row='3', number='5').seat_type, 'B')
+    
+    def test_broken_file_imports_nothing(self):
+        """ファイルが途中で壊れている場合は何も登録しない"""
+        data = b'{"block": "E", "row": "1", "number": "1", "seat_type": "S"}\n{"block": '
+        with self.assertRaises(importers.SeatImportError):
+            importers.import_seat_layout(self.venue, BytesIO(data), 'jsonl')
+        self.assertFalse(Seat.objects.filter(venue=self.venue, block='E').exists())
+    
+    def test_generate_seats_supports_multi_letter_rows(self):
+        """アルファベットの列はZの次がAAとして生成される"""
+        generate_seats(self.venue, 'F', 'A', 'Y', 'AB', 1, 1)
+        rows = set(Seat.objects.filter(venue=self.venue, block='F').values_list('row', flat=True))
+        self.assertEqual(rows, {'Y', 'Z', 'AA', 'AB'})
+    
+    def test_import_from_view(self):
+        """座席一括登録画面からファイルを取り込める"""
+        self.client.force_login(self.organizer.user)
+        response = self.client.post(
+            reverse('seats:seat_bulk_create', args=[self.venue.pk]),
+            {'layout_file': SimpleUploadedFile('layout.csv', self.CSV.encode())}
+        )
+        self.assertRedirects(response, reverse('seats:seat_list', args=[self.venue.pk]))
+        self.assertEqual(Seat.objects.filter(venue=self.venue, block='C').count(), 2)
+    
+    def test_import_command(self):
+        """管理コマンドから取り込める"""
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False, encoding='utf-8') as f:
+            f.write('{"block": "G", "row": "1", "number": "1", "seat_type": "S"}\n')
+            f.write('{"block": "G", "row": "1", "number": "2", "seat_type": "S"}\n')
+        self.addCleanup(os.remove, f.name)
+        
+        out = StringIO()
+        call_command('import_seats', str(self.venue.pk), f.name, stdout=out)
+        self.assertIn('登録 2件', out.getvalue())
+        self.assertEqual(Seat.objects.filter(venue=self.venue, block='G').count(), 2)
+
+
+class SeatAvailabilityBitmapTest(SeatTestMixin, TestCase):
+    """空席ビットマップのテスト"""
+    
+    def test_bitmap_matches_seat_index(self):
+        """ビット位置が座席インデックスの位置に対応する"""
+        open_event_seats(self.event)
+        seat_index = get_seat_index(self.venue.pk)
+        sold_seat_id = seat_index['seats'][3][0]
+        EventSeat.objects.filter(event=self.event, seat_id=sold_seat_id).update(status='sold')
+        
+        availability = get_availability_bitmap(self.event)
+        bits = availability['bitmap']
+        self.assertEqual(availability['count'], 10)
+        self.assertEqual(len(bits), 2)
+        self.assertFalse(bits[0] & (1 << 3))
+        self.assertTrue(bits[0] & (1 << 2))
+        self.assertTrue(bits[1] & (1 << 1))
+        self.assertFalse(bits[1] & (1 << 2))
+    
+    def test_bitmap_is_cached_until_invalidated(self):
+        """キャッシュ済みのビットマップはDBを参照せず、破棄後に再構築される"""
+        open_event_seats(self.event)
+        first = get_availability_bitmap(self.event)
+        EventSeat.objects.filter(event=self.event).update(status='sold')
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(get_availability_bitmap(self.event)['version'], first['version'])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_availability(self.event.pk)
+        self.assertEqual(get_availability_bitmap(self.event)['bitmap'], bytes(2))
+    
+    def test_stale_fill_is_not_served_after_invalidation(self):
+        """DBを読んでからキャッシュに書くまでにコミットされた変更は、次の取得に反映される"""
+        open_event_seats(self.event)
+        build = services.build_availability_bitmap
+        
+        def build_then_sell(event, seat_index):
+            availability = build(event, seat_index)
+            with self.captureOnCommitCallbacks(execute=True):
+                EventSeat.objects.filter(event=self.event).update(status='sold')
+                invalidate_availability(self.event.pk)
+            return availability
+        
+        with mock.patch.object(services, 'build_availability_bitmap', side_effect=build_then_sell):
+            self.assertNotEqual(get_availability_bitmap(self.event)['bitmap'], bytes(2))
+        self.assertEqual(get_availability_bitmap(self.event)['bitmap'], bytes(2))
+    
+    def test_availability_view_etag(self):
+        """同じバージョンの再取得は304を返す"""
+        open_event_seats(self.event)
+        url = reverse('seats:seat_availability', args=[self.event.pk, self.ticket_type.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 10)
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class SeatMapLayoutTest(SeatTestMixin, TestCase):
+    """座席配置キャッシュとステータス重ね合わせのテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        open_event_seats(self.event)
+    
+    def test_seat_map_is_served_from_cache(self):
+        """キャッシュ済みの座席マップはDBを参照しない"""
+        get_seat_map(self.event, self.ticket_type)
+        with self.assertNumQueries(0):
+            seat_map = get_seat_map(self.event, self.ticket_type)
+        self.assertEqual(list(seat_map['A']), ['1', '2'])
+        self.assertEqual(len(seat_map['A']['1']), 5)
+    
+    def test_status_overlay_follows_changes(self):
+        """座席ステータスの変更はコミット後に反映される"""
+        seat = Seat.objects.get(block='A', row='2', number='3')
+        get_seat_map(self.event, self.ticket_type)
+        with self.captureOnCommitCallbacks(execute=True):
+            EventSeat.objects.filter(event=self.event, seat=seat).update(status='reserved')
+            record_seat_changes(self.event.pk, [seat.pk])
+        
+        seat_map = get_seat_map(self.event, self.ticket_type)
+        statuses = {s['id']: s['status'] for s in seat_map['A']['2']}
+        self.assertEqual(statuses[seat.pk], 'reserved')
+    
+    def test_layout_is_rebuilt_after_seat_delete(self):
+        """座席削除後は座席配置が再構築される"""
+        get_seat_map(self.event, self.ticket_type)
+        seat = Seat.objects.get(block='A', row='1', number='1')
+        self.client.force_login(self.organizer.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('seats:seat_delete', args=[seat.pk]))
+        
+        seat_map = get_seat_map(self.event, self.ticket_type)
+        self.assertEqual(len(seat_map['A']['1']), 4)
+    
+    def test_index_is_invalidated_after_seat_delete(self):
+        """座席インデックスのキャッシュは座席を削除してから破棄する（削除前の座席で作り直さない）"""
+        seat = Seat.objects.get(block='A', row='1', number='1')
+        deleted = []
+        self.client.force_login(self.organizer.user)
+        with mock.patch(
+            'apps.seats.services.invalidate_seat_index',
+            side_effect=lambda venue_id: deleted.append(not Seat.objects.filter(pk=seat.pk).exists()),
+        ):
+            self.client.post(reverse('seats:seat_delete', args=[seat.pk]))
+        self.assertEqual(deleted, [True])
+
+
+class SeatLayoutOrderTest(SeatTestMixin, TestCase):
+    """座席の並び順（並び順キー）のテスト"""
+    
+    def test_sort_keys(self):
+        """数字は数値順、アルファベットは列名順、数字がアルファベットより前"""
+        keys = [seat_sort_key(value) for value in ['1', '2', '10', 'A', 'Z', 'AA', 'A-1']]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+    
+    def test_seats_are_ordered_naturally(self):
+        """座席インデックス・空席一覧・座席一覧は "2" を "10" より前に並べる"""
+        generate_seats(self.venue, 'B', 'A', '1', '10', 1, 10)
+        expected = [(row, number) for row in range(1, 11) for number in range(1, 11)]
+        
+        index_seats = [(int(row), int(number)) for _, block, row, number, _ in get_seat_index(self.venue.pk)['seats'] if block == 'B']
+        self.assertEqual(index_seats, expected)
+        
+        available = [(int(s['row']), int(s['number'])) for s in get_available_seats_json(self.event, self.ticket_type) if s['block'] == 'B']
+        self.assertEqual(available, expected)
+        
+        seat_map = get_seat_map(self.event, self.ticket_type)
+        self.assertEqual(list(seat_map['B']), [str(row) for row in range(1, 11)])
+        
+        self.client.force_login(self.organizer.user)
+        response = self.client.get(reverse('seats:seat_list', args=[self.venue.pk]))
+        listed = [(seat.row, seat.number) for seat in response.context['seats'] if seat.block == 'B']
+        self.assertEqual(listed[9:12], [('1', '10'), ('2', '1'), ('2', '2')])
+    
+    def test_alphabetic_rows_follow_z_with_aa(self):
+        """アルファベットの列は Z の後に AA が並ぶ"""
+        generate_seats(self.venue, 'C', 'B', 'Y', 'AB', 1, 1)
+        rows = list(get_seat_map(self.event, self.ticket_type)['C'])
+        self.assertEqual(rows, ['Y', 'Z', 'AA', 'AB'])
+
+
+class SeatChangesTest(SeatTestMixin, TestCase):
+    """座席マップ差分のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        open_event_seats(self.event)
+        self.seat_ids = list(Seat.objects.order_by('id').values_list('id', flat=True))
+    
+    def change_status(self, seat_ids, status):
+        EventSeat.objects.filter(event=self.event, seat_id__in=seat_ids).update(status=status)
+        return record_seat_changes(self.event.pk, seat_ids)
+    
+    def settled(self):
+        """変更がコミット済みと見なせる日時"""
+        return timezone.now() + timedelta(seconds=SEAT_CHANGE_SETTLE_SECONDS)
+    
+    def test_initial_request_returns_snapshot(self):
+        """カーソルなしの場合は空席以外のスナップショットを返す"""
+        change_id = self.change_status(self.seat_ids[:2], 'sold')
+        result = get_seat_changes(self.event, now=self.settled())
+        self.assertTrue(result['snapshot'])
+        self.assertEqual(result['cursor'], change_id)
+        self.assertCountEqual(result['changes'], [[self.seat_ids[0], 'sold'], [self.seat_ids[1], 'sold']])
+    
+    def test_delta_contains_only_changes_after_cursor(self):
+        """カーソル以降に変更された座席のみ返す"""
+        cursor = self.change_status(self.seat_ids[:2], 'reserved')
+        self.change_status([self.seat_ids[1]], 'available')
+        last = self.change_status([self.seat_ids[5]], 'reserved')
+        
+        result = get_seat_changes(self.event, cursor, now=self.settled())
+        self.assertFalse(result['snapshot'])
+        self.assertEqual(result['cursor'], last)
+        self.assertCountEqual(result['changes'], [[self.seat_ids[1], 'available'], [self.seat_ids[5], 'reserved']])
+        
+        self.assertEqual(get_seat_changes(self.event, result['cursor'])['changes'], [])
+    
+    def test_cursor_waits_for_recent_changes(self):
+        """直近の変更はカーソルを進めずに返し、後からコミットされる前の番号の変更を取りこぼさない"""
+        cursor = self.change_status([self.seat_ids[0]], 'sold')
+        SeatChange.objects.filter(pk=cursor).update(created_at=timezone.now() - timedelta(minutes=1))
+        recent = self.change_status([self.seat_ids[1]], 'reserved')
+        
+        result = get_seat_changes(self.event, 0)
+        self.assertEqual(result['cursor'], cursor)
+        self.assertCountEqual(result['changes'], [[self.seat_ids[0], 'sold'], [self.seat_ids[1], 'reserved']])
+        self.assertEqual(get_seat_changes(self.event, result['cursor'])['changes'], [[self.seat_ids[1], 'reserved']])
+        self.assertEqual(get_seat_changes(self.event, result['cursor'], now=self.settled())['cursor'], recent)
+    
+    def test_invalid_cursor_falls_back_to_snapshot(self):
+        """未来のカーソルはスナップショットになる"""
+        change_id = self.change_status([self.seat_ids[0]], 'sold')
+        result = get_seat_changes(self.event, change_id + 100)
+        self.assertTrue(result['snapshot'])
+        self.assertEqual(result['changes'], [[self.seat_ids[0], 'sold']])
+    
+    def test_pruned_cursor_falls_back_to_snapshot(self):
+        """保持期間を過ぎて削除された座席変更のカーソルはスナップショットになる"""
+        old = self.change_status([self.seat_ids[0]], 'sold')
+        kept = self.change_status([self.seat_ids[1]], 'reserved')
+        latest = self.change_status([self.seat_ids[2]], 'reserved')
+        expired = timezone.now() - timedelta(minutes=SEAT_CHANGE_RETENTION_MINUTES + 1)
+        SeatChange.objects.filter(pk__in=[old, latest]).update(created_at=expired)
+        
+        # 最新の座席変更は保持期間を過ぎても残す
+        self.assertEqual(prune_seat_changes(), 1)
+        self.assertEqual(list(SeatChange.objects.order_by('id').values_list('id', flat=True)), [kept, latest])
+        
+        result = get_seat_changes(self.event, old, now=self.settled())
+        self.assertTrue(result['snapshot'])
+        self.assertEqual(result['cursor'], latest)
+        self.assertEqual(len(result['changes']), 3)
+        
+        result = get_seat_changes(self.event, kept, now=self.settled())
+        self.assertFalse(result['snapshot'])
+        self.assertEqual(result['changes'], [[self.seat_ids[2], 'reserved']])
+
+
+class SeatStreamTest(SeatTestMixin, TestCase):
+    """座席ステータス変更のプッシュ配信のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        open_event_seats(self.event)
+        self.seat_id = Seat.objects.order_by('id').values_list('id', flat=True).first()
+    
+    def reserve_seat(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            EventSeat.objects.filter(event=self.event, seat_id=self.seat_id).update(status='reserved')
+            record_seat_changes(self.event.pk, [self.seat_id])
+    
+    async def test_stream_sends_snapshot_then_changes(self):
+        """接続時にスナップショット、以降は変更を配信する"""
+        response = await self.async_client.get(reverse('seats:seat_stream', args=[self.event.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        
+        first = (await anext(stream)).decode()
+        self.assertIn('"snapshot": true', first)
+        
+        await sync_to_async(self.reserve_seat)()
+        second = (await anext(stream)).decode()
+        self.assertTrue(second.startswith('id: 0\n'))
+        data = json.loads(second.split('data: ', 1)[1])
+        self.assertEqual(data['changes'], [[self.seat_id, 'reserved']])
+        await stream.aclose()
+
+
+
+class FakePubSub:
+    """Redis Pub/Subの接続の代わり（購読・購読解除の依頼を記録し、受信するメッセージを積む）"""
+    
+    def __init__(self):
+        self.commands = []
+        self.messages = asyncio.Queue()
+    
+    async def subscribe(self, channel):
+        self.commands.append(('subscribe', channel))
+    
+    async def unsubscribe(self, channel):
+        self.commands.append(('unsubscribe', channel))
+    
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        return await self.messages.get()
+
+
+class RedisBrokerTest(SimpleTestCase):
+    """Redis Pub/Subブローカーのテスト"""
+    
+    async def test_subscribers_share_one_connection(self):
+        """購読者はプロセス内の1つの接続を共有し、チャンネルの購読はRedisに1回だけ依頼する"""
+        pubsub = FakePubSub()
+        broker = RedisBroker('redis://localhost:6379/0')
+        with mock.patch('redis.asyncio.Redis.from_url') as from_url:
+            from_url.return_value.pubsub.return_value = pubsub
+            first = await broker.subscribe('seats:event:1')
+            second = await broker.subscribe('seats:event:1')
+            other = await broker.subscribe('seats:event:2')
+        self.assertEqual(from_url.call_count, 1)
+        self.assertEqual(pubsub.commands, [('subscribe', 'seats:event:1'), ('subscribe', 'seats:event:2')])
+        
+        await pubsub.messages.put({'channel': b'seats:event:1', 'data': json.dumps({'cursor': 3, 'changes': []})})
+        self.assertEqual(await first.get(timeout=1), {'cursor': 3, 'changes': []})
+        self.assertEqual(await second.get(timeout=1), {'cursor': 3, 'changes': []})
+        self.assertIsNone(await other.get(timeout=0.01))
+        
+        await first.close()
+        await second.close()
+        await other.close()
+        self.assertEqual(pubsub.commands[2:], [('unsubscribe', 'seats:event:1'), ('unsubscribe', 'seats:event:2')])
+        broker._listener.cancel()
+
+class BestAvailableTest(SeatTestMixin, TestCase):
+    """おまかせ座席割当のテスト"""
+    
+    def setUp(self):
+        super().setUp()
+        open_event_seats(self.event)
+        self.customer = User.objects.create_user(username='customer', password='testpass123')
+    
+    def seat_labels(self, seat_ids):
+        seats = Seat.objects.in_bulk(seat_ids)
+        return [f"{seats[i].row}-{seats[i].number}" for i in seat_ids]
+    
+    def test_prefers_front_row_center(self):
+        """最前列の中央に近い並びを選ぶ"""
+        self.assertEqual(self.seat_labels(find_best_seats(self.event, 3)), ['1-2', '1-3', '1-4'])
+    
+    def test_skips_rows_without_enough_contiguous_seats(self):
+        """連続した空席が足りない列は飛ばす"""
+        EventSeat.objects.filter(event=self.event, seat__row='1', seat__number='3').update(status='sold')
+        self.assertEqual(self.seat_labels(find_best_seats(self.event, 3)), ['2-2', '2-3', '2-4'])
+    
+    def test_excluded_seats_split_runs(self):
+        """除外した座席をまたがない並びを選ぶ"""
+        excluded = set(EventSeat.objects.filter(
+            event=self.event, seat__row='1', seat__number='3'
+        ).values_list('seat_id', flat=True))
+        self.assertEqual(self.seat_labels(find_best_seats(self.event, 2, excluded=excluded)), ['1-1', '1-2'])
+    
+    def test_find_best_seats_within_budget(self):
+        """5万席の会場でも1回の探索が数ミリ秒で終わる"""
+        blocks = {
+            f'B{block}': {
+                str(row): [(block * 10000 + row * 100 + number, str(number), 'S') for number in range(1, 51)]
+                for row in range(1, 51)
+            }
+            for block in range(20)
+        }
+        # 前方の半分の列は売約済み
+        statuses = {
+            seat_id: 'sold' for rows in blocks.values() for row, seats in rows.items() if int(row) <= 25
+            for seat_id, number, seat_type in seats
+        }
+        with mock.patch('apps.seats.allocation.get_venue_layout', return_value={'blocks': blocks}), \
+                mock.patch('apps.seats.allocation.get_seat_status_overlay', return_value=statuses):
+            cache.delete(AVAILABLE_RUNS_CACHE_KEY.format(event_id=self.event.pk))
+            self.assertEqual(find_best_seats(self.event, 4), [2624, 2625, 2626, 2627])
+        
+            calls = 50
+            started = time.perf_counter()
+            for _ in range(calls):
+                find_best_seats(self.event, 4, seat_types=['A', 'S'])
+            elapsed_ms = (time.perf_counter() - started) * 1000 / calls
+        self.assertLess(elapsed_ms, FIND_BEST_SEATS_BUDGET_MS)
+    
+    def test_allocation_retries_on_conflict(self):
+        """キャッシュより先に他の購入者が確保した座席は除外して再試行する"""
+        find_best_seats(self.event, 2)
+        EventSeat.objects.filter(event=self.event, seat__row='1').update(status='sold')
+        
+        event_seats = allocate_best_seats(self.event, self.customer, 2)
+        self.assertEqual([e.seat.row for e in event_seats], ['2', '2'])
+        self.assertTrue(all(e.status == 'reserved' and e.reserved_by == self.customer for e in event_seats))
+        self.assertEqual(self.customer.carts.get().items.count(), 2)
+    
+    def test_allocation_fails_when_no_seats(self):
+        """条件に合う座席がない場合はエラー"""
+        with self.assertRaises(SeatAllocationError):
+            allocate_best_seats(self.event, self.customer, 6)
+    
+    def test_best_available_view(self):
+        """APIで確保した座席がカートに入る"""
+        self.client.force_login(self.customer)
+        response = self.client.post(
+            reverse('seats:best_available', args=[self.event.pk, self.ticket_type.pk]),
+            data=json.dumps({'quantity': 2, 'seat_types': ['S']}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s['label'] for s in response.json()['seats']], ['A-1-2', 'A-1-3'])
+    
+    def test_best_available_view_rejects_malformed_filters(self):
+        """リストでないブロック・座席種別の指定は400を返す"""
+        self.client.force_login(self.customer)
+        url = reverse('seats:best_available', args=[self.event.pk, self.ticket_type.pk])
+        for data in ({'quantity': 2, 'blocks': 'A'}, {'quantity': 2, 'seat_types': 'S'}, [2]):
+            response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(EventSeat.objects.filter(event=self.event, status='reserved').exists())
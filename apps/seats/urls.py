@@ -8,4 +8,9 @@ urlpatterns = [
     path('<int:venue_id>/create/', views.SeatBulkCreateView.as_view(), name='seat_bulk_create'),
     path('delete/<int:pk>/', views.SeatDeleteView.as_view(), name='seat_delete'),
     path('select/<int:event_id>/<int:ticket_type_id>/', views.SeatSelectionView.as_view(), name='seat_selection'),
+    path('select/<int:event_id>/<int:ticket_type_id>/availability/', views.SeatAvailabilityView.as_view(), name='seat_availability'),
+    path('select/<int:event_id>/<int:ticket_type_id>/best-available/', views.BestAvailableView.as_view(), name='best_available'),
+    path('select/<int:event_id>/changes/', views.SeatChangesView.as_view(), name='seat_changes'),
+    path('select/<int:event_id>/stream/', views.SeatStreamView.as_view(), name='seat_stream'),
+    path('index/<int:venue_id>/', views.SeatIndexView.as_view(), name='seat_index'),
 ]
@@ -1,12 +1,14 @@
+import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import ListView, DeleteView
 from django.views import View
 from django.urls import reverse_lazy
 from django.contrib import messages
+from apps.core.pagination import KeysetPaginationMixin
 from apps.events.models import Venue
 from .models import Seat
-from .forms import SeatBulkCreateForm
+from .forms import SeatBulkCreateForm, SeatImportForm
 from .services import generate_seats
 
 
@@ -19,10 +21,16 @@ class SeatBulkCreateView(LoginRequiredMixin, View):
         return render(request, 'seats/seat_creation.html', {
             'venue': venue,
             'form': form,
+            'import_form': SeatImportForm(),
         })
     
     def post(self, request, venue_id):
         venue = get_object_or_404(Venue, pk=venue_id)
+        
+        # 座席配置ファイルのインポート
+        if 'layout_file' in request.FILES:
+            return self.import_layout(request, venue)
+        
         form = SeatBulkCreateForm(request.POST)
         
         if form.is_valid():
@@ -44,19 +52,56 @@ class SeatBulkCreateView(LoginRequiredMixin, View):
         return render(request, 'seats/seat_creation.html', {
             'venue': venue,
             'form': form,
+            'import_form': SeatImportForm(),
+        })
+    
+    def import_layout(self, request, venue):
+        from .importers import import_seat_layout, SeatImportError
+        
+        import_form = SeatImportForm(request.POST, request.FILES)
+        
+        if import_form.is_valid():
+            try:
+                result = import_seat_layout(
+                    venue,
+                    import_form.cleaned_data['layout_file'],
+                    import_form.cleaned_data['file_format'],
+                )
+                messages.success(
+                    request,
+                    f"{result['created']}件の座席を登録しました。"
+                    f"（登録済みのためスキップ: {result['skipped']}件）"
+                )
+                if result['invalid']:
+                    messages.warning(
+                        request,
+                        f"不正な行が{result['invalid']}件あったため登録しませんでした: "
+                        + ' / '.join(result['errors'])
+                    )
+                return redirect('seats:seat_list', venue_id=venue.pk)
+            except SeatImportError as e:
+                messages.error(request, f'座席配置ファイルを取り込めませんでした: {str(e)}')
+        
+        return render(request, 'seats/seat_creation.html', {
+            'venue': venue,
+            'form': SeatBulkCreateForm(),
+            'import_form': import_form,
         })
 
 
-class SeatListView(LoginRequiredMixin, ListView):
+class SeatListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """座席一覧ビュー"""
     model = Seat
     template_name = 'seats/seat_list.html'
     context_object_name = 'seats'
     paginate_by = 100
+    # 会場内では座席配置順が一意（ブロック・列・番号のユニーク制約）
+    keyset_ordering = Seat.LAYOUT_ORDER
+    keyset_count = 'approximate'
     
     def get_queryset(self):
         venue_id = self.kwargs.get('venue_id')
-        return Seat.objects.filter(venue_id=venue_id).order_by('block', 'row', 'number')
+        return Seat.objects.filter(venue_id=venue_id).order_by(*Seat.LAYOUT_ORDER)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -74,8 +119,12 @@ class SeatDeleteView(LoginRequiredMixin, DeleteView):
         return reverse_lazy('seats:seat_list', kwargs={'venue_id': self.object.venue.pk})
     
     def form_valid(self, form):
+        from .services import invalidate_seat_index
+        response = super().form_valid(form)
+        # 削除の後に破棄する（先に破棄すると、削除前の座席でインデックスが作り直される）
+        invalidate_seat_index(self.object.venue_id)
         messages.success(self.request, '座席を削除しました。')
-        return super().form_valid(form)
+        return response
 
 
 
@@ -100,3 +149,197 @@ class SeatSelectionView(View):
             'event': event,
             'ticket_type': ticket_type,
         })
+
+
+class BestAvailableView(LoginRequiredMixin, View):
+    """おまかせ座席割当API（並んで座れる最良の座席を確保してカートに追加）"""
+    
+    def post(self, request, event_id, ticket_type_id):
+        from apps.events.models import Event, TicketType
+        from django.http import JsonResponse
+        from apps.orders.cart_store import get_cart_store
+        from .allocation import allocate_best_seats, SeatAllocationError
+        
+        event = get_object_or_404(Event, pk=event_id, is_public=True)
+        ticket_type = get_object_or_404(TicketType, pk=ticket_type_id, event=event, type='reserved')
+        
+        try:
+            data = json.loads(request.body)
+            quantity = int(data.get('quantity', 1))
+            seat_types = data.get('seat_types') or None
+            blocks = data.get('blocks') or None
+            if not all(value is None or isinstance(value, list) for value in (seat_types, blocks)):
+                raise ValueError('seat_types・blocksはリストで指定してください')
+        except (ValueError, TypeError, AttributeError):
+            return JsonResponse({'error': 'Invalid request'}, status=400)
+        
+        try:
+            event_seats = allocate_best_seats(
+                event,
+                request.user,
+                quantity,
+                # 座席種別のあるチケット種別はその座席種別だけから選ぶ
+                seat_types=[ticket_type.seat_type] if ticket_type.seat_type else seat_types,
+                blocks=blocks,
+                ticket_type_id=ticket_type.pk,
+            )
+        except SeatAllocationError as e:
+            return JsonResponse({'error': str(e)}, status=409)
+        
+        cart = get_cart_store().get(request.user.pk)
+        return JsonResponse({
+            'success': True,
+            'expires_at': cart.expires_at.isoformat(),
+            'remaining_seconds': cart.remaining_seconds,
+            'seats': [
+                {
+                    'id': event_seat.seat_id,
+                    'seat_type': event_seat.seat.seat_type,
+                    'label': f"{event_seat.seat.block}-{event_seat.seat.row}-{event_seat.seat.number}",
+                }
+                for event_seat in event_seats
+            ],
+        })
+
+
+class SeatIndexView(View):
+    """座席インデックスAPI（会場単位、クライアントでキャッシュ）"""
+    
+    def get(self, request, venue_id):
+        from django.http import JsonResponse, HttpResponseNotModified
+        from .services import get_seat_index
+        
+        venue = get_object_or_404(Venue, pk=venue_id)
+        seat_index = get_seat_index(venue.pk)
+        etag = f'"{seat_index["version"]}"'
+        
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponseNotModified()
+        
+        response = JsonResponse({
+            'version': seat_index['version'],
+            'fields': ['id', 'block', 'row', 'number', 'seat_type'],
+            'seat_types': dict(Seat.SEAT_TYPE_CHOICES),
+            'seats': seat_index['seats'],
+        })
+        response['ETag'] = etag
+        return response
+
+
+class SeatAvailabilityView(View):
+    """空席ビットマップAPI（イベント単位）"""
+    
+    def get(self, request, event_id, ticket_type_id):
+        from apps.events.models import Event, TicketType
+        from django.http import JsonResponse, HttpResponse, HttpResponseNotModified
+        from .services import get_availability_bitmap, encode_bitmap
+        
+        event = get_object_or_404(Event, pk=event_id, is_public=True)
+        ticket_type = get_object_or_404(TicketType, pk=ticket_type_id, event=event)
+        availability = get_availability_bitmap(event)
+        etag = f'"{availability["index_version"]}-{availability["version"]}"'
+        
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponseNotModified()
+        
+        # バイナリ形式（?format=binary）
+        if request.GET.get('format') == 'binary':
+            response = HttpResponse(availability['bitmap'], content_type='application/octet-stream')
+            response['X-Seat-Index-Version'] = availability['index_version']
+            response['X-Seat-Count'] = availability['count']
+        else:
+            response = JsonResponse({
+                'index_version': availability['index_version'],
+                'version': availability['version'],
+                'count': availability['count'],
+                'price': float(ticket_type.price),
+                'bitmap': encode_bitmap(availability['bitmap']),
+            })
+        response['ETag'] = etag
+        return response
+
+
+class SeatChangesView(View):
+    """座席マップ差分API（cursor以降に変更された座席のみ返す）"""
+    
+    def get(self, request, event_id):
+        from apps.events.models import Event
+        from django.http import JsonResponse
+        from .services import get_seat_changes
+        
+        event = get_object_or_404(Event, pk=event_id, is_public=True)
+        
+        try:
+            cursor = int(request.GET['cursor'])
+        except (KeyError, ValueError):
+            cursor = None
+        
+        return JsonResponse(get_seat_changes(event, cursor))
+
+
+class SeatStreamView(View):
+    """
+    座席ステータス変更のプッシュ配信（Server-Sent Events、ASGIで動作）
+    
+    接続直後に差分（Last-Event-ID がなければスナップショット）を送り、
+    以降は変更が発生するたびに配信する。配信の入れ替わり・取りこぼしを補正するため、
+    SEAT_EVENTS_HEARTBEAT 秒ごとにDBから差分を取得してカーソルを進める。
+    """
+    
+    async def get(self, request, event_id):
+        from apps.events.models import Event
+        from django.http import Http404, StreamingHttpResponse
+        
+        if not await Event.objects.filter(pk=event_id, is_public=True).aexists():
+            raise Http404
+        
+        try:
+            cursor = int(request.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            cursor = None
+        
+        response = StreamingHttpResponse(
+            self.stream(event_id, cursor),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    async def stream(self, event_id, cursor):
+        import asyncio
+        from asgiref.sync import sync_to_async
+        from django.conf import settings
+        from apps.events.models import Event
+        from .pubsub import subscribe_seat_changes, RESYNC
+        from .services import get_seat_changes
+        
+        event = await Event.objects.aget(pk=event_id)
+        loop = asyncio.get_running_loop()
+        
+        # 取りこぼしを防ぐため、購読を開始してから現在の状態を送る
+        subscription = await subscribe_seat_changes(event_id)
+        try:
+            message = RESYNC
+            synced_at = None
+            while True:
+                sent = False
+                if message is not None and message is not RESYNC:
+                    # 配信された変更はそのまま送る（カーソルはコミット済みと確定した位置のまま進めない）
+                    data = {'cursor': cursor, 'snapshot': False, 'changes': message['changes']}
+                    yield f'id: {cursor}\nevent: seats\ndata: {json.dumps(data)}\n\n'
+                    sent = True
+                if message is RESYNC or loop.time() - synced_at >= settings.SEAT_EVENTS_HEARTBEAT:
+                    # 再同期要求、または前回から一定時間経った場合はDBから差分を取得
+                    data = await sync_to_async(get_seat_changes)(event, cursor)
+                    synced_at = loop.time()
+                    if data['snapshot'] or data['changes'] or data['cursor'] != cursor:
+                        cursor = data['cursor']
+                        yield f'id: {cursor}\nevent: seats\ndata: {json.dumps(data)}\n\n'
+                        sent = True
+                if not sent:
+                    # 接続維持用のコメント
+                    yield ': heartbeat\n\n'
+                message = await subscription.get(timeout=settings.SEAT_EVENTS_HEARTBEAT)
+        finally:
+            await subscription.close()
@@ -1,8 +1,18 @@
 from django.db import models
+from apps.core.ids import generate_id
 from apps.orders.models import Order
 from apps.seats.models import Seat
 
 
+# チケット番号の接頭辞（接頭辞 + 時刻順の識別子14文字で16文字）
+TICKET_NUMBER_PREFIX = 'TK'
+
+
+def generate_ticket_number():
+    """チケット番号を生成（時刻順のため、一意インデックスの末尾に追加される）"""
+    return generate_id(TICKET_NUMBER_PREFIX)
+
+
 class Ticket(models.Model):
     """チケットモデル"""
     
@@ -50,8 +60,7 @@ class Ticket(models.Model):
     
     def generate_ticket_number(self):
         """チケット番号を生成"""
-        import uuid
-        return f"TK{uuid.uuid4().hex[:14].upper()}"
+        return generate_ticket_number()
     
     def save(self, *args, **kwargs):
         if not self.ticket_number:
@@ -0,0 +1,275 @@
+"""
+チケットの署名付きペイロード（QRコードの内容）
+
+入場ゲートの端末がサーバーに問い合わせずに、チケットの真正性・対象イベント・入場可能期間を
+確認できるよう、必要な情報と署名をQRコードに含める。端末は入場記録だけを後からサーバーに送る。
+
+形式（バージョン2）:
+    T2.<鍵ID>.<本体40文字>.<署名103文字>
+    - 本体: 次の198ビットを連結してCrockford Base32にしたもの
+        70ビット チケット番号（接頭辞 TK を除いた14文字）
+        32ビット イベントID
+        32ビット 座席ID（自由席は0）
+        32ビット 入場可能期間の開始（UNIX時刻・秒）
+        32ビット 入場可能期間の終了（UNIX時刻・秒）
+    - 署名: 「T2.<鍵ID>.<本体>」のEd25519署名（64バイト）をCrockford Base32にしたもの
+全体が英大文字・数字・記号「.」のみのため、QRコードの英数字モードで描画できる。
+
+署名はEd25519で、秘密鍵はサーバーだけに置き、入場ゲートの端末には公開鍵（export_verification_keys）だけを
+配布する。端末が盗まれても、公開鍵からチケットを偽造することはできない。
+
+秘密鍵は設定 TICKET_SIGNING_KEYS（{鍵ID: 秘密鍵}）で管理し、TICKET_SIGNING_KEY_ID の鍵で署名する。
+鍵を交換する場合は新しい鍵を追加して TICKET_SIGNING_KEY_ID を切り替え、古い鍵の秘密鍵は削除して
+公開鍵を TICKET_VERIFY_KEYS に移す（鍵IDで検証に使う鍵を選ぶため、発行済みのチケットも検証できる）。
+発行済みのチケットが不要になってから TICKET_VERIFY_KEYS からも削除する。
+"""
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from django.conf import settings
+from django.utils import timezone
+from apps.core.ids import ALPHABET, ID_LENGTH, decode, encode
+from apps.tickets.models import TICKET_NUMBER_PREFIX
+
+
+PAYLOAD_VERSION = 'T2'
+SIGNATURE_ALGORITHM = 'Ed25519'
+
+BODY_LENGTH = 40
+SIGNATURE_BYTES = 64
+SIGNATURE_LENGTH = 103
+
+_FIELD_BITS = (
+    ('ticket', 5 * ID_LENGTH),
+    ('event_id', 32),
+    ('seat_id', 32),
+    ('valid_from', 32),
+    ('valid_until', 32),
+)
+
+# イベント開始の何時間前から入場できるか・終了日時がない場合は開始から何時間後まで入場できるか
+ENTRY_OPENS_HOURS = 24
+ENTRY_CLOSES_HOURS = 24
+
+
+class TicketPayloadError(Exception):
+    """ペイロードが不正・対象外・期間外"""
+
+
+class TicketClaims:
+    """ペイロードの内容"""
+
+    def __init__(self, ticket_number, event_id, seat_id, valid_from, valid_until, key_id=None):
+        self.ticket_number = ticket_number
+        self.event_id = event_id
+        self.seat_id = seat_id
+        self.valid_from = valid_from
+        self.valid_until = valid_until
+        self.key_id = key_id
+
+
+@lru_cache(maxsize=16)
+def _load_private_key(value):
+    return Ed25519PrivateKey.from_private_bytes(base64.b64decode(value))
+
+
+@lru_cache(maxsize=16)
+def _load_public_key(value):
+    return Ed25519PublicKey.from_public_bytes(base64.b64decode(value))
+
+
+def _public_key_text(public_key):
+    return base64.b64encode(public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)).decode()
+
+
+def get_signing_keys():
+    """署名の鍵（{鍵ID: Ed25519の秘密鍵}）"""
+    return {key_id: _load_private_key(value) for key_id, value in settings.TICKET_SIGNING_KEYS.items()}
+
+
+def get_verification_keys():
+    """検証の鍵（{鍵ID: Ed25519の公開鍵}。署名の鍵の公開鍵と TICKET_VERIFY_KEYS）"""
+    keys = {key_id: _load_public_key(value) for key_id, value in getattr(settings, 'TICKET_VERIFY_KEYS', {}).items()}
+    keys.update({key_id: private_key.public_key() for key_id, private_key in get_signing_keys().items()})
+    return keys
+
+
+def export_verification_keys():
+    """入場ゲートの端末に配布する公開鍵（{鍵ID: 公開鍵32バイトのBase64}）"""
+    return {key_id: _public_key_text(public_key) for key_id, public_key in get_verification_keys().items()}
+
+
+def _verification_key(keys, key_id):
+    """検証に使う公開鍵（keys は公開鍵または export_verification_keys の値の辞書。未指定時は設定の鍵）"""
+    key = (keys if keys is not None else get_verification_keys()).get(key_id)
+    if isinstance(key, str):
+        try:
+            key = _load_public_key(key)
+        except (binascii.Error, ValueError):
+            return None
+    return key
+
+
+def is_signed_payload(value):
+    """署名付きペイロードの形式か（チケット番号の手入力と区別する）"""
+    return value.startswith(f'{PAYLOAD_VERSION}.')
+
+
+def entry_window(event):
+    """
+    イベントの入場可能期間
+
+    Returns:
+        tuple: (開始日時, 終了日時)
+    """
+    valid_from = event.start_datetime - timedelta(hours=ENTRY_OPENS_HOURS)
+    valid_until = event.end_datetime or event.start_datetime + timedelta(hours=ENTRY_CLOSES_HOURS)
+    return valid_from, valid_until
+
+
+def _sign(message, private_key):
+    return encode(int.from_bytes(private_key.sign(message.encode()), 'big'), SIGNATURE_LENGTH)
+
+
+def _verify(message, signature, public_key):
+    value = decode(signature)
+    if value >> (8 * SIGNATURE_BYTES):
+        return False
+    try:
+        public_key.verify(value.to_bytes(SIGNATURE_BYTES, 'big'), message.encode())
+    except InvalidSignature:
+        return False
+    return True
+
+
+def encode_payload(claims, key_id=None):
+    """
+    ペイロードを作成して署名する
+
+    Args:
+        claims: TicketClaims
+        key_id: 鍵ID（未指定時は TICKET_SIGNING_KEY_ID）
+
+    Returns:
+        str: 署名付きペイロード
+    """
+    key_id = key_id or settings.TICKET_SIGNING_KEY_ID
+    private_key = get_signing_keys()[key_id]
+    values = {
+        'ticket': decode(claims.ticket_number[len(TICKET_NUMBER_PREFIX):]),
+        'event_id': claims.event_id,
+        'seat_id': claims.seat_id or 0,
+        'valid_from': int(claims.valid_from.timestamp()),
+        'valid_until': int(claims.valid_until.timestamp()),
+    }
+    body = 0
+    for name, bits in _FIELD_BITS:
+        if not 0 <= values[name] < 1 << bits:
+            raise ValueError(f'ペイロードに格納できない値です: {name}={values[name]}')
+        body = (body << bits) | values[name]
+    message = f'{PAYLOAD_VERSION}.{key_id}.{encode(body, BODY_LENGTH)}'
+    return f'{message}.{_sign(message, private_key)}'
+
+
+def sign_ticket(ticket, key_id=None):
+    """
+    チケットの署名付きペイロードを作成する
+
+    Args:
+        ticket: Ticketオブジェクト（order.event を参照する）
+        key_id: 鍵ID（未指定時は TICKET_SIGNING_KEY_ID）
+
+    Returns:
+        str: 署名付きペイロード
+    """
+    event = ticket.order.event
+    valid_from, valid_until = entry_window(event)
+    return encode_payload(
+        TicketClaims(ticket.ticket_number, event.pk, ticket.seat_id, valid_from, valid_until),
+        key_id,
+    )
+
+
+def sign_message(message, key_id=None):
+    """
+    任意のデータに署名する（入場ゲートの端末に配布するマニフェストなど）
+
+    Args:
+        message: 署名するバイト列
+        key_id: 鍵ID（未指定時は TICKET_SIGNING_KEY_ID）
+
+    Returns:
+        tuple: (鍵ID, Ed25519署名のBase64)
+    """
+    key_id = key_id or settings.TICKET_SIGNING_KEY_ID
+    return key_id, base64.b64encode(get_signing_keys()[key_id].sign(message)).decode()
+
+
+def verify_message(message, key_id, signature, keys=None):
+    """sign_message の署名を公開鍵で検証する（keys は decode_payload と同じ）"""
+    public_key = _verification_key(keys, key_id)
+    if public_key is None:
+        return False
+    try:
+        public_key.verify(base64.b64decode(signature), message)
+    except (InvalidSignature, binascii.Error, ValueError):
+        return False
+    return True
+
+
+def decode_payload(payload, event_id=None, now=None, keys=None):
+    """
+    ペイロードの署名・対象イベント・入場可能期間を検証して内容を取り出す（DBを参照しない）
+
+    Args:
+        payload: 署名付きペイロード
+        event_id: 入場するイベントのID（指定時は一致しなければエラー）
+        now: 基準日時（指定時は入場可能期間外ならエラー）
+        keys: 検証に使う公開鍵（{鍵ID: 公開鍵}、値は export_verification_keys の形式でもよい。
+              未指定時は get_verification_keys()）
+
+    Returns:
+        TicketClaims: ペイロードの内容
+
+    Raises:
+        TicketPayloadError: 形式・署名が不正、対象のイベントでない、入場可能期間外の場合
+    """
+    parts = payload.strip().upper().split('.')
+    if len(parts) != 4 or parts[0] != PAYLOAD_VERSION:
+        raise TicketPayloadError('QRコードの形式が不正です')
+    version, key_id, body, signature = parts
+    if len(body) != BODY_LENGTH or len(signature) != SIGNATURE_LENGTH or not set(body + signature) <= set(ALPHABET):
+        raise TicketPayloadError('QRコードの形式が不正です')
+
+    public_key = _verification_key(keys, key_id)
+    if public_key is None:
+        raise TicketPayloadError('QRコードの署名鍵が無効です')
+    if not _verify(f'{version}.{key_id}.{body}', signature, public_key):
+        raise TicketPayloadError('QRコードの署名が無効です')
+
+    value = decode(body)
+    values = {}
+    for name, bits in reversed(_FIELD_BITS):
+        values[name] = value & ((1 << bits) - 1)
+        value >>= bits
+    claims = TicketClaims(
+        ticket_number=f'{TICKET_NUMBER_PREFIX}{encode(values["ticket"])}',
+        event_id=values['event_id'],
+        seat_id=values['seat_id'] or None,
+        valid_from=datetime.fromtimestamp(values['valid_from'], tz=dt_timezone.utc),
+        valid_until=datetime.fromtimestamp(values['valid_until'], tz=dt_timezone.utc),
+        key_id=key_id,
+    )
+
+    if event_id is not None and claims.event_id != int(event_id):
+        raise TicketPayloadError('このイベントのチケットではありません')
+    if now is not None:
+        if now < claims.valid_from:
+            raise TicketPayloadError(f'入場開始前です（入場開始: {timezone.localtime(claims.valid_from):%Y年%m月%d日 %H:%M}）')
+        if now > claims.valid_until:
+            raise TicketPayloadError('入場可能期間が終了しています')
+    return claims
@@ -4,13 +4,19 @@
 import qrcode
 import hmac
 import hashlib
-import uuid
+import logging
 from io import BytesIO
 from django.core.files import File
 from django.db import transaction
 from django.conf import settings
-from apps.tickets.models import Ticket
+from apps.tickets.models import Ticket, generate_ticket_number
 from apps.orders.models import Order
+from apps.seats.models import EventSeat
+from apps.seats.services import record_seat_changes
+from apps.tickets.services.signing import sign_ticket
+
+
+logger = logging.getLogger(__name__)
 
 
 class TicketQRService:
@@ -19,7 +25,7 @@ class TicketQRService:
     @staticmethod
     def generate_ticket_number():
         """一意なチケット番号を生成"""
-        return f"TKT{uuid.uuid4().hex[:12].upper()}"
+        return generate_ticket_number()
     
     @staticmethod
     def generate_signature(ticket_number):
@@ -74,23 +80,27 @@ class TicketQRService:
             return False, str(e)
 
 
-def generate_qr_code_image(ticket_number):
+def generate_qr_code_image(ticket):
     """
-    チケット番号からQRコード画像を生成
+    チケットのQRコード画像を生成
+    
+    QRコードの内容は署名付きペイロード（signing.py）のため、入場ゲートの端末は
+    サーバーに問い合わせずに真正性・対象イベント・入場可能期間を確認できる。
     
     Args:
-        ticket_number: チケット番号
+        ticket: Ticketオブジェクト（order.event を参照する）
         
     Returns:
         File: QRコード画像ファイル
     """
     qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
         box_size=10,
         border=4,
     )
-    qr.add_data(ticket_number)
+    # 英大文字・数字・「.」のみのため英数字モードで描画される
+    qr.add_data(sign_ticket(ticket))
     qr.make(fit=True)
     
     img = qr.make_image(fill_color="black", back_color="white")
@@ -99,7 +109,69 @@ def generate_qr_code_image(ticket_number):
     img.save(buffer, format='PNG')
     buffer.seek(0)
     
-    return File(buffer, name=f'{ticket_number}.png')
+    return File(buffer, name=f'{ticket.ticket_number}.png')
+
+
+def issue_tickets(order, seat_ids):
+    """
+    注文のチケットを一括発行する
+    
+    チケットはbulk_createで1文で作成し、QRコードの生成（画像の描画とファイル書き込み）は
+    トランザクションのコミット後にCeleryのタスクとして登録する。
+    座席ロックの保持時間と購入確定の応答時間が枚数に比例しないようにするため。
+    
+    Args:
+        order: Orderオブジェクト
+        seat_ids: 座席IDのリスト（自由席はNone）
+    
+    Returns:
+        list: 発行したチケットのリスト
+    """
+    tickets = [Ticket(order=order, seat_id=seat_id) for seat_id in seat_ids]
+    for ticket in tickets:
+        ticket.ticket_number = ticket.generate_ticket_number()
+    Ticket.objects.bulk_create(tickets)
+    
+    ticket_ids = [ticket.pk for ticket in tickets]
+    transaction.on_commit(lambda: enqueue_ticket_rendering(ticket_ids))
+    return tickets
+
+
+def enqueue_ticket_rendering(ticket_ids):
+    """
+    QRコードの生成をCeleryに登録する
+    
+    登録に失敗しても購入は確定済みのため例外にしない（未生成のチケットは定期処理で生成される）。
+    
+    Args:
+        ticket_ids: チケットIDのリスト
+    """
+    from apps.tickets.tasks import render_ticket_qr_codes_task
+    
+    try:
+        render_ticket_qr_codes_task.delay(ticket_ids)
+    except Exception:
+        logger.exception('QRコード生成タスクを登録できませんでした: ticket_ids=%s', ticket_ids)
+
+
+def render_ticket_qr_codes(ticket_ids):
+    """
+    QRコードが未生成のチケットにQRコード画像を生成する
+    
+    何度呼び出しても生成済みのチケットはスキップする。
+    
+    Args:
+        ticket_ids: チケットIDのリスト
+    
+    Returns:
+        int: 生成した件数
+    """
+    tickets = list(Ticket.objects.select_related('order__event').filter(id__in=ticket_ids, qr_code=''))
+    for ticket in tickets:
+        qr_image = generate_qr_code_image(ticket)
+        ticket.qr_code.save(f'{ticket.ticket_number}.png', qr_image, save=False)
+    Ticket.objects.bulk_update(tickets, ['qr_code'])
+    return len(tickets)
 
 
 @transaction.atomic
@@ -113,31 +185,23 @@ def create_tickets_for_order(order_id):
     Returns:
         list: 生成されたチケットのリスト
     """
-    order = Order.objects.select_related('event').prefetch_related('cart__items__seat').get(id=order_id)
+    order = Order.objects.select_related('event').get(id=order_id)
     
     tickets = []
     
     # カート内の各座席に対してチケットを作成
-    cart = order.user.carts.filter(event=order.event).first()
+    cart = order.user.carts.filter(items__event=order.event).first()
     if cart:
-        for cart_item in cart.items.all():
-            ticket = Ticket.objects.create(
-                order=order,
-                seat=cart_item.seat
-            )
-            
-            # QRコード生成
-            qr_image = generate_qr_code_image(ticket.ticket_number)
-            ticket.qr_code.save(f'{ticket.ticket_number}.png', qr_image, save=True)
-            
-            # 座席ステータスを売約済に更新
-            seat = cart_item.seat
-            seat.status = 'sold'
-            seat.reserved_by = None
-            seat.reserved_at = None
-            seat.save()
-            
-            tickets.append(ticket)
+        seat_ids = list(cart.items.values_list('seat_id', flat=True))
+        tickets = issue_tickets(order, seat_ids)
+        
+        # 座席ステータスを売約済に更新
+        sold_seat_ids = [seat_id for seat_id in seat_ids if seat_id]
+        EventSeat.objects.filter(
+            event_id=order.event_id,
+            seat_id__in=sold_seat_ids
+        ).update(status='sold', reserved_by=None, reserved_at=None)
+        record_seat_changes(order.event_id, sold_seat_ids)
     
     return tickets
 
@@ -150,13 +214,16 @@ def cancel_ticket(ticket_id):
         ticket_id: チケットID
     """
     with transaction.atomic():
-        ticket = Ticket.objects.select_related('seat').get(id=ticket_id)
+        ticket = Ticket.objects.select_related('order').get(id=ticket_id)
         
         # チケットステータスを更新
         ticket.status = 'cancelled'
         ticket.save()
         
         # 座席を空席に戻す
-        if ticket.seat:
-            ticket.seat.status = 'available'
-            ticket.seat.save()
+        if ticket.seat_id:
+            EventSeat.objects.filter(
+                event_id=ticket.order.event_id,
+                seat_id=ticket.seat_id
+            ).update(status='available')
+            record_seat_changes(ticket.order.event_id, [ticket.seat_id])
@@ -0,0 +1,43 @@
+"""チケット関連のCeleryタスク"""
+import logging
+from datetime import timedelta
+from celery import shared_task
+from django.utils import timezone
+from apps.core.tasks import TimedTask
+from .models import Ticket
+from .services.ticket_service import render_ticket_qr_codes
+
+
+logger = logging.getLogger(__name__)
+
+# 購入から一定時間たってもQRコードが未生成のチケットを定期処理で生成する（登録に失敗した場合の補完）
+MISSING_QR_CODE_GRACE_MINUTES = 5
+MISSING_QR_CODE_BATCH_SIZE = 500
+
+
+@shared_task(
+    base=TimedTask,
+    autoretry_for=(OSError,),
+    retry_backoff=True,
+    retry_jitter=True,
+    max_retries=5,
+)
+def render_ticket_qr_codes_task(ticket_ids):
+    """チケットのQRコード画像を生成して保存（購入確定のコミット後に登録）"""
+    return render_ticket_qr_codes(ticket_ids)
+
+
+@shared_task(base=TimedTask)
+def render_missing_qr_codes_task():
+    """QRコードが未生成のまま残ったチケットを生成（Celery beatで定期実行）"""
+    cutoff = timezone.now() - timedelta(minutes=MISSING_QR_CODE_GRACE_MINUTES)
+    ticket_ids = list(
+        Ticket.objects.filter(qr_code='', created_at__lt=cutoff)
+        .exclude(status='cancelled')
+        .order_by('id')
+        .values_list('id', flat=True)[:MISSING_QR_CODE_BATCH_SIZE]
+    )
+    rendered = render_ticket_qr_codes(ticket_ids) if ticket_ids else 0
+    if rendered:
+        logger.warning('未生成のQRコードを生成しました: rendered=%s', rendered)
+    return rendered
@@ -1,3 +1,94 @@
-from django.test import TestCase
+import base64
+from datetime import timedelta
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from apps.tickets.models import generate_ticket_number
+from apps.tickets.services.signing import (
+    TicketClaims, TicketPayloadError, decode_payload, encode_payload, export_verification_keys, sign_message,
+    verify_message,
+)
+
+
+def private_key(seed):
+    """テスト用のEd25519の秘密鍵（32バイトのBase64）"""
+    return base64.b64encode(bytes([seed]) * 32).decode()
+
+
+@override_settings(
+    TICKET_SIGNING_KEYS={'K1': private_key(1), 'K2': private_key(2)}, TICKET_SIGNING_KEY_ID='K1', TICKET_VERIFY_KEYS={}
+)
+class TicketPayloadTest(SimpleTestCase):
+    """チケットの署名付きペイロードのテスト"""
+
+    def setUp(self):
+        now = timezone.now().replace(microsecond=0)
+        self.claims = TicketClaims(generate_ticket_number(), 12, 345, now - timedelta(hours=1), now + timedelta(hours=5))
+
+    def test_round_trip(self):
+        """内容を復元でき、QRコードの英数字モードで描画できる文字だけを使う"""
+        payload = encode_payload(self.claims)
+        self.assertRegex(payload, r'^T2\.K1\.[0-9A-Z]{40}\.[0-9A-Z]{103}$')
+
+        claims = decode_payload(payload, event_id=12, now=timezone.now())
+        self.assertEqual(
+            (claims.ticket_number, claims.event_id, claims.seat_id, claims.valid_from, claims.valid_until, claims.key_id),
+            (self.claims.ticket_number, 12, 345, self.claims.valid_from, self.claims.valid_until, 'K1')
+        )
+        self.claims.seat_id = None
+        self.assertIsNone(decode_payload(encode_payload(self.claims)).seat_id)
+
+    def test_tampered_payload_is_rejected(self):
+        """本体・署名を書き換えたペイロードや形式の違う文字列は拒否する"""
+        payload = encode_payload(self.claims)
+        body = payload.split('.')[2]
+        tampered = payload.replace(body, body[:-1] + ('0' if body[-1] != '0' else '1'))
+        for value in (tampered, payload[:-1] + 'Z' if payload[-1] != 'Z' else payload[:-1] + 'Y', 'T2.K1.abc', self.claims.ticket_number):
+            with self.assertRaises(TicketPayloadError):
+                decode_payload(value)
+
+    def test_key_rotation(self):
+        """鍵IDで検証の鍵を選ぶため、交換後も古い鍵のチケットを公開鍵で検証でき、削除した鍵は拒否する"""
+        public_keys = export_verification_keys()
+        old = encode_payload(self.claims)
+        with self.settings(TICKET_SIGNING_KEY_ID='K2'):
+            new = encode_payload(self.claims)
+            self.assertEqual(decode_payload(old).key_id, 'K1')
+            self.assertEqual(decode_payload(new).key_id, 'K2')
+        
+        with self.settings(TICKET_SIGNING_KEYS={'K2': private_key(2)}):
+            decode_payload(new)
+            with self.assertRaisesMessage(TicketPayloadError, '署名鍵'):
+                decode_payload(old)
+            with self.settings(TICKET_VERIFY_KEYS={'K1': public_keys['K1']}):
+                self.assertEqual(decode_payload(old).key_id, 'K1')
+        with self.settings(TICKET_SIGNING_KEYS={'K1': private_key(3)}):
+            with self.assertRaisesMessage(TicketPayloadError, '署名'):
+                decode_payload(old)
+    
+    def test_gates_verify_with_public_keys_only(self):
+        """入場ゲートの端末は配布された公開鍵だけでQRコードとマニフェストを検証できる"""
+        public_keys = export_verification_keys()
+        self.assertEqual(set(public_keys), {'K1', 'K2'})
+        self.assertFalse({private_key(1), private_key(2)} & set(public_keys.values()))
+        
+        payload = encode_payload(self.claims)
+        self.assertEqual(decode_payload(payload, keys=public_keys).ticket_number, self.claims.ticket_number)
+        with self.assertRaisesMessage(TicketPayloadError, '署名鍵'):
+            decode_payload(payload, keys={'K2': public_keys['K2']})
+        
+        key_id, signature = sign_message(b'{"count":3}')
+        self.assertTrue(verify_message(b'{"count":3}', key_id, signature, keys=public_keys))
+        self.assertFalse(verify_message(b'{"count":4}', key_id, signature, keys=public_keys))
+        self.assertFalse(verify_message(b'{"count":3}', 'K2', signature, keys=public_keys))
+    
+    def test_event_and_window_are_checked_locally(self):
+        """別のイベント・入場可能期間外のチケットは拒否する"""
+        payload = encode_payload(self.claims)
+        with self.assertRaisesMessage(TicketPayloadError, 'このイベント'):
+            decode_payload(payload, event_id=13)
+        with self.assertRaisesMessage(TicketPayloadError, '入場開始前'):
+            decode_payload(payload, now=self.claims.valid_from - timedelta(seconds=1))
+        with self.assertRaisesMessage(TicketPayloadError, '終了'):
+            decode_payload(payload, now=self.claims.valid_until + timedelta(seconds=1))
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import base64
+import hashlib
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -59,6 +61,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'apps.events.middleware.WaitingRoomMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -151,6 +154,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom User Model
 AUTH_USER_MODEL = 'members.User'
 
+# Cache Configuration
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 # Celery Configuration
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -158,6 +169,104 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Tokyo'
+# Trueの場合はワーカーを使わずに登録時にその場で実行する（開発・テスト用）
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+CELERY_TASK_EAGER_PROPAGATES = True
+# ワーカーの異常終了時にタスクを失わないよう、完了後に応答する
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BEAT_SCHEDULE = {
+    'release-expired-seat-holds': {
+        'task': 'apps.orders.tasks.release_expired_holds_task',
+        'schedule': 60.0,
+    },
+    'release-expired-carts': {
+        'task': 'apps.orders.tasks.release_expired_carts_task',
+        'schedule': 60.0,
+    },
+    'resume-cancellation-runs': {
+        'task': 'apps.orders.tasks.resume_cancellation_runs_task',
+        'schedule': 300.0,
+    },
+    'compact-ticket-stock': {
+        'task': 'apps.events.tasks.compact_ticket_stock_task',
+        'schedule': 30.0,
+    },
+    'prune-seat-changes': {
+        'task': 'apps.seats.tasks.prune_seat_changes_task',
+        'schedule': 600.0,
+    },
+    'render-missing-ticket-qr-codes': {
+        'task': 'apps.tickets.tasks.render_missing_qr_codes_task',
+        'schedule': 300.0,
+    },
+}
+
+# 座席の仮予約（カート投入）の保持時間と、期限切れ解放のバッチサイズ
+# カートの有効期限も最初に商品を入れてからこの時間（期限切れのカートは自由席の在庫ごと解放）
+SEAT_HOLD_MINUTES = int(os.getenv('SEAT_HOLD_MINUTES', '10'))
+SEAT_HOLD_RELEASE_BATCH_SIZE = 500
+CART_RELEASE_BATCH_SIZE = 200
+
+# カートの保存先（'db': Cart・CartItemテーブル、'cache': Djangoのキャッシュ。本番ではRedisを使い、追い出しを無効にする）
+CART_STORE = os.getenv('CART_STORE', 'db')
+
+# 決済ゲートウェイ（'stub': 通信せずに承認、'http': PAYMENT_GATEWAY_URL のゲートウェイ）
+PAYMENT_PROVIDER = os.getenv('PAYMENT_PROVIDER', 'stub')
+PAYMENT_GATEWAY_URL = os.getenv('PAYMENT_GATEWAY_URL', '')
+PAYMENT_GATEWAY_API_KEY = os.getenv('PAYMENT_GATEWAY_API_KEY', '')
+# 接続・応答待ちのタイムアウト（秒）と、プロセスごとの接続プールの大きさ
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = 3
+PAYMENT_GATEWAY_READ_TIMEOUT = 10
+PAYMENT_GATEWAY_POOL_SIZE = 20
+# 連続してこの回数失敗するとサーキットブレーカーを開き、指定秒数は通信せずにエラーを返す
+PAYMENT_BREAKER_FAILURE_THRESHOLD = 5
+PAYMENT_BREAKER_RESET_SECONDS = 30
+# 与信の間、仮予約・カートを期限切れにしない時間（秒）
+PAYMENT_HOLD_SECONDS = 120
+
+# 一括キャンセル・返金の1トランザクションの注文数と、1回のCeleryタスクの実行時間（秒）
+CANCELLATION_CHUNK_SIZE = int(os.getenv('CANCELLATION_CHUNK_SIZE', '500'))
+CANCELLATION_TASK_SECONDS = 60
+
+# 冪等キー（Idempotency-Key）の結果の保存期間と、処理中の同じリクエストを待つ時間（秒）
+IDEMPOTENCY_KEY_TTL = 60 * 60
+IDEMPOTENCY_WAIT_SECONDS = 10
+
+# 座席確保の方式
+# 'pessimistic': SELECT ... FOR UPDATE でロックしてから更新
+# 'optimistic':  ロックせずに読み、status・versionの比較付きUPDATEの更新件数で確保を判定
+SEAT_CLAIM_MODE = os.getenv('SEAT_CLAIM_MODE', 'pessimistic')
+
+# 自由席の在庫カウンターのシャード数（同時に購入を処理できる行数）
+TICKET_STOCK_SHARDS = int(os.getenv('TICKET_STOCK_SHARDS', '8'))
+
+# Seat status push (Server-Sent Events)
+# 'memory': プロセス内（単一ノード・テスト）、'redis': Redis Pub/Sub（複数ノード）
+SEAT_EVENTS_BROKER = os.getenv('SEAT_EVENTS_BROKER', 'memory')
+SEAT_EVENTS_REDIS_URL = os.getenv('SEAT_EVENTS_REDIS_URL', CELERY_BROKER_URL)
+SEAT_EVENTS_HEARTBEAT = 15
+
+# 仮想待合室（イベントごとの入場ペースは Event.waiting_room_rate）
+# 'memory': プロセス内（単一ノード・テスト）、'redis': Redis（複数ノード）
+WAITING_ROOM_BACKEND = os.getenv('WAITING_ROOM_BACKEND', 'memory')
+WAITING_ROOM_REDIS_URL = os.getenv('WAITING_ROOM_REDIS_URL', CELERY_BROKER_URL)
+# 入場トークンの有効期間（分）
+WAITING_ROOM_ADMISSION_MINUTES = int(os.getenv('WAITING_ROOM_ADMISSION_MINUTES', '15'))
+
+# チケットのQRコード（署名付きペイロード）・入場ゲートのマニフェストの署名鍵（Ed25519）
+# TICKET_SIGNING_KEYS は「鍵ID:秘密鍵」のカンマ区切り（鍵IDは英大文字・数字、秘密鍵は32バイトのBase64）。
+# 秘密鍵はサーバーだけに置き、入場ゲートの端末には公開鍵（/entries/keys/）だけを配布する
+# 未設定時はSECRET_KEYから導出した鍵（開発用）
+TICKET_SIGNING_KEYS = dict(
+    item.split(':', 1) for item in os.getenv('TICKET_SIGNING_KEYS', '').split(',') if item
+) or {'K1': base64.b64encode(hashlib.sha256(f'ticket-signing:{SECRET_KEY}'.encode()).digest()).decode()}
+# 新しく発行するチケットの署名に使う鍵ID（鍵の交換時に切り替える）
+TICKET_SIGNING_KEY_ID = os.getenv('TICKET_SIGNING_KEY_ID') or next(iter(TICKET_SIGNING_KEYS))
+# 秘密鍵を削除した古い鍵の公開鍵（「鍵ID:公開鍵」のカンマ区切り）。発行済みのチケットの検証に使う
+TICKET_VERIFY_KEYS = dict(
+    item.split(':', 1) for item in os.getenv('TICKET_VERIFY_KEYS', '').split(',') if item
+)
 
 # Email Configuration
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
@@ -10,7 +10,7 @@ from django.utils import timezone
 from datetime import timedelta
 
 from apps.events.models import Venue, Event
-from apps.seats.models import Seat
+from apps.seats.models import Seat, EventSeat
 from apps.tickets.models import Ticket
 from apps.orders.models import Order, Payment
 from apps.entries.models import Entry
@@ -66,8 +66,7 @@ class TestEntryFlow(TestCase):
             block='A',
             row='1',
             number='1',
-            seat_type='reserved',
-            status='available'
+            seat_type='reserved'
         )
         
         # イベント作成（現在時刻から1時間後に開始）
@@ -113,10 +112,12 @@ class TestEntryFlow(TestCase):
             status='valid'
         )
         
-        # 座席を予約済みに更新
-        self.seat.status = 'sold'
-        self.seat.reserved_by = self.customer
-        self.seat.save()
+        # イベントの座席を売約済みに更新
+        EventSeat.objects.create(
+            event=self.event,
+            seat=self.seat,
+            status='sold'
+        )
         
         self.client = Client()
     